@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -90,9 +92,35 @@ DATABASES = {
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        # connections are kept for DB_CONN_MAX_AGE seconds instead of being
+        # opened and closed by every request, and checked before reuse; each
+        # thread keeps its own, so a uWSGI worker pools up to APP_THREADS of them
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': bool(int(os.environ.get('DB_CONN_HEALTH_CHECKS', 1))),
     }
 }
 
+# SQLite (tests, benchmarks) ignores the listing columns covered by
+# image_owner_id_idx on PostgreSQL, the index itself is still used
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# local memory cache is per process, use e.g. FileBasedCache to share it between workers
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Download authorization (token -> user -> plan) is cached in CACHES and for
+# AUTH_CACHE_LOCAL_TTL seconds in process memory, changes are invalidated by signals
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 300))
+AUTH_CACHE_LOCAL_TTL = int(os.environ.get('AUTH_CACHE_LOCAL_TTL', 5))
+AUTH_CACHE_LOCAL_MAX_ENTRIES = int(os.environ.get('AUTH_CACHE_LOCAL_MAX_ENTRIES', 10000))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -135,6 +163,117 @@ MEDIA_URL = '/static/media/'
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# Uploads are checked while streaming, plans may override the limits
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+UPLOAD_MAX_PIXELS = int(os.environ.get('UPLOAD_MAX_PIXELS', 50 * 1000 * 1000))
+UPLOAD_IMAGE_FORMATS = ['JPEG', 'PNG', 'GIF', 'WEBP']
+
+# Batch uploads (api/image/bulk/): files per request, size of an uploaded zip/tar
+# archive and threads checking and storing the files
+BULK_UPLOAD_MAX_FILES = int(os.environ.get('BULK_UPLOAD_MAX_FILES', 1000))
+BULK_UPLOAD_MAX_BYTES = int(os.environ.get('BULK_UPLOAD_MAX_BYTES', 1024 * 1024 * 1024))
+BULK_UPLOAD_WORKERS = int(os.environ.get('BULK_UPLOAD_WORKERS', os.cpu_count() or 1))
+# Django refuses requests with more files outright, before the upload handler sees them
+DATA_UPLOAD_MAX_NUMBER_FILES = BULK_UPLOAD_MAX_FILES
+
+# Storage of originals: FileSystemStorage under MEDIA_ROOT by default,
+# 'core.storage.ObjectStorage' keeps them in an S3-compatible bucket (needs boto3)
+STORAGES = {
+    'default': {
+        'BACKEND': os.environ.get('DEFAULT_FILE_STORAGE', 'django.core.files.storage.FileSystemStorage'),
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+OBJECT_STORAGE_BUCKET = os.environ.get('OBJECT_STORAGE_BUCKET', 'images')
+OBJECT_STORAGE_PREFIX = os.environ.get('OBJECT_STORAGE_PREFIX', '')
+OBJECT_STORAGE_ENDPOINT_URL = os.environ.get('OBJECT_STORAGE_ENDPOINT_URL') or None
+# Objects are read lazily in ranged GETs of this many bytes
+OBJECT_STORAGE_READ_BLOCK_SIZE = int(os.environ.get('OBJECT_STORAGE_READ_BLOCK_SIZE', 256 * 1024))
+# Dotted path of a client class used instead of boto3, created with OBJECT_STORAGE_ROOT;
+# 'core.storage.LocalObjectClient' keeps objects in a local directory (development)
+OBJECT_STORAGE_CLIENT = os.environ.get('OBJECT_STORAGE_CLIENT') or None
+OBJECT_STORAGE_ROOT = os.environ.get('OBJECT_STORAGE_ROOT', '/vol/web/objects')
+
+# Rendered thumbnails are cached on disk, path is relative to MEDIA_ROOT
+THUMBNAIL_CACHE_PATH = 'cache/thumbnails'
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Dotted path of another storage class for thumbnails, e.g. originals in a bucket
+# and thumbnails on local SSD or the other way round; options are its keyword arguments
+THUMBNAIL_STORAGE = os.environ.get('THUMBNAIL_STORAGE') or None
+THUMBNAIL_STORAGE_OPTIONS = {}
+
+# Concurrent renders of one thumbnail are coalesced under a lock: 'postgres'
+# advisory lock (all nodes), 'file' lock under MEDIA_ROOT/RENDER_LOCK_PATH (one
+# node), 'auto' picks by database, 'off'; waiting ends after RENDER_LOCK_TIMEOUT seconds
+RENDER_LOCK_BACKEND = os.environ.get('RENDER_LOCK_BACKEND', 'auto')
+RENDER_LOCK_PATH = 'cache/locks'
+RENDER_LOCK_TIMEOUT = int(os.environ.get('RENDER_LOCK_TIMEOUT', 30))
+
+# Largest output side in pixels of on-the-fly resizes (download/<id>/t/<spec>/<token>)
+TRANSFORM_MAX_DIMENSION = int(os.environ.get('TRANSFORM_MAX_DIMENSION', 4000))
+# Sizes in CSS pixels on-the-fly resizes may use for each side, before the pixel ratio
+TRANSFORM_SIZES = [
+    int(size) for size in os.environ.get(
+        'TRANSFORM_SIZES', '100,150,200,300,320,400,480,600,640,800,960,1200,1280,1600,1920,2560',
+    ).split(',')
+]
+# Widths of w<width> variants listed in images-list srcset for plans allowing them
+SRCSET_WIDTHS = [320, 640, 960, 1280, 1920, 2560]
+
+# Thumbnail formats by preference, the first one listed in Accept header and supported
+# by Pillow is served; JPEG is the fallback. AVIF needs pillow-avif-plugin.
+THUMBNAIL_FORMATS = os.environ.get('THUMBNAIL_FORMATS', 'AVIF,WEBP,JPEG').split(',')
+
+# How downloads are sent: 'python' - streamed by Django, 'x-accel' - nginx
+# X-Accel-Redirect to IMAGE_ACCEL_PREFIX (internal location aliasing MEDIA_ROOT),
+# 'x-sendfile' - X-Sendfile header with absolute path (Apache, lighttpd)
+IMAGE_DELIVERY_BACKEND = os.environ.get('IMAGE_DELIVERY_BACKEND', 'python')
+IMAGE_ACCEL_PREFIX = os.environ.get('IMAGE_ACCEL_PREFIX', '/protected-media/')
+
+# Serve downloads with async views, for ASGI deployments (APP_SERVER=asgi in run.sh);
+# files are streamed in chunks of DOWNLOAD_CHUNK_SIZE bytes and thumbnails rendered
+# in a pool of ASYNC_RENDER_WORKERS threads
+ASYNC_DOWNLOADS = bool(int(os.environ.get('ASYNC_DOWNLOADS', 0)))
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 64 * 1024))
+ASYNC_RENDER_WORKERS = int(os.environ.get('ASYNC_RENDER_WORKERS', os.cpu_count() or 1))
+
+# Lifetime of signed expiring links in seconds, clients pick it with ?expires_in=
+EXPIRING_LINK_MIN_SECONDS = 300
+EXPIRING_LINK_MAX_SECONDS = 30000
+EXPIRING_LINK_DEFAULT_SECONDS = int(os.environ.get('EXPIRING_LINK_DEFAULT_SECONDS', 3600))
+
+# Thumbnails of uploaded images are rendered ahead of the first download:
+# 'thread' - in a background thread pool, 'sync' - right after commit,
+# 'queue' - by `manage.py render_worker` processes (downloads never render), 'off' - disabled
+THUMBNAIL_PIPELINE = os.environ.get('THUMBNAIL_PIPELINE', 'thread')
+THUMBNAIL_PIPELINE_WORKERS = int(os.environ.get('THUMBNAIL_PIPELINE_WORKERS', 2))
+
+# Files of deleted images are removed after commit: 'thread' - by a background
+# thread in batches, 'sync' - right after commit
+FILE_SWEEPER = os.environ.get('FILE_SWEEPER', 'thread')
+FILE_SWEEPER_BATCH_SIZE = int(os.environ.get('FILE_SWEEPER_BATCH_SIZE', 500))
+
+# Most images removed by one api/image/bulk-delete/ request
+BULK_DELETE_MAX_IMAGES = int(os.environ.get('BULK_DELETE_MAX_IMAGES', 10000))
+
+# Per-request metrics exported at /metrics, with a Server-Timing header under DEBUG
+METRICS_ENABLED = bool(int(os.environ.get('METRICS_ENABLED', 1)))
+# Scrapers must send 'Authorization: Bearer <METRICS_TOKEN>' when set
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Opt-in profiling of sync requests: stacks of requests slower than
+# PROFILE_SLOW_SECONDS are kept, a PROFILE_SAMPLE_RATE fraction is profiled
+# with cProfile; the newest PROFILE_MAX_FILES profiles are kept in PROFILE_PATH
+PROFILE_REQUESTS = bool(int(os.environ.get('PROFILE_REQUESTS', 0)))
+PROFILE_SLOW_SECONDS = float(os.environ.get('PROFILE_SLOW_SECONDS', 1))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+# /vol/data is private to the app, the proxy shares /vol/web
+PROFILE_PATH = os.environ.get('PROFILE_PATH', '/vol/data/profiles')
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -142,6 +281,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'core.User'
 
+# images-list is paginated by a cursor, clients may ask for up to max page size;
+# ?stream=ndjson exports whole library reading the database in chunks
+IMAGE_LIST_PAGE_SIZE = int(os.environ.get('IMAGE_LIST_PAGE_SIZE', 100))
+IMAGE_LIST_MAX_PAGE_SIZE = int(os.environ.get('IMAGE_LIST_MAX_PAGE_SIZE', 1000))
+IMAGE_LIST_STREAM_CHUNK_SIZE = int(os.environ.get('IMAGE_LIST_STREAM_CHUNK_SIZE', 2000))
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
@@ -24,11 +24,14 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path, include
 
+from core import views as core_views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/schema/', SpectacularAPIView.as_view(), name='api-schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='api-schema'), name='api-docs'),
     path('api/', include('core.urls')),
+    path('metrics', core_views.metricsView, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -14,3 +14,17 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_wsgi_application()
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    postfork = None
+
+if postfork is not None:
+    @postfork
+    def open_connection():
+        """Connect each worker right after fork, not on its first request."""
+        from django.db import connection
+        # connections opened before the fork would be shared by all workers
+        if connection.settings_dict['CONN_MAX_AGE']:
+            connection.ensure_connection()
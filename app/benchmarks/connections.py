@@ -0,0 +1,128 @@
+"""
+Benchmark of download latency with per-request vs persistent database connections.
+
+Requests go through the WSGI handler, which closes connections at the end of
+a request unless CONN_MAX_AGE keeps them, like uWSGI does. The difference is
+the connection setup of the database: large on PostgreSQL (TCP, auth, backend
+fork), small on SQLite. A throwaway test database is created on the
+configured connection. Run from /app directory:
+
+        python -m benchmarks.connections --requests 500
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from io import BytesIO
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+django.setup()
+
+from PIL import Image as PILImage  # noqa: E402
+
+from django.core.files import File  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from rest_framework.authtoken.models import Token  # noqa: E402
+
+from core.models import Image, Plan, User  # noqa: E402
+
+from benchmarks.stats import summarize  # noqa: E402
+
+
+# name: (CONN_MAX_AGE, CONN_HEALTH_CHECKS)
+MODES = {
+    'per_request': (0, False),
+    'persistent': (60, False),
+    'persistent_health_checks': (60, True),
+}
+
+
+def request(handler, path):
+    """Send GET through the WSGI handler and read the response like a server would."""
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'testserver',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+    }
+    response = handler(environ, lambda status, headers: None)
+    for _ in response:
+        pass
+    # fires request_finished, which closes connections past CONN_MAX_AGE
+    response.close()
+
+
+def run_mode(handler, path, conn_max_age, health_checks, requests):
+    """Time requests with given connection settings, return latency and connections opened."""
+    connection.close()
+    connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+    connection.settings_dict['CONN_HEALTH_CHECKS'] = health_checks
+    opened = []
+
+    def count_connection(sender, connection, **kwargs):
+        opened.append(connection)
+
+    connection_created.connect(count_connection, weak=False)
+
+    timings = []
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            request(handler, path)
+            timings.append(time.perf_counter() - start)
+    finally:
+        connection_created.disconnect(count_connection)
+    return {**summarize(timings), 'connections_opened': len(opened)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        override_settings(MEDIA_ROOT=tmp_dir, THUMBNAIL_PIPELINE='off', IMAGE_DELIVERY_BACKEND='x-sendfile').enable()
+        setup_test_environment()
+        if connection.vendor == 'sqlite':
+            # closing an in-memory database would drop it
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmp_dir, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            plan = Plan.objects.create(name='Benchmark', original_size=True, expiring_link=False)
+            user = User.objects.create_user(username='benchmark', password='benchmark', plan=plan)
+            key = Token.objects.create(user=user).key
+            img_io = BytesIO()
+            PILImage.new('RGB', (64, 64)).save(img_io, format='JPEG')
+            image = Image(owner=user)
+            image.image.save('benchmark.jpg', File(img_io))
+
+            # the file is handed to the web server, only authorization is left
+            path = reverse('core:download-original', args=[image.pk, key])
+            handler = WSGIHandler()
+            request(handler, path)
+
+            results = {
+                mode: run_mode(handler, path, conn_max_age, health_checks, args.requests)
+                for mode, (conn_max_age, health_checks) in MODES.items()
+            }
+        finally:
+            connection.close()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(json.dumps({'database': connection.vendor, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Synthetic image corpora shared by the benchmarks.
+
+Images are photo-like (gradients and noise) so encoders and the JPEG draft
+decoder behave as they do on real uploads.
+"""
+import os
+
+from PIL import Image as PILImage
+
+from benchmarks.resize import FORMATS, create_source
+
+
+# name: (width, height)
+SIZES = {
+    'small': (640, 480),
+    'medium': (2048, 1536),
+    'large': (6000, 4000),
+}
+
+
+def create_corpus(directory, sizes=SIZES, formats=FORMATS):
+    """Save one image per size and format the Pillow build can write, return their descriptions."""
+    PILImage.init()
+    corpus = []
+    for name in sizes:
+        width, height = SIZES[name]
+        for image_format in formats:
+            if image_format not in PILImage.SAVE:
+                continue
+            path = os.path.join(directory, f'{name}{FORMATS[image_format]}')
+            create_source(path, image_format, width, height)
+            corpus.append({
+                'name': name,
+                'format': image_format,
+                'source': f'{width}x{height}',
+                'path': path,
+                'bytes': os.path.getsize(path),
+            })
+    return corpus
@@ -0,0 +1,75 @@
+"""
+Benchmark of thumbnail output formats: bytes per thumbnail and encode time.
+
+Formats the Pillow build can't write (WebP, AVIF without pillow-avif-plugin)
+are skipped. Run from /app directory:
+
+        python -m benchmarks.formats --qualities 60 75 85 --repeat 5
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from core.imaging import OUTPUT_FORMATS, can_encode, encode, resize_to_height
+
+from benchmarks.resize import SIZES, create_source
+
+
+def run_case(thumbnail, image_format, quality, repeat):
+    """Encode thumbnail repeatedly, return output size and encode latency."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = encode(thumbnail, image_format, quality)
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return {
+        'bytes': len(data),
+        'median_ms': round(timings[len(timings) // 2] * 1000, 2),
+        'min_ms': round(timings[0] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--formats', nargs='+', default=list(OUTPUT_FORMATS))
+    parser.add_argument('--qualities', nargs='+', type=int, default=[60, 75, 85])
+    args = parser.parse_args()
+
+    formats = []
+    for image_format in args.formats:
+        if can_encode(image_format):
+            formats.append(image_format)
+        else:
+            print(f'Skipping {image_format}, not supported by this Pillow build', file=sys.stderr)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'source.jpg')
+        create_source(path, 'JPEG', args.width, args.height)
+
+        for height in SIZES:
+            thumbnail = resize_to_height(path, height)
+            for image_format in formats:
+                for quality in args.qualities:
+                    result = {
+                        'format': image_format,
+                        'height': height,
+                        'quality': quality,
+                        **run_case(thumbnail, image_format, quality, args.repeat),
+                    }
+                    results.append(result)
+                    print(json.dumps(result), file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of download authorization: token lookup vs signed link.
+
+A throwaway test database is created on the configured connection.
+Run from /app directory:
+
+        python -m benchmarks.links --iterations 2000
+"""
+import argparse
+import json
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from rest_framework.authtoken.models import Token  # noqa: E402
+
+from core import access, links  # noqa: E402
+from core.models import Plan, Thumbnail, User  # noqa: E402
+
+
+def token_lookup(key):
+    """Authorize the way downloads did before the authorization cache."""
+    user = Token.objects.get(key=key).user
+    return [t.size for t in user.plan.thumbnails.all()]
+
+
+def measure(func, iterations):
+    """Return microseconds per call and number of queries of one warm call."""
+    func()
+    with CaptureQueriesContext(connection) as queries:
+        func()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'us_per_call': round(elapsed / iterations * 10 ** 6, 2),
+        'queries': len(queries),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        plan = Plan.objects.create(name='Enterprise', original_size=True, expiring_link=True)
+        for size in [200, 400]:
+            plan.thumbnails.add(Thumbnail.objects.create(size=size))
+        user = User.objects.create_user(username='benchmark', password='benchmark', plan=plan)
+        key = Token.objects.create(user=user).key
+        signed = links.sign(1, 'original', 3600)
+
+        results = {
+            'token_lookup': measure(lambda: token_lookup(key), args.iterations),
+            'token_cached': measure(lambda: access.resolve_token(key), args.iterations),
+            'signed_link': measure(lambda: links.verify(signed), args.iterations),
+        }
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+Load test of the image API: worker processes hitting download, list and upload endpoints.
+
+A throwaway test database is created on the configured connection (a file
+next to the corpus on SQLite, test_<name> on PostgreSQL) and seeded with
+images of the synthetic corpus. Every worker is a separate interpreter
+driving the full request stack through the Django test client, the way a
+uWSGI worker would, and records latency, queries and peak RSS. Response
+statuses are reported too: SQLite serializes writers, so concurrent uploads
+there may end with 500 (database is locked).
+Run from /app directory:
+
+        python -m benchmarks.load --workers 4 --requests 200 --images 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+django.setup()
+
+from django.core.files import File  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from rest_framework.authtoken.models import Token  # noqa: E402
+
+from core.models import Image, Plan, Thumbnail, User  # noqa: E402
+from core.uploads import image_metadata  # noqa: E402
+
+from benchmarks.corpus import create_corpus  # noqa: E402
+from benchmarks.resize import peak_rss_mb  # noqa: E402
+from benchmarks.stats import revision, summarize  # noqa: E402
+
+
+SCENARIOS = ['thumbnail', 'render', 'original', 'list', 'upload']
+
+
+def scenario_request(scenario, config, worker, i):
+    """Return (method, path, data) of the i-th request of a worker."""
+    image_ids, token = config['image_ids'], config['token']
+    image_id = image_ids[(worker * 7 + i) % len(image_ids)]
+
+    if scenario == 'thumbnail':
+        return 'get', reverse('core:download', args=[image_id, 200, token]), None
+    if scenario == 'render':
+        # a width no other request asks for, so every request renders
+        spec = f'w{100 + (worker * config["requests"] + i) % 3000}'
+        return 'get', reverse('core:download-transform', args=[image_id, spec, token]), None
+    if scenario == 'original':
+        return 'get', reverse('core:download-original', args=[image_id, token]), None
+    if scenario == 'list':
+        return 'get', reverse('core:list'), None
+    return 'post', reverse('core:image-list'), {'image': open(config['upload_path'], 'rb')}
+
+
+def run_worker(scenario, config, worker):
+    """Send requests of a scenario, return timings, queries and statuses."""
+    connection.settings_dict['NAME'] = config['database']
+    override_settings(**config['settings']).enable()
+    setup_test_environment()
+    client = Client(raise_request_exception=False, HTTP_AUTHORIZATION=f'Token {config["token"]}')
+
+    timings, queries, statuses = [], [], {}
+    started = time.time()
+    for i in range(config['requests']):
+        method, path, data = scenario_request(scenario, config, worker, i)
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as captured:
+            response = client.post(path, data) if method == 'post' else client.get(path)
+            # streamed files are read like a client would
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+        timings.append(time.perf_counter() - start)
+        queries.append(len(captured))
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if data:
+            data['image'].close()
+
+    return {
+        'timings': timings,
+        'queries': queries,
+        'statuses': statuses,
+        'started': started,
+        'finished': time.time(),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def seed(corpus, images):
+    """Create plan, user and images, return (token, image ids)."""
+    plan = Plan.objects.create(
+        name='Benchmark', original_size=True, expiring_link=True, transform_families='height,width,fit,fill,dpr',
+    )
+    for size in [200, 400]:
+        plan.thumbnails.add(Thumbnail.objects.create(size=size))
+    user = User.objects.create_user(username='benchmark', password='benchmark', plan=plan)
+    token = Token.objects.create(user=user).key
+
+    image_ids = []
+    for i in range(images):
+        source = corpus[i % len(corpus)]
+        with open(source['path'], 'rb') as file:
+            image = Image(owner=user, **image_metadata(File(file)))
+            image.image.save(os.path.basename(source['path']), File(file))
+        image_ids.append(image.pk)
+    return token, image_ids
+
+
+def run_scenario(scenario, config, workers):
+    """Run workers of a scenario in parallel, return aggregated results."""
+    processes = [
+        subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.load', '--worker', scenario, str(worker)],
+            env={**os.environ, 'BENCHMARK_CONFIG': json.dumps(config)},
+            stdout=subprocess.PIPE, text=True,
+        )
+        for worker in range(workers)
+    ]
+    results = []
+    for process in processes:
+        output, _ = process.communicate()
+        if process.returncode:
+            raise RuntimeError(f'Worker of {scenario} failed with exit code {process.returncode}')
+        results.append(json.loads(output))
+
+    timings = [timing for result in results for timing in result['timings']]
+    queries = [count for result in results for count in result['queries']]
+    statuses = {}
+    for result in results:
+        for code, count in result['statuses'].items():
+            statuses[code] = statuses.get(code, 0) + count
+    elapsed = max(result['finished'] for result in results) - min(result['started'] for result in results)
+
+    return {
+        'scenario': scenario,
+        'workers': workers,
+        **summarize(timings, elapsed),
+        'queries': {
+            'mean': round(sum(queries) / len(queries), 2),
+            'max': max(queries),
+        },
+        'statuses': statuses,
+        'peak_rss_mb': max(result['peak_rss_mb'] for result in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help='Requests sent by every worker.')
+    parser.add_argument('--images', type=int, default=50, help='Images seeded for the user.')
+    parser.add_argument('--corpus', nargs='+', default=['small', 'medium'], help='Sizes of seeded images.')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--worker', nargs=2, metavar=('SCENARIO', 'WORKER'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        scenario, worker = args.worker
+        config = json.loads(os.environ['BENCHMARK_CONFIG'])
+        print(json.dumps(run_worker(scenario, config, int(worker))))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = create_corpus(tmp_dir, args.corpus, ['JPEG', 'PNG'])
+        media_root = os.path.join(tmp_dir, 'media')
+        benchmark_settings = {
+            'MEDIA_ROOT': media_root,
+            # renders are measured in the request, not in a background pipeline
+            'THUMBNAIL_PIPELINE': 'off',
+            'FILE_SWEEPER': 'sync',
+        }
+        override_settings(**benchmark_settings).enable()
+
+        if connection.vendor == 'sqlite':
+            # an in-memory database can't be shared with worker processes
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmp_dir, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            token, image_ids = seed(corpus, args.images)
+            config = {
+                'database': connection.settings_dict['NAME'],
+                'settings': benchmark_settings,
+                'token': token,
+                'image_ids': image_ids,
+                'requests': args.requests,
+                'upload_path': corpus[0]['path'],
+            }
+            # thumbnails are rendered once, 'thumbnail' measures cached downloads
+            setup_test_environment()
+            client = Client()
+            for image_id in image_ids:
+                client.get(reverse('core:download', args=[image_id, 200, token]))
+            connection.close()
+
+            results = []
+            for scenario in args.scenarios:
+                result = run_scenario(scenario, config, args.workers)
+                results.append(result)
+                print(json.dumps({key: result[key] for key in ('scenario', 'p50_ms', 'per_second')}), file=sys.stderr)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(json.dumps({
+        'revision': revision(),
+        'database': connection.vendor,
+        'images': args.images,
+        'requests_per_worker': args.requests,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
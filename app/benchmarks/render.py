@@ -0,0 +1,103 @@
+"""
+Micro-benchmark of the thumbnail path over a synthetic corpus: decode and resize, encode.
+
+Every source image runs in a fresh interpreter so peak RSS belongs to it only.
+Run from /app directory:
+
+        python -m benchmarks.render --sizes small medium large --repeat 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# specs are bounded by TRANSFORM_MAX_DIMENSION of the settings
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+from core import transforms  # noqa: E402
+from core.imaging import OUTPUT_FORMATS, can_encode, encode, resize  # noqa: E402
+
+from benchmarks.corpus import SIZES, create_corpus  # noqa: E402
+from benchmarks.resize import FORMATS, peak_rss_mb  # noqa: E402
+from benchmarks.stats import summarize  # noqa: E402
+
+
+# fixed thumbnail heights and on-the-fly specs of a responsive page
+VARIANTS = ['h200', 'h400', 'w640', 'fill400x400']
+
+
+def run_case(path, spec, formats, repeat):
+    """Resize and encode one source repeatedly, return timings of every step."""
+    transform = transforms.parse(spec)
+    resize_timings = []
+    encode_timings = {image_format: [] for image_format in formats}
+    output_bytes = {}
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        thumbnail = resize(path, transform)
+        resize_timings.append(time.perf_counter() - start)
+
+        for image_format in formats:
+            start = time.perf_counter()
+            output_bytes[image_format] = len(encode(thumbnail, image_format))
+            encode_timings[image_format].append(time.perf_counter() - start)
+
+    return {
+        'resize': summarize(resize_timings),
+        'encode': {
+            image_format: {**summarize(timings), 'bytes': output_bytes[image_format]}
+            for image_format, timings in encode_timings.items()
+        },
+    }
+
+
+def run_source(path, formats, repeat):
+    """Run every variant of one source, return results with peak RSS of the process."""
+    return {
+        'variants': {spec: run_case(path, spec, formats, repeat) for spec in VARIANTS},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--source-formats', nargs='+', default=list(FORMATS))
+    parser.add_argument('--formats', nargs='+', default=list(OUTPUT_FORMATS), help='Output formats.')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--source', metavar='PATH', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    formats = []
+    for image_format in args.formats:
+        if can_encode(image_format):
+            formats.append(image_format)
+        else:
+            print(f'Skipping {image_format}, not supported by this Pillow build', file=sys.stderr)
+
+    if args.source:
+        print(json.dumps(run_source(args.source, formats, args.repeat)))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for source in create_corpus(tmp_dir, args.sizes, args.source_formats):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.render', '--repeat', str(args.repeat),
+                 '--formats', *formats, '--source', source['path']],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = {key: value for key, value in source.items() if key != 'path'}
+            result.update(json.loads(output))
+            results.append(result)
+            print(json.dumps({key: result[key] for key in ('name', 'format', 'peak_rss_mb')}), file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark of thumbnail rendering: full decode vs reduced decode.
+
+Every case runs in a fresh interpreter so peak RSS belongs to that case only.
+Run from /app directory:
+
+        python -m benchmarks.resize --width 6000 --height 4000 --repeat 5
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image as PILImage
+
+from core.imaging import render_thumbnail
+
+
+FORMATS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'WEBP': '.webp',
+}
+SIZES = [200, 400]
+
+
+def render_full_decode(path, height):
+    """Render thumbnail the way it was done before draft mode and reducing gap."""
+    with PILImage.open(path) as original_image:
+        new_width = int(height * original_image.width / original_image.height)
+        buffer = io.BytesIO()
+        thumbnail = original_image.resize((new_width, height), PILImage.LANCZOS)
+        thumbnail.convert('RGB').save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+
+ENGINES = {
+    'full': render_full_decode,
+    'reduced': render_thumbnail,
+}
+
+
+def create_source(path, image_format, width, height):
+    """Save synthetic photo-like image of given size."""
+    gradient = PILImage.linear_gradient('L').resize((width, height))
+    noise = PILImage.effect_noise((width, height), 64)
+    image = PILImage.merge('RGB', (gradient, noise, gradient.rotate(180)))
+    image.save(path, image_format)
+
+
+def peak_rss_mb():
+    """Return peak resident memory of this process in megabytes."""
+    # VmHWM starts over at exec, unlike ru_maxrss inherited from the parent
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is reported in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_case(engine, path, height, repeat):
+    """Render thumbnail repeatedly, return latency and peak RSS."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ENGINES[engine](path, height)
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return {
+        'median_ms': round(timings[len(timings) // 2] * 1000, 2),
+        'min_ms': round(timings[0] * 1000, 2),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--formats', nargs='+', default=list(FORMATS))
+    parser.add_argument('--case', nargs=3, metavar=('ENGINE', 'PATH', 'HEIGHT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        engine, path, height = args.case
+        print(json.dumps(run_case(engine, path, int(height), args.repeat)))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        PILImage.init()
+        for image_format in args.formats:
+            if image_format not in PILImage.SAVE:
+                print(f'Skipping {image_format}, not supported by this Pillow build', file=sys.stderr)
+                continue
+            path = os.path.join(tmp_dir, f'source{FORMATS[image_format]}')
+            create_source(path, image_format, args.width, args.height)
+
+            for height in SIZES:
+                for engine in ENGINES:
+                    output = subprocess.run(
+                        [sys.executable, '-m', 'benchmarks.resize', '--repeat', str(args.repeat),
+                         '--case', engine, path, str(height)],
+                        check=True, capture_output=True, text=True,
+                    ).stdout
+                    result = {
+                        'format': image_format,
+                        'source': f'{args.width}x{args.height}',
+                        'height': height,
+                        'engine': engine,
+                        **json.loads(output),
+                    }
+                    results.append(result)
+                    print(json.dumps(result), file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Load test of downloads under slow clients: WSGI workers vs ASGI coroutines.
+
+Slow clients download a file reading a few kilobytes per second while a probe
+requests a second URL in a loop; its latency shows whether slow readers pin the
+app workers. Start the deployment with APP_SERVER=wsgi or APP_SERVER=asgi and
+point both URLs at the app itself, not at a buffering proxy.
+Run from /app directory:
+
+        python -m benchmarks.slow_clients --slow-url http://localhost:9000/download/1/original/<token> \\
+            --probe-url http://localhost:9000/download/1/200/<token> --clients 50 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from urllib.parse import urlsplit
+
+from benchmarks.stats import summarize
+
+
+async def request(url, read_size=None, read_delay=0):
+    """GET url over a new connection, return (status, body bytes, seconds), optionally reading slowly."""
+    parts = urlsplit(url)
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n\r\n'.encode())
+    await writer.drain()
+
+    status_line = await reader.readline()
+    status = int(status_line.split()[1]) if status_line else 0
+    received = 0
+    while chunk := await reader.read(read_size or 65536):
+        received += len(chunk)
+        if read_delay:
+            await asyncio.sleep(read_delay)
+    writer.close()
+    return status, received, time.perf_counter() - start
+
+
+async def slow_client(url, read_size, read_delay, deadline, stats):
+    """Download url throttled, over and over until the deadline."""
+    while time.perf_counter() < deadline:
+        try:
+            status, received, _ = await request(url, read_size, read_delay)
+            stats['downloads'] += 1
+            stats['bytes'] += received
+            if status >= 400:
+                stats['errors'] += 1
+        except OSError:
+            stats['errors'] += 1
+            await asyncio.sleep(read_delay)
+
+
+async def probe(url, deadline, latencies, errors):
+    """Request url back to back until the deadline, recording latencies."""
+    while time.perf_counter() < deadline:
+        try:
+            status, _, elapsed = await request(url)
+            if status >= 400:
+                errors.append(status)
+            latencies.append(elapsed)
+        except OSError as exc:
+            errors.append(repr(exc))
+            await asyncio.sleep(0.1)
+
+
+async def run(args):
+    deadline = time.perf_counter() + args.duration
+    stats = {'downloads': 0, 'bytes': 0, 'errors': 0}
+    latencies, probe_errors = [], []
+
+    await asyncio.gather(
+        *[
+            slow_client(args.slow_url, args.read_size, args.read_delay, deadline, stats)
+            for _ in range(args.clients)
+        ],
+        probe(args.probe_url, deadline, latencies, probe_errors),
+    )
+
+    return {
+        'clients': args.clients,
+        'duration_s': args.duration,
+        'slow_clients': stats,
+        'probe': {**summarize(latencies), 'errors': len(probe_errors)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--slow-url', required=True)
+    parser.add_argument('--probe-url', required=True)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--read-size', type=int, default=4096, help='Bytes read by slow clients at once.')
+    parser.add_argument('--read-delay', type=float, default=0.5, help='Seconds slow clients wait between reads.')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if result['probe']['count'] == 0:
+        print('Probe did not complete a single request', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Summaries of benchmark timings reported as JSON.
+"""
+import subprocess
+
+
+def percentile(timings, fraction):
+    """Return percentile of sorted timings in seconds as milliseconds."""
+    if not timings:
+        return None
+    return round(timings[min(int(len(timings) * fraction), len(timings) - 1)] * 1000, 2)
+
+
+def summarize(timings, elapsed=None):
+    """Return count, p50/p95/p99 and mean of timings in seconds, throughput when elapsed is given."""
+    timings = sorted(timings)
+    summary = {
+        'count': len(timings),
+        'p50_ms': percentile(timings, 0.50),
+        'p95_ms': percentile(timings, 0.95),
+        'p99_ms': percentile(timings, 0.99),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 2) if timings else None,
+    }
+    if elapsed:
+        summary['per_second'] = round(len(timings) / elapsed, 2)
+    return summary
+
+
+def revision():
+    """Return git commit of the benchmarked tree, None outside a checkout."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], check=True, capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
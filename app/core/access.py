@@ -0,0 +1,122 @@
+"""
+Cached authorization of image downloads.
+
+Token, user and plan data needed to authorize a download are cached in two
+layers: a short lived in-process dict and the shared Django cache. Signals
+in core.models invalidate both layers whenever the underlying rows change;
+other processes drop their in-process copies after AUTH_CACHE_LOCAL_TTL.
+"""
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from rest_framework.authtoken.models import Token
+
+from core.models import Plan, Thumbnail, User
+from core.transforms import parse_families
+
+
+# sizes maps thumbnail sizes of the plan to their encoder quality,
+# transforms is a frozenset of allowed on-the-fly resize families,
+# plan_id is 0 for users without a plan
+Grant = namedtuple(
+    'Grant', ['user_id', 'sizes', 'original_size', 'expiring_link', 'cache_max_age', 'transforms', 'plan_id'],
+)
+
+TOKEN_KEY = 'access:token:{}'
+USER_KEY = 'access:user:{}'
+# versioned, entries cached by older releases have another shape
+PLAN_KEY = 'access:plan:v2:{}'
+
+# entries are (expires_at, value)
+_local = {}
+
+
+def _get(key):
+    entry = _local.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+
+    value = cache.get(key)
+    if value is not None:
+        _set_local(key, value)
+    return value
+
+
+def _set(key, value):
+    cache.set(key, value, settings.AUTH_CACHE_TTL)
+    _set_local(key, value)
+
+
+def _set_local(key, value):
+    if len(_local) >= settings.AUTH_CACHE_LOCAL_MAX_ENTRIES:
+        _local.clear()
+    _local[key] = (time.monotonic() + settings.AUTH_CACHE_LOCAL_TTL, value)
+
+
+def _delete(keys):
+    cache.delete_many(keys)
+    for key in keys:
+        _local.pop(key, None)
+
+
+def _user_id(token_key):
+    user_id = _get(TOKEN_KEY.format(token_key))
+    if user_id is None:
+        user_id = Token.objects.filter(key=token_key).values_list('user_id', flat=True).first()
+        if user_id is not None:
+            _set(TOKEN_KEY.format(token_key), user_id)
+    return user_id
+
+
+def _plan_id(user_id):
+    # users without a plan are cached as 0
+    plan_id = _get(USER_KEY.format(user_id))
+    if plan_id is None:
+        plan_id = User.objects.filter(pk=user_id).values_list('plan_id', flat=True).first() or 0
+        _set(USER_KEY.format(user_id), plan_id)
+    return plan_id
+
+
+def _plan(plan_id):
+    plan = _get(PLAN_KEY.format(plan_id))
+    if plan is None:
+        flags = Plan.objects.filter(pk=plan_id).values_list(
+            'original_size', 'expiring_link', 'cache_max_age', 'transform_families',
+        ).first()
+        if flags is None:
+            return {}, False, False, 0, frozenset()
+        *flags, families = flags
+        sizes = dict(Thumbnail.objects.filter(plan=plan_id).values_list('size', 'quality'))
+        plan = (sizes, *flags, parse_families(families))
+        _set(PLAN_KEY.format(plan_id), plan)
+    return plan
+
+
+def resolve_token(token_key):
+    """Return Grant of user owning the token or None for an unknown token."""
+    user_id = _user_id(token_key)
+    if user_id is None:
+        return None
+
+    plan_id = _plan_id(user_id)
+    if not plan_id:
+        return Grant(user_id, {}, False, False, 0, frozenset(), 0)
+    return Grant(user_id, *_plan(plan_id), plan_id)
+
+
+def invalidate_token(token_key):
+    """Forget cached owner of a token."""
+    _delete([TOKEN_KEY.format(token_key)])
+
+
+def invalidate_user(user_id):
+    """Forget cached plan of a user."""
+    _delete([USER_KEY.format(user_id)])
+
+
+def invalidate_plans(plan_ids):
+    """Forget cached thumbnails and settings of plans."""
+    _delete([PLAN_KEY.format(plan_id) for plan_id in plan_ids])
@@ -0,0 +1,216 @@
+"""
+Async download views, routed instead of the sync ones with ASYNC_DOWNLOADS
+when the app is served under ASGI.
+
+Authorization reads go through the async ORM, files are streamed through an
+async iterator reading chunks in a thread and thumbnails missing from the
+cache are rendered in a thread pool. A slow client then costs an idle
+coroutine instead of a worker. Grant checks, negotiation and headers are
+shared with core.views through core.delivery.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core import signing
+from django.http import Http404, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+from core import access, coalesce, delivery, jobs, links, metrics, transforms
+from core.cache import get_thumbnail_cache
+from core.models import Image
+from core.pipeline import open_original, render_stored, store_variant, thumbnail_qualities
+
+
+_executor = None
+
+# renders in progress in this process, keyed by (source, variant, format, quality)
+_renders = {}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # Pillow releases the GIL while decoding, resizing and encoding
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.ASYNC_RENDER_WORKERS,
+            thread_name_prefix='async-renders',
+        )
+    return _executor
+
+
+async def _get_image(image_id):
+    image = await Image.objects.select_related('blob').filter(pk=image_id).afirst()
+    if image is None:
+        raise Http404('No Image matches the given query.')
+    return image
+
+
+async def _in_thread(func, *args):
+    """Run blocking storage I/O outside the event loop."""
+    return await sync_to_async(func, thread_sensitive=False)(*args)
+
+
+async def _iter_file(file, chunk_size):
+    """Yield chunks of a file read in a thread, closing it at the end."""
+    try:
+        while chunk := await _in_thread(file.read, chunk_size):
+            yield chunk
+    finally:
+        await _in_thread(file.close)
+
+
+async def _file_response(file, content_type, filename):
+    """Return response streaming an open file, or handing a local one to the web server."""
+    if delivery.served_by_web_server(file, settings.IMAGE_DELIVERY_BACKEND):
+        return delivery.file_response(file, content_type, filename)
+
+    size = await _in_thread(lambda: file.size)
+    metrics.add('storage_read_bytes', size)
+    response = StreamingHttpResponse(
+        _iter_file(file, settings.DOWNLOAD_CHUNK_SIZE), content_type=content_type,
+    )
+    response['Content-Length'] = size
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+
+async def _render_once(image, variant, image_format):
+    cache = get_thumbnail_cache()
+    transform, quality = variant.transform, variant.quality
+    key = transform.key
+    # other processes and nodes rendering the same thumbnail are waited for
+    async with coalesce.async_single_flight(coalesce.render_key(image, key)):
+        cached_file = await _in_thread(cache.open, image, key, image_format, quality)
+        if cached_file is not None:
+            metrics.increment('thumbnail_renders_collapsed')
+            with cached_file:
+                return await _in_thread(cached_file.read)
+
+        # the context carries metrics of the request into the pool thread
+        renders = await asyncio.get_running_loop().run_in_executor(
+            _get_executor(), contextvars.copy_context().run,
+            render_stored, image.image.name, transform, [image_format], quality,
+        )
+        await sync_to_async(store_variant)(image, transform, renders, quality, variant.derivative)
+    return renders[image_format]
+
+
+async def _render(image, variant, image_format):
+    """Return thumbnail bytes, concurrent requests of this process share one render."""
+    render_key = (image.image.name, variant.transform.key, image_format, variant.quality)
+    task = _renders.get(render_key)
+    if task is not None:
+        metrics.increment('thumbnail_renders_collapsed')
+    else:
+        task = asyncio.ensure_future(_render_once(image, variant, image_format))
+        _renders[render_key] = task
+        task.add_done_callback(lambda _: _renders.pop(render_key, None))
+    # a disconnecting client must not cancel the render others wait for
+    return await asyncio.shield(task)
+
+
+async def _thumbnail_response(request, image, variant):
+    """Return thumbnail of an authorized image download."""
+    return delivery.vary_on_accept(await _negotiated_thumbnail(request, image, variant))
+
+
+async def _negotiated_thumbnail(request, image, variant):
+    image_format = delivery.negotiate_format(request)
+    transform, quality = variant.transform, variant.quality
+
+    # answer revalidation before any file is opened
+    etag, last_modified = await _in_thread(delivery.thumbnail_validators, image, variant, image_format)
+    response = delivery.not_modified(request, etag, last_modified, variant.max_age)
+    if response is not None:
+        return response
+
+    cached_file = await _in_thread(get_thumbnail_cache().open, image, transform.key, image_format, quality)
+    metrics.add('cache_hits' if cached_file is not None else 'cache_misses')
+    content_type, filename = delivery.thumbnail_file(image, variant, image_format)
+
+    if cached_file is not None:
+        # deliver cached thumbnail, Pillow is not touched at all
+        response = await _file_response(cached_file, content_type, filename)
+    elif delivery.queued(variant):
+        # leave rendering to render_worker
+        await sync_to_async(jobs.enqueue)(image, [transform.pixel_height])
+        return delivery.render_pending()
+    else:
+        data = await _render(image, variant, image_format)
+        response = delivery.data_response(data, content_type, filename)
+
+    return delivery.add_caching_headers(response, etag, last_modified, variant.max_age)
+
+
+async def _original_response(request, image, max_age):
+    """Return original of an authorized image download."""
+    etag, last_modified = await _in_thread(delivery.validators, image, 'original')
+    response = delivery.not_modified(request, etag, last_modified, max_age)
+    if response is not None:
+        return response
+
+    content_type, filename = delivery.original_file(image)
+    response = await _file_response(await _in_thread(open_original, image.image.name), content_type, filename)
+
+    return delivery.add_caching_headers(response, etag, last_modified, max_age)
+
+
+async def _authorize(image_id, token):
+    """Return (image, grant) of a download, raise Http404 for an unknown image or token."""
+    image = await _get_image(image_id)
+    grant = await sync_to_async(access.resolve_token)(token)
+    if grant is None:
+        raise Http404('No Token matches the given query.')
+    return image, grant
+
+
+async def thumbnailView(request, image_id, size, token):
+    image, grant = await _authorize(image_id, token)
+
+    variant = delivery.thumbnail_variant(image, grant, size)
+    if variant is None:
+        return delivery.unauthorized()
+    return await _thumbnail_response(request, image, variant)
+
+
+async def transformView(request, image_id, spec, token):
+    image, grant = await _authorize(image_id, token)
+
+    try:
+        transform = transforms.parse(spec)
+    except transforms.TransformError as exc:
+        return delivery.invalid_transform(exc)
+
+    variant = delivery.transform_variant(image, grant, transform)
+    if variant is None:
+        return delivery.unauthorized()
+    return await _thumbnail_response(request, image, variant)
+
+
+async def originalView(request, image_id, token):
+    image, grant = await _authorize(image_id, token)
+
+    if not delivery.original_allowed(image, grant):
+        return delivery.unauthorized()
+    return await _original_response(request, image, grant.cache_max_age)
+
+
+async def expiringLinkView(request, signed):
+    try:
+        image_id, variant, expires = links.verify(signed)
+    except signing.BadSignature:
+        raise Http404('Invalid link.')
+    except links.LinkExpired:
+        return delivery.link_expired()
+
+    # the signature is the authorization, no token or plan lookup needed
+    image = await _get_image(image_id)
+
+    if variant == 'original':
+        return await _original_response(request, image, delivery.link_max_age(expires))
+    qualities = await sync_to_async(thumbnail_qualities)([variant])
+    return await _thumbnail_response(request, image, delivery.link_variant(variant, qualities[variant], expires))
@@ -0,0 +1,151 @@
+"""
+Content-addressed storage of uploaded image files.
+"""
+import contextvars
+import hashlib
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.db.models.functions import Greatest
+
+from core import sweeper
+from core.models import Blob, blob_file_path
+
+
+# references collected by batch_releases, None outside of it
+_releases = contextvars.ContextVar('blob_releases', default=None)
+
+
+def file_sha256(file):
+    """Return SHA-256 of a file, reusing the hash computed while it was uploaded."""
+    digest = getattr(file, 'sha256', None)
+    if digest is not None:
+        return digest
+
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _create(digest, file):
+    blob = Blob(sha256=digest, size=file.size)
+    storage = blob.file.storage
+    name = blob_file_path(blob, file.name)
+    blob.file.name = name if storage.exists(name) else storage.save(name, file)
+
+    try:
+        with transaction.atomic():
+            blob.save()
+    except IntegrityError:
+        # concurrent upload of the same content created the blob first
+        if blob.file.name != name:
+            storage.delete(blob.file.name)
+        return Blob.objects.select_for_update().get(sha256=digest)
+
+    return blob
+
+
+def store(file):
+    """Return blob holding content of file, adding one reference to it."""
+    digest = file_sha256(file)
+
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(sha256=digest).first()
+        if blob is None:
+            blob = _create(digest, file)
+        elif not blob.file.storage.exists(blob.file.name):
+            # file was lost or purged concurrently, restore it from this upload
+            blob.file.name = blob.file.storage.save(blob.file.name, file)
+            blob.save(update_fields=['file'])
+        Blob.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+
+    return blob
+
+
+def save_file(digest, file):
+    """Write file under its content-addressed name unless it is stored already, return the name."""
+    blob = Blob(sha256=digest)
+    storage = blob.file.storage
+    name = blob_file_path(blob, file.name)
+    if storage.exists(name):
+        return name
+    return storage.save(name, file)
+
+
+def store_many(files):
+    """
+    Return {sha256: blob} for {sha256: (name, file, references)} of saved files.
+
+    Blobs are created in one statement and every blob gets its references
+    added in another, however many images are stored. Files of blobs purged
+    since save_file reused them are written again.
+    """
+    with transaction.atomic():
+        Blob.objects.bulk_create(
+            [Blob(sha256=digest, file=name, size=file.size) for digest, (name, file, _) in files.items()],
+            ignore_conflicts=True,
+        )
+        blobs = {
+            blob.sha256: blob
+            for blob in Blob.objects.select_for_update().filter(sha256__in=list(files))
+        }
+        restored = []
+        for digest, (_, file, _) in files.items():
+            blob = blobs[digest]
+            if not blob.file.storage.exists(blob.file.name):
+                # file was lost or purged concurrently, restore it from this upload
+                blob.file.name = blob.file.storage.save(blob.file.name, file)
+                restored.append(blob)
+        Blob.objects.bulk_update(restored, ['file'])
+        Blob.objects.filter(pk__in=[blob.pk for blob in blobs.values()]).update(
+            refcount=F('refcount') + Case(
+                *[When(pk=blobs[digest].pk, then=Value(references)) for digest, (_, _, references) in files.items()],
+                output_field=PositiveIntegerField(),
+            ),
+        )
+
+    for digest, (name, _, _) in files.items():
+        if blobs[digest].file.name != name:
+            # concurrent upload stored the same content under another name first
+            blobs[digest].file.storage.delete(name)
+    return blobs
+
+
+def release(blob_id):
+    """Drop one reference to a blob, its file is purged after commit once unused."""
+    references = _releases.get()
+    if references is not None:
+        references[blob_id] += 1
+    else:
+        release_many({blob_id: 1})
+
+
+@contextmanager
+def batch_releases():
+    """Collect release() calls, e.g. of delete signals, and drop the references at once on exit."""
+    references = Counter()
+    token = _releases.set(references)
+    try:
+        yield
+    finally:
+        _releases.reset(token)
+    release_many(references)
+
+
+def release_many(references):
+    """Drop {blob id: count} references in one statement, unused blobs are purged after commit."""
+    if not references:
+        return
+    Blob.objects.filter(pk__in=list(references)).update(
+        refcount=Greatest(
+            F('refcount') - Case(
+                *[When(pk=blob_id, then=Value(count)) for blob_id, count in references.items()],
+                output_field=PositiveIntegerField(),
+            ),
+            Value(0),
+        ),
+    )
+    sweeper.schedule(blob_ids=references)
@@ -0,0 +1,184 @@
+"""
+Batch ingest of many images in one request.
+"""
+import os
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
+
+from PIL import Image as PILImage
+
+from core import blobs, sweeper
+from core.models import Image
+from core.pipeline import schedule_many
+from core.uploads import INVALID_IMAGE, check_image, image_metadata, open_header, upload_limits
+
+
+class ArchiveError(Exception):
+    """Archive could not be unpacked."""
+
+
+def _members(archive):
+    """Yield (name, file) of regular files in a zip or tar archive."""
+    archive.seek(0)
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zip_file:
+            for info in zip_file.infolist():
+                if not info.is_dir():
+                    with zip_file.open(info) as member:
+                        yield info.filename, member
+        return
+
+    archive.seek(0)
+    try:
+        # stream mode, members are read in order without seeking back
+        with tarfile.open(fileobj=archive, mode='r|*') as tar_file:
+            for info in tar_file:
+                if info.isfile():
+                    yield info.name, tar_file.extractfile(info)
+    except tarfile.TarError as exc:
+        raise ArchiveError('Upload a zip or tar archive.') from exc
+
+
+def unpack(archive, max_bytes, max_files):
+    """
+    Return (files, rejected) unpacked from an archive into temporary files.
+
+    Members larger than max_bytes are rejected without being read whole.
+    """
+    files = []
+    rejected = []
+    try:
+        for name, member in _members(archive):
+            name = os.path.basename(name)
+            if len(files) + len(rejected) >= max_files:
+                rejected.append({'image': name, 'errors': [f'More than {max_files} files in one request.']})
+                break
+
+            unpacked = TemporaryUploadedFile(name, 'application/octet-stream', 0, None)
+            copied = 0
+            while chunk := member.read(64 * 1024):
+                copied += len(chunk)
+                if copied > max_bytes:
+                    break
+                unpacked.write(chunk)
+            if copied > max_bytes:
+                unpacked.close()
+                rejected.append({'image': name, 'errors': [f'Image is larger than {max_bytes} bytes.']})
+                continue
+            unpacked.size = copied
+            unpacked.seek(0)
+            files.append(unpacked)
+    except (ArchiveError, zipfile.BadZipFile) as exc:
+        rejected.append({'image': archive.name, 'errors': [str(exc)]})
+    return files, rejected
+
+
+def _inspect(file, max_pixels):
+    """Return (sha256, error) of a file, reading its header unless it was checked while streaming."""
+    if getattr(file, 'image_format', None) is None:
+        try:
+            file.seek(0)
+            image_format, image_size = open_header(file)
+        except PILImage.DecompressionBombError:
+            return None, f'Image has more than {max_pixels} pixels.'
+        except Exception:
+            return None, INVALID_IMAGE
+
+        error = check_image(image_format, image_size, max_pixels)
+        if error is not None:
+            return None, error
+        file.image_format, file.image_size = image_format, image_size
+    return blobs.file_sha256(file), None
+
+
+def ingest(owner, uploads, archives=(), rejected=()):
+    """
+    Store uploaded images and images unpacked from archives for owner.
+
+    Files are checked, hashed and written to storage in a thread pool, the
+    rows are inserted with bulk_create. Return a result per file: the new
+    image id, or errors of a rejected file.
+    """
+    max_bytes, max_pixels = upload_limits(owner)
+    results = list(rejected)
+    files = list(uploads)
+    for archive in archives:
+        unpacked, archive_rejected = unpack(archive, max_bytes, settings.BULK_UPLOAD_MAX_FILES - len(files))
+        files += unpacked
+        results += archive_rejected
+
+    try:
+        with ThreadPoolExecutor(max_workers=settings.BULK_UPLOAD_WORKERS) as executor:
+            inspected = list(executor.map(lambda file: _inspect(file, max_pixels), files))
+
+            accepted = {}
+            file_results = []
+            for file, (digest, error) in zip(files, inspected):
+                if error is None:
+                    accepted.setdefault(digest, []).append(file)
+                    file_results.append({
+                        'image': os.path.basename(file.name), 'sha256': digest, 'metadata': image_metadata(file),
+                    })
+                else:
+                    file_results.append({'image': os.path.basename(file.name), 'errors': [error]})
+
+            # identical files in the batch are written once
+            names = dict(zip(
+                accepted,
+                executor.map(lambda digest: blobs.save_file(digest, accepted[digest][0]), accepted),
+            ))
+
+        images = []
+        if accepted:
+            with transaction.atomic():
+                stored = blobs.store_many({
+                    digest: (names[digest], digest_files[0], len(digest_files))
+                    for digest, digest_files in accepted.items()
+                })
+                images = Image.objects.bulk_create([
+                    Image(
+                        owner=owner,
+                        image=stored[result['sha256']].file.name,
+                        blob=stored[result['sha256']],
+                        filename=result['image'],
+                        **result.pop('metadata'),
+                    )
+                    for result in file_results if 'sha256' in result
+                ])
+                schedule_many(images)
+    finally:
+        for file in files:
+            file.close()
+
+    created = iter(images)
+    for result in file_results:
+        if result.pop('sha256', None) is not None:
+            result['id'] = next(created).pk
+    return results + file_results
+
+
+def delete(images):
+    """
+    Delete images of a queryset, up to BULK_DELETE_MAX_IMAGES, and return their number.
+
+    Images are loaded with the columns their delete signals need, the
+    signals run as for single deletes and rows are removed in Django's
+    delete batches. Blob references the signals release are dropped with
+    one update and all files, also of images stored before blobs, are left
+    to one sweep after commit, so the transaction does no disk I/O.
+    """
+    with transaction.atomic():
+        image_ids = list(
+            images.select_for_update()
+            .order_by('id')
+            .values_list('id', flat=True)[:settings.BULK_DELETE_MAX_IMAGES]
+        )
+        with sweeper.batch(), blobs.batch_releases():
+            Image.objects.filter(pk__in=image_ids).only('id', 'image', 'blob').delete()
+
+    return len(image_ids)
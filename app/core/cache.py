@@ -0,0 +1,192 @@
+"""
+Cache of rendered image derivatives in a storage backend.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from core import metrics
+from core.storage import local_path, source_version
+
+
+# fraction of the budget freed below it on eviction, so a full cache is not
+# scanned again on the next write
+EVICTION_HEADROOM = 0.1
+
+# estimated bytes of local cache directories by path, kept per process
+_usage = {}
+_usage_lock = threading.Lock()
+
+
+class DerivativeCache:
+    """
+    Content-addressed store of rendered thumbnails in a storage backend.
+
+    On a local filesystem writes are atomic renames and the cache is kept
+    within an LRU byte budget; object stores replace whole objects on write
+    and leave expiry to bucket lifecycle rules. Written bytes are counted
+    against the budget, the directory is only scanned once the count goes
+    over it. Writes of other processes are seen at the next scan.
+    """
+
+    def __init__(self, storage, max_bytes):
+        self.storage = storage
+        self.max_bytes = max_bytes
+
+    def _source_dir(self, name):
+        # images sharing a blob share the source file and so its derivatives
+        return hashlib.sha256(name.encode()).hexdigest()
+
+    def key(self, image, size, image_format='JPEG', quality=None):
+        """Return cache key for image rendered at given size, format and quality."""
+        version, _ = source_version(image)
+        source = f'{image.image.name}:{size}:{image_format}:{quality}:{version}'
+        return hashlib.sha256(source.encode()).hexdigest()
+
+    def name(self, image, size, image_format='JPEG', quality=None):
+        """Return storage name of a derivative."""
+        key = self.key(image, size, image_format, quality)
+        return f'{self._source_dir(image.image.name)}/{key}.{image_format.lower()}'
+
+    def path(self, image, size, image_format='JPEG', quality=None):
+        """Return filesystem path of a derivative, None when storage is not local."""
+        return local_path(self.storage, self.name(image, size, image_format, quality))
+
+    def open(self, image, size, image_format='JPEG', quality=None):
+        """Return an open file with cached derivative or None on a miss."""
+        name = self.name(image, size, image_format, quality)
+        try:
+            cached_file = self.storage.open(name, 'rb')
+        except FileNotFoundError:
+            return None
+
+        path = local_path(self.storage, name)
+        if path is not None:
+            # mark as recently used, eviction goes by modification time
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+        return cached_file
+
+    def exists(self, image, size, image_format='JPEG', quality=None):
+        """Return True when derivative is cached."""
+        return self.storage.exists(self.name(image, size, image_format, quality))
+
+    def put(self, image, size, data, image_format='JPEG', quality=None):
+        """Atomically store rendered derivative and return its storage name."""
+        name = self.name(image, size, image_format, quality)
+        metrics.add('storage_write_bytes', len(data))
+        path = local_path(self.storage, name)
+        if path is None:
+            self.storage.save(name, ContentFile(data))
+            return name
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # write to temporary file in the same directory, then rename over
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        root = local_path(self.storage, '')
+        with _usage_lock:
+            usage = _usage.get(root)
+            if usage is not None:
+                usage = _usage[root] = usage + len(data)
+        if usage is None or usage > self.max_bytes:
+            self.evict()
+        return name
+
+    def invalidate(self, name):
+        """Remove all derivatives of a source file stored under name."""
+        directory = self._source_dir(name)
+        path = local_path(self.storage, directory)
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
+            return
+
+        try:
+            _, filenames = self.storage.listdir(directory)
+        except FileNotFoundError:
+            return
+        for filename in filenames:
+            self.storage.delete(f'{directory}/{filename}')
+
+    def evict(self):
+        """Remove least recently used derivatives until cache fits the budget with some headroom."""
+        root = local_path(self.storage, '')
+        if root is None:
+            return
+
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total > self.max_bytes:
+            target = self.max_bytes * (1 - EVICTION_HEADROOM)
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+        with _usage_lock:
+            _usage[root] = total
+
+
+_storage = None
+
+
+@receiver(setting_changed)
+def reset_thumbnail_storage(**kwargs):
+    """Drop configured storage when tests override settings."""
+    global _storage
+    _storage = None
+    _usage.clear()
+
+
+def get_thumbnail_storage():
+    """Return storage of derivatives, by default a directory under MEDIA_ROOT."""
+    global _storage
+    if _storage is None:
+        if settings.THUMBNAIL_STORAGE:
+            _storage = import_string(settings.THUMBNAIL_STORAGE)(**settings.THUMBNAIL_STORAGE_OPTIONS)
+        else:
+            _storage = FileSystemStorage(location=os.path.join(settings.MEDIA_ROOT, settings.THUMBNAIL_CACHE_PATH))
+    return _storage
+
+
+def get_thumbnail_cache():
+    """Return thumbnail cache configured in settings."""
+    return DerivativeCache(get_thumbnail_storage(), settings.THUMBNAIL_CACHE_MAX_BYTES)
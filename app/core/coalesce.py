@@ -0,0 +1,148 @@
+"""
+Single-flight rendering: concurrent requests for the same thumbnail wait
+for one render instead of each decoding the original.
+
+The lock is a PostgreSQL advisory lock, shared by all workers and nodes
+using the database, or a file lock shared by workers of one node.
+"""
+import asyncio
+import fcntl
+import hashlib
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import connection
+
+
+# file locks are striped over a fixed number of files, so the lock
+# directory never grows and lock files need not be cleaned up
+FILE_LOCK_STRIPES = 1024
+
+POLL_INTERVAL = 0.05
+
+
+def render_key(image, size):
+    """Return lock key of rendering thumbnails of an image at given size."""
+    # derivatives are shared by images of a blob, so is their rendering
+    source = f'{image.image.name}:{size}'
+    return int.from_bytes(hashlib.sha256(source.encode()).digest()[:8], 'big', signed=True)
+
+
+def lock_backend():
+    """Return 'postgres', 'file' or 'off' according to RENDER_LOCK_BACKEND."""
+    backend = settings.RENDER_LOCK_BACKEND
+    if backend == 'auto':
+        return 'postgres' if connection.vendor == 'postgresql' else 'file'
+    return backend
+
+
+class _AdvisoryLock:
+
+    def __init__(self, key):
+        self.key = key
+
+    def try_acquire(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [self.key])
+            return cursor.fetchone()[0]
+
+    def release(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [self.key])
+
+
+class _FileLock:
+
+    def __init__(self, key):
+        directory = os.path.join(settings.MEDIA_ROOT, settings.RENDER_LOCK_PATH)
+        os.makedirs(directory, exist_ok=True)
+        self.lock_file = open(os.path.join(directory, f'{key % FILE_LOCK_STRIPES}.lock'), 'a+b')
+
+    def try_acquire(self):
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def release(self):
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def close(self):
+        self.lock_file.close()
+
+
+@contextmanager
+def single_flight(key):
+    """
+    Hold the render lock of key, yield True when another holder was waited for.
+
+    Waiting gives up after RENDER_LOCK_TIMEOUT seconds and the caller renders
+    without the lock, a stuck render never blocks downloads for good.
+    """
+    backend = lock_backend()
+    if backend == 'off':
+        yield False
+        return
+
+    lock = _AdvisoryLock(key) if backend == 'postgres' else _FileLock(key)
+    try:
+        acquired = lock.try_acquire()
+        waited = not acquired
+        deadline = time.monotonic() + settings.RENDER_LOCK_TIMEOUT
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            acquired = lock.try_acquire()
+
+        try:
+            yield waited
+        finally:
+            if acquired:
+                lock.release()
+    finally:
+        if backend == 'file':
+            lock.close()
+
+
+@asynccontextmanager
+async def async_single_flight(key):
+    """single_flight for async views, the lock is polled without blocking the event loop."""
+    backend = lock_backend()
+    if backend == 'off':
+        yield False
+        return
+
+    if backend == 'postgres':
+        lock = _AdvisoryLock(key)
+        # the advisory lock belongs to the connection of the thread running sync code
+        try_acquire, release = sync_to_async(lock.try_acquire), sync_to_async(lock.release)
+    else:
+        lock = _FileLock(key)
+        # non-blocking flock returns at once, no thread needed
+
+        async def try_acquire():
+            return lock.try_acquire()
+
+        async def release():
+            lock.release()
+
+    try:
+        acquired = await try_acquire()
+        waited = not acquired
+        deadline = time.monotonic() + settings.RENDER_LOCK_TIMEOUT
+        while not acquired and time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            acquired = await try_acquire()
+
+        try:
+            yield waited
+        finally:
+            if acquired:
+                await release()
+    finally:
+        if backend == 'file':
+            lock.close()
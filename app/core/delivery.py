@@ -0,0 +1,209 @@
+"""
+HTTP delivery of images.
+
+Decisions shared by the sync and async download views live here: grant
+checks, format negotiation, validators, filenames and headers. The views
+only do the I/O, blocking or awaited.
+"""
+import hashlib
+import mimetypes
+import os
+import time
+from collections import namedtuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import content_disposition_header, http_date
+
+from rest_framework import status
+
+from core import metrics, transforms
+from core.imaging import OUTPUT_FORMATS
+from core.pipeline import output_formats
+from core.storage import source_version
+
+
+# thumbnail download allowed by a grant or link, derivative is True for
+# plan thumbnails, which the pipeline renders into the cache ahead of time
+Variant = namedtuple('Variant', ['transform', 'quality', 'max_age', 'derivative'])
+
+
+def unauthorized():
+    """Return response of a download the grant doesn't allow."""
+    return HttpResponse(f'error: {status.HTTP_401_UNAUTHORIZED} unauthorized')
+
+
+def invalid_transform(exc):
+    """Return response of a malformed transform spec."""
+    return HttpResponse(f'error: {status.HTTP_400_BAD_REQUEST} {exc}', status=status.HTTP_400_BAD_REQUEST)
+
+
+def link_expired():
+    """Return response of an expired signed link."""
+    return HttpResponse(f'error: {status.HTTP_410_GONE} link expired', status=status.HTTP_410_GONE)
+
+
+def thumbnail_variant(image, grant, size):
+    """Return Variant of a plan thumbnail download, None when the grant doesn't allow it."""
+    if image.owner_id != grant.user_id or size not in grant.sizes:
+        return None
+    return Variant(transforms.for_height(size), grant.sizes[size], grant.cache_max_age, True)
+
+
+def transform_variant(image, grant, transform):
+    """Return Variant of an on-the-fly resize, None when the grant doesn't allow it."""
+    if image.owner_id != grant.user_id or not transforms.allowed(transform, grant.transforms):
+        return None
+    if transform.family == 'height' and transform.pixel_height in grant.sizes:
+        # same output as a plan thumbnail, served from its derivative at its quality
+        return Variant(transform, grant.sizes[transform.pixel_height], grant.cache_max_age, True)
+    # other variants are rendered by the request at the Pillow default quality
+    return Variant(transform, None, grant.cache_max_age, False)
+
+
+def link_variant(size, quality, expires):
+    """Return Variant of a thumbnail download by signed link, cached until the link expires."""
+    return Variant(transforms.for_height(size), quality, link_max_age(expires), True)
+
+
+def link_max_age(expires):
+    """Return Cache-Control max-age of a download by signed link."""
+    return max(int(expires - time.time()), 0)
+
+
+def original_allowed(image, grant):
+    """Return True when the grant allows downloading the original of an image."""
+    return image.owner_id == grant.user_id and grant.original_size
+
+
+def validators(image, variant):
+    """Return strong ETag and Last-Modified timestamp of an image variant."""
+    version, last_modified = source_version(image)
+    source = f'{image.pk}:{variant}:{image.image.name}:{version}'
+    return f'"{hashlib.sha256(source.encode()).hexdigest()[:32]}"', last_modified
+
+
+def accepted_media_types(request):
+    """Return media types listed in Accept header with non-zero quality."""
+    accepted = set()
+    for media_range in request.META.get('HTTP_ACCEPT', '').split(','):
+        media_type, *params = [part.strip() for part in media_range.split(';')]
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if media_type and weight > 0:
+            accepted.add(media_type.lower())
+    return accepted
+
+
+def negotiate_format(request):
+    """Return thumbnail format to send: first of THUMBNAIL_FORMATS the client accepts."""
+    accepted = accepted_media_types(request)
+    for image_format in output_formats():
+        # wildcards don't count, clients sending only */* get the JPEG fallback
+        if image_format == 'JPEG' or OUTPUT_FORMATS[image_format][0] in accepted:
+            return image_format
+    return 'JPEG'
+
+
+def thumbnail_validators(image, variant, image_format):
+    """Return ETag and Last-Modified timestamp of a thumbnail in a format."""
+    return validators(image, f'{variant.transform.key}:{image_format}:{variant.quality}')
+
+
+def thumbnail_file(image, variant, image_format):
+    """Return (content type, download filename) of a thumbnail in a format."""
+    content_type, extension = OUTPUT_FORMATS[image_format]
+    return content_type, f'thumbnail-{image.pk}-{variant.transform.label}.{extension}'
+
+
+def original_file(image):
+    """Return (content type, download filename) of an original."""
+    content_type, _ = mimetypes.guess_type(image.image.name)
+    return content_type or 'application/octet-stream', image.display_name
+
+
+def queued(variant):
+    """Return True when a missing thumbnail is left to render_worker instead of rendered by the request."""
+    # only plan thumbnails have a Derivative the worker marks as ready
+    return settings.THUMBNAIL_PIPELINE == 'queue' and variant.derivative
+
+
+def render_pending():
+    """Return response asking the client to retry once render_worker rendered the thumbnail."""
+    response = HttpResponse('thumbnail is being rendered, retry later', status=status.HTTP_202_ACCEPTED)
+    response['Retry-After'] = '1'
+    return response
+
+
+def vary_on_accept(response):
+    """Mark a thumbnail response as negotiated."""
+    # thumbnail format depends on Accept header, shared caches must key on it
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def add_caching_headers(response, etag, last_modified, max_age):
+    """Set validators and Cache-Control of an image response."""
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, max_age=max_age)
+    return response
+
+
+def not_modified(request, etag, last_modified, max_age):
+    """Return 304 response when the client copy is still valid, None otherwise."""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        add_caching_headers(response, etag, last_modified, max_age)
+    return response
+
+
+def served_by_web_server(file, backend):
+    """Return True when the web server can send a file in place of the app."""
+    if backend == 'python' or not os.path.isabs(file.name):
+        # files of object stores have no local path the web server could read
+        return False
+    if backend == 'x-accel':
+        media_root = os.path.abspath(settings.MEDIA_ROOT)
+        return os.path.commonpath([media_root, os.path.abspath(file.name)]) == media_root
+    return True
+
+
+def file_response(file, content_type, filename):
+    """
+    Return response delivering an open file from a storage.
+
+    With 'x-accel' or 'x-sendfile' IMAGE_DELIVERY_BACKEND a local file is
+    closed and the web server is told to send it, freeing the worker right
+    away. Other files are streamed in blocks.
+    """
+    backend = settings.IMAGE_DELIVERY_BACKEND
+    if not served_by_web_server(file, backend):
+        metrics.add('storage_read_bytes', file.size)
+        response = FileResponse(file, content_type=content_type)
+    else:
+        file.close()
+        response = HttpResponse(content_type=content_type)
+        if backend == 'x-accel':
+            path = os.path.relpath(file.name, settings.MEDIA_ROOT)
+            response['X-Accel-Redirect'] = settings.IMAGE_ACCEL_PREFIX + quote(path)
+        else:
+            response['X-Sendfile'] = file.name
+
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+
+def data_response(data, content_type, filename):
+    """Return response of a thumbnail rendered by the request."""
+    response = HttpResponse(data, content_type=content_type)
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
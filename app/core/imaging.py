@@ -0,0 +1,100 @@
+"""
+Image processing helpers.
+"""
+import io
+
+from PIL import Image as PILImage
+
+try:
+    # AVIF encoder of Pillow versions without built-in AVIF support
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+from core import metrics, transforms
+
+
+# resize first reduces image by an integer factor (cheap box filter) as long
+# as the result stays at least REDUCING_GAP times bigger than the target
+REDUCING_GAP = 3.0
+
+
+# media type and file extension of thumbnail output formats
+OUTPUT_FORMATS = {
+    'JPEG': ('image/jpeg', 'jpg'),
+    'WEBP': ('image/webp', 'webp'),
+    'AVIF': ('image/avif', 'avif'),
+}
+
+
+def can_encode(image_format):
+    """Return True when this Pillow build (with its plugins) can write the format."""
+    PILImage.init()
+    return image_format in PILImage.SAVE
+
+
+def resize(source, transform):
+    """Decode image from a path or an open file and return it transformed as RGB."""
+    with PILImage.open(source) as original_image:
+        size, box = transforms.geometry(transform, original_image.width, original_image.height)
+
+        if original_image.format == 'JPEG':
+            # let the decoder scale DCT blocks by 1/2, 1/4 or 1/8, so only the
+            # smallest image still covering the thumbnail is ever decoded;
+            # other formats fall back to a full decode
+            crop_width, crop_height = box[2] - box[0], box[3] - box[1]
+            scale = max(size[0] / crop_width, size[1] / crop_height)
+            full_width, full_height = original_image.width, original_image.height
+            original_image.draft('RGB', (int(full_width * scale), int(full_height * scale)))
+            # the box is scaled along with the decoded image
+            box = tuple(
+                coordinate * original_image.width / full_width if i % 2 == 0
+                else coordinate * original_image.height / full_height
+                for i, coordinate in enumerate(box)
+            )
+
+        with metrics.timer('decode_seconds'):
+            original_image.load()
+
+        # crop, convert and resize image
+        with metrics.timer('resize_seconds'):
+            thumbnail = original_image.resize(
+                size,
+                PILImage.LANCZOS,
+                box=box,
+                reducing_gap=REDUCING_GAP,
+            )
+            return thumbnail.convert('RGB')
+
+
+def resize_to_height(source, height):
+    """Decode image from a path or an open file and return it resized to given height as RGB."""
+    return resize(source, transforms.for_height(height))
+
+
+def encode(thumbnail, image_format='JPEG', quality=None):
+    """Encode image into the output format and return its bytes."""
+    options = {}
+    if quality is not None:
+        options['quality'] = quality
+    if image_format == 'JPEG':
+        # progressive scans are smaller and show early on slow connections
+        options.update(optimize=True, progressive=True)
+    elif image_format == 'WEBP':
+        options['method'] = 4
+
+    buffer = io.BytesIO()
+    with metrics.timer('encode_seconds'):
+        thumbnail.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def render_thumbnail(source, variant, image_format='JPEG', quality=None):
+    """Render a thumbnail of given height or Transform and return its bytes."""
+    return encode(resize(source, transforms.coerce(variant)), image_format, quality)
+
+
+def render_thumbnails(source, variant, formats, quality=None):
+    """Resize image once and return {format: bytes} of the thumbnail in every format."""
+    thumbnail = resize(source, transforms.coerce(variant))
+    return {image_format: encode(thumbnail, image_format, quality) for image_format in formats}
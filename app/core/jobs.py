@@ -0,0 +1,85 @@
+"""
+Database backed queue of thumbnail rendering jobs.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models import Derivative, RenderJob
+
+
+def enqueue(image, sizes):
+    """Queue rendering of image thumbnails, skipping already active jobs."""
+    enqueue_many([(image, size) for size in sizes])
+
+
+def enqueue_many(thumbnails):
+    """Queue rendering of (image, size) thumbnails in one statement."""
+    RenderJob.objects.bulk_create(
+        [RenderJob(image=image, size=size) for image, size in thumbnails],
+        ignore_conflicts=True,
+    )
+
+
+def claim(worker, limit, visibility_timeout, max_attempts=None):
+    """
+    Lock and return up to limit jobs for a worker.
+
+    Rows are picked with SELECT ... FOR UPDATE SKIP LOCKED so concurrent
+    workers never claim the same job. Running jobs whose visibility
+    timeout has passed are considered abandoned and are claimed again,
+    unless they already had max_attempts: a job whose worker keeps dying
+    on it is marked as failed instead.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            RenderJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(Q(status=RenderJob.QUEUED) | Q(status=RenderJob.RUNNING), available_at__lte=now)
+            .order_by('available_at')[:limit]
+        )
+        if max_attempts is not None:
+            abandoned = [job for job in jobs if job.status == RenderJob.RUNNING and job.attempts >= max_attempts]
+            if abandoned:
+                _abandon(abandoned, now)
+                jobs = [job for job in jobs if job not in abandoned]
+        RenderJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=RenderJob.RUNNING,
+            attempts=F('attempts') + 1,
+            available_at=now + timedelta(seconds=visibility_timeout),
+            locked_by=worker,
+            updated_at=now,
+        )
+
+    return list(RenderJob.objects.select_related('image__blob').filter(pk__in=[job.pk for job in jobs]))
+
+
+def _abandon(jobs, now):
+    RenderJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+        status=RenderJob.FAILED,
+        last_error='Worker did not finish the last attempt within the visibility timeout.',
+        updated_at=now,
+    )
+    for job in jobs:
+        Derivative.objects.filter(image_id=job.image_id, size=job.size).update(status=Derivative.FAILED)
+
+
+def complete(job):
+    """Mark job as done."""
+    job.status = RenderJob.DONE
+    job.last_error = ''
+    job.save(update_fields=['status', 'last_error', 'updated_at'])
+
+
+def fail(job, error, max_attempts, retry_delay):
+    """Schedule job for a retry or mark it as failed after max_attempts."""
+    job.last_error = error
+    if job.attempts >= max_attempts:
+        job.status = RenderJob.FAILED
+    else:
+        job.status = RenderJob.QUEUED
+        job.available_at = timezone.now() + timedelta(seconds=retry_delay * job.attempts)
+    job.save(update_fields=['status', 'last_error', 'available_at', 'updated_at'])
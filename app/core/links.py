@@ -0,0 +1,36 @@
+"""
+Stateless signed links to images.
+
+A link carries image id, variant ('original' or thumbnail size) and expiry
+time, signed with HMAC by django.core.signing. Verifying it needs no
+database lookup.
+"""
+import time
+
+from django.core import signing
+
+
+SALT = 'core.links'
+
+
+class LinkExpired(Exception):
+    """Signed link is valid but its expiry time has passed."""
+
+
+def sign(image_id, variant, expires_in):
+    """Return signed link value for image variant valid for expires_in seconds."""
+    expires = int(time.time()) + expires_in
+    return signing.dumps([image_id, variant, expires], salt=SALT)
+
+
+def verify(value):
+    """
+    Return (image_id, variant, expires) of signed link value.
+
+    Raises signing.BadSignature for forged values and LinkExpired
+    for outdated ones.
+    """
+    image_id, variant, expires = signing.loads(value, salt=SALT)
+    if expires <= time.time():
+        raise LinkExpired()
+    return image_id, variant, expires
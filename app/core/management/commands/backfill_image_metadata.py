@@ -0,0 +1,48 @@
+"""
+Django command storing dimensions, format and size of images uploaded before
+they were recorded at ingest.
+"""
+from django.core.management.base import BaseCommand
+
+from core.models import Image
+from core.uploads import open_header
+
+
+class Command(BaseCommand):
+    """Django command reading image headers once into Image rows."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Rows updated per statement.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        fields = ['width', 'height', 'image_format', 'file_size']
+        images = Image.objects.filter(width__isnull=True).only('id', 'image').order_by('id')
+        batch = []
+        updated = 0
+
+        for image in images.iterator(chunk_size=options['batch_size']):
+            storage = image.image.storage
+            try:
+                # only the header is read, object stores fetch it with ranged GETs
+                with storage.open(image.image.name, 'rb') as source:
+                    image.image_format, (image.width, image.height) = open_header(source)
+                image.file_size = storage.size(image.image.name)
+            except Exception as exc:
+                self.stdout.write(self.style.WARNING(f'Skipping image {image.pk}: {exc!r}'))
+                continue
+
+            batch.append(image)
+            if len(batch) == options['batch_size']:
+                Image.objects.bulk_update(batch, fields)
+                updated += len(batch)
+                batch = []
+
+        if batch:
+            Image.objects.bulk_update(batch, fields)
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Stored metadata of {updated} images'))
@@ -0,0 +1,62 @@
+"""
+Django command moving existing images into content-addressed blobs.
+"""
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import blobs
+from core.cache import get_thumbnail_cache
+from core.models import Blob, Image
+
+
+class Command(BaseCommand):
+    """Django command deduplicating images uploaded before blob storage."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report how much space deduplication would free.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        cache = get_thumbnail_cache()
+        seen = set(Blob.objects.values_list('sha256', flat=True))
+        images = Image.objects.filter(blob__isnull=True).order_by('id')
+        moved = 0
+        freed = 0
+
+        for image in images.iterator():
+            name = image.image.name
+            try:
+                source = image.image.storage.open(name, 'rb')
+            except FileNotFoundError:
+                self.stdout.write(self.style.WARNING(f'Missing file of image {image.pk}: {name}'))
+                continue
+
+            with source:
+                upload = File(source, name=name)
+                digest = blobs.file_sha256(upload)
+                if digest in seen:
+                    freed += upload.size
+                seen.add(digest)
+                moved += 1
+                if options['dry_run']:
+                    continue
+
+                with transaction.atomic():
+                    blob = blobs.store(upload)
+                    Image.objects.filter(pk=image.pk).update(
+                        image=blob.file.name, blob=blob, filename=image.display_name,
+                    )
+
+            # the old file belonged to this image only, uploads got unique names
+            if name != blob.file.name and not Image.objects.filter(image=name).exists():
+                image.image.storage.delete(name)
+            cache.invalidate(name)
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {moved} images into {len(seen)} blobs, freeing {freed} bytes'
+        ))
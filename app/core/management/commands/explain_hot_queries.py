@@ -0,0 +1,113 @@
+"""
+Django command printing query plans of the hot queries of the API.
+
+With --seed, owners and images are created in a transaction that is rolled
+back at the end, so the command is safe to run against any database. With
+--check it fails when a hot query reads a whole table, to catch index
+regressions in CI.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import Count
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_framework.authtoken.models import Token
+
+from core.models import IMAGE_LISTING_FIELDS, Derivative, Image, Plan, User
+
+
+# full table reads in PostgreSQL and SQLite plans
+FULL_SCAN_RES = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (\w+)$', re.MULTILINE),
+}
+
+
+class Command(BaseCommand):
+    """Django command running EXPLAIN (ANALYZE on PostgreSQL) on hot queries."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Create this many images for the plans (rolled back), use existing rows otherwise.',
+        )
+        parser.add_argument('--owners', type=int, default=100, help='Owners of seeded images.')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--check', action='store_true', help='Fail when a hot query reads a whole table.')
+
+    def _seed(self, images, owners):
+        plan = Plan.objects.create(name='explain-hot-queries', original_size=True, expiring_link=True)
+        users = User.objects.bulk_create(
+            User(username=f'explain-hot-queries-{i}', plan=plan) for i in range(owners)
+        )
+        Token.objects.bulk_create(Token(key=Token.generate_key(), user=user) for user in users)
+        seeded = Image.objects.bulk_create(
+            Image(
+                owner=users[i % owners], image=f'uploads/seed/{i}.jpg', filename=f'{i}.jpg',
+                width=1600, height=1000, image_format='JPEG', file_size=250000,
+            )
+            for i in range(images)
+        )
+        Derivative.objects.bulk_create(
+            Derivative(image=image, size=size, status=Derivative.READY) for image in seeded for size in (200, 400)
+        )
+        # planner statistics of the seeded rows, SQLite plans on indexes without them
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for model in (User, Token, Image, Derivative):
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+    def _hot_queries(self, page_size):
+        owner = User.objects.annotate(image_count=Count('images')).order_by('-image_count').first()
+        if owner is None or not owner.image_count:
+            raise CommandError('No images to explain queries on, use --seed.')
+        images = Image.objects.filter(owner=owner)
+        page = list(images.order_by('id').values_list('id', flat=True)[:page_size])
+        token = Token.objects.filter(user=owner).first()
+
+        queries = {
+            # api/image: images of the owner newest first
+            'image_viewset': images.order_by('-id')[:page_size],
+            # images-list: next page after a cursor with listing columns
+            'images_list_page': (
+                images.filter(id__gt=page[0]).order_by('id').values('id', *IMAGE_LISTING_FIELDS)[:page_size]
+            ),
+            'images_list_statuses': (
+                Derivative.objects.filter(image_id__in=page).values_list('image_id', 'size', 'status')
+            ),
+            # bulk-delete by id range
+            'bulk_delete_range': images.filter(pk__gte=page[0], pk__lte=page[-1]).values_list('pk', flat=True),
+            # downloads: image row and token owner
+            'download_image': Image.objects.select_related('blob').filter(pk=page[-1]),
+        }
+        if token is not None:
+            queries['download_token'] = Token.objects.filter(key=token.key).values_list('user_id', flat=True)
+        return queries
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        vendor = connection.vendor
+        explain_options = {'analyze': True, 'buffers': True} if vendor == 'postgresql' else {}
+        full_scans = {}
+
+        with transaction.atomic():
+            if options['seed']:
+                self._seed(options['seed'], options['owners'])
+
+            for name, queryset in self._hot_queries(options['page_size']).items():
+                plan = queryset.explain(**explain_options)
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                self.stdout.write(plan)
+                full_scan_re = FULL_SCAN_RES.get(vendor)
+                if full_scan_re is not None and full_scan_re.search(plan):
+                    full_scans[name] = sorted(set(full_scan_re.findall(plan)))
+
+            transaction.set_rollback(True)
+
+        if full_scans and options['check']:
+            raise CommandError('Full table reads in ' + ', '.join(
+                f'{name} ({", ".join(tables)})' for name, tables in full_scans.items()
+            ))
+        for name, tables in full_scans.items():
+            self.stdout.write(self.style.WARNING(f'{name} reads whole tables: {", ".join(tables)}'))
@@ -0,0 +1,48 @@
+"""
+Django command browsing profiles of slow and sampled requests.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core import profiling
+from core.models import Plan
+
+
+class Command(BaseCommand):
+    """Django command listing stored profiles or summarizing one of them."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', nargs='?', help='Summarize this profile instead of listing.')
+        parser.add_argument('--endpoint', help='List profiles of this URL name only, e.g. core:download.')
+        parser.add_argument('--limit', type=int, default=20, help='Profiles listed.')
+        parser.add_argument('--top', type=int, default=20, help='Functions shown by cumulative time.')
+
+    def _describe(self, meta, plans):
+        tags = dict(meta['tags'])
+        plan_id = tags.pop('plan_id', None)
+        if plan_id is not None:
+            tags['plan'] = plans.get(plan_id, plan_id)
+        tags = ' '.join(f'{key}={value}' for key, value in sorted(tags.items()))
+        return f'{meta["id"]}  {meta["endpoint"]}  {meta["duration_ms"]}ms  {meta["kind"]}  {tags}'
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        profiles = profiling.list_profiles()
+        plans = dict(Plan.objects.values_list('id', 'name'))
+
+        if options['profile_id']:
+            meta = next((meta for meta in profiles if meta['id'] == options['profile_id']), None)
+            if meta is None:
+                raise CommandError(f'No profile {options["profile_id"]} in the profile directory.')
+
+            self.stdout.write(self._describe(meta, plans))
+            self.stdout.write(f'{"cumulative ms":>14}  {"own ms":>10}  {"calls":>8}  function')
+            for label, cumulative, own, calls in profiling.top_functions(meta, options['top']):
+                self.stdout.write(f'{cumulative * 1000:>14.1f}  {own * 1000:>10.1f}  {calls:>8}  {label}')
+            return
+
+        if options['endpoint']:
+            profiles = [meta for meta in profiles if meta['endpoint'] == options['endpoint']]
+        if not profiles:
+            self.stdout.write(self.style.WARNING('No profiles stored'))
+        for meta in profiles[:options['limit']]:
+            self.stdout.write(self._describe(meta, plans))
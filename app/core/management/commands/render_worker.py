@@ -0,0 +1,133 @@
+"""
+Django command rendering queued thumbnails in a pool of processes.
+"""
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import jobs
+from core.models import Derivative, RenderJob
+from core.pipeline import output_formats, render_stored, store_thumbnail, thumbnail_qualities
+
+
+class Command(BaseCommand):
+    """Django command processing RenderJob queue."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=os.cpu_count(),
+            help='Number of rendering processes.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Jobs claimed per poll, defaults to concurrency.',
+        )
+        parser.add_argument(
+            '--visibility-timeout', type=int, default=300,
+            help='Seconds after which a running job is handed to another worker.',
+        )
+        parser.add_argument(
+            '--max-attempts', type=int, default=3,
+            help='Attempts before a job is marked as failed.',
+        )
+        parser.add_argument(
+            '--retry-delay', type=int, default=30,
+            help='Base delay in seconds between attempts, grows with every attempt.',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to sleep when queue is empty.',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit when queue is empty.',
+        )
+        parser.add_argument(
+            '--sync', action='store_true',
+            help='Render in this process without a pool (test mode, works with SQLite).',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        batch_size = options['batch_size'] or options['concurrency']
+
+        pool = None if options['sync'] else self._pool(options['concurrency'])
+
+        self.stdout.write(f'Render worker {worker} started.')
+        processed = 0
+        try:
+            while True:
+                claimed = jobs.claim(worker, batch_size, options['visibility_timeout'], options['max_attempts'])
+                if not claimed:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                qualities = thumbnail_qualities({job.size for job in claimed})
+                pending = {job.pk: job for job in claimed}
+                try:
+                    for job, renders, error in self._render(pool, claimed, qualities):
+                        del pending[job.pk]
+                        if error is None:
+                            store_thumbnail(job.image, job.size, renders, qualities[job.size])
+                            jobs.complete(job)
+                        else:
+                            self._fail(job, error, options)
+                        processed += 1
+                except BrokenProcessPool as exc:
+                    # a rendering process died (OOM kill, crash in a decoder), the pool takes no more work
+                    self.stderr.write(f'Rendering process died, requeueing {len(pending)} jobs.')
+                    for job in pending.values():
+                        self._fail(job, repr(exc), options)
+                    pool.shutdown(wait=False)
+                    pool = self._pool(options['concurrency'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} render jobs.'))
+
+    def _pool(self, concurrency):
+        # forked processes must not share parent's database connections
+        connections.close_all()
+        return ProcessPoolExecutor(max_workers=concurrency)
+
+    def _fail(self, job, error, options):
+        jobs.fail(job, error, options['max_attempts'], options['retry_delay'])
+        if job.status == RenderJob.FAILED:
+            Derivative.objects.filter(image=job.image, size=job.size).update(status=Derivative.FAILED)
+
+    def _render(self, pool, claimed, qualities):
+        """Yield (job, {format: data}, error) for every claimed job."""
+        formats = output_formats()
+        if pool is None:
+            for job in claimed:
+                try:
+                    renders = render_stored(job.image.image.name, job.size, formats, qualities[job.size])
+                    yield job, renders, None
+                except Exception as exc:
+                    yield job, None, repr(exc)
+            return
+
+        futures = {
+            pool.submit(render_stored, job.image.image.name, job.size, formats, qualities[job.size]): job
+            for job in claimed
+        }
+        for future in as_completed(futures):
+            try:
+                renders = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as exc:
+                yield futures[future], None, repr(exc)
+            else:
+                yield futures[future], renders, None
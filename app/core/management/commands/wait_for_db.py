@@ -1,17 +1,53 @@
 """
 Django command to wait for the database to be available.
 """
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from psycopg2 import OperationalError as Psycopg2OpError
 
+from django.db import connections
 from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 
 class Command(BaseCommand):
     """Django command to wait for database."""
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--connections', type=int, default=0,
+            help='Open this many connections at once once the database is up, '
+                 'e.g. app workers times threads, to check they are admitted.',
+        )
+
+    def _open(self, barrier):
+        # every connection is held until all are open, like the pools of the workers
+        connection = None
+        try:
+            connection = connections.create_connection('default')
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            barrier.wait()
+        except BaseException:
+            barrier.abort()
+            raise
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def warm_up(self, count):
+        """Open count connections concurrently, raise CommandError when any is refused."""
+        barrier = threading.Barrier(count, timeout=30)
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            futures = [executor.submit(self._open, barrier) for _ in range(count)]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            # other threads only saw the barrier broken by the refused one
+            error = next((error for error in errors if not isinstance(error, threading.BrokenBarrierError)), errors[0])
+            raise CommandError(f'Database did not admit {count} connections at once: {error!r}')
+
     def handle(self, *args, **options):
         """Entrypoint for command."""
         self.stdout.write('Waiting for database...')
@@ -25,3 +61,7 @@ class Command(BaseCommand):
                 time.sleep(1)
 
         self.stdout.write(self.style.SUCCESS('Database available!'))
+
+        if options['connections']:
+            self.warm_up(options['connections'])
+            self.stdout.write(self.style.SUCCESS(f'Opened {options["connections"]} connections at once'))
@@ -0,0 +1,176 @@
+"""
+Process-wide counters and histograms, exposed in Prometheus text format.
+
+Hot paths add to measures of the current request (DB queries, Pillow
+decode/resize/encode time, storage bytes, cache hits) with add() and
+timer(). MetricsMiddleware starts a request and, once it is answered,
+observes every measure into a histogram labelled with the endpoint.
+Outside a request, measures are dropped.
+"""
+import contextvars
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024, 100 * 1024 * 1024)
+
+# measures of a request exported per endpoint, histogram buckets or None for counters
+MEASURES = {
+    'db_queries': COUNT_BUCKETS,
+    'db_seconds': TIME_BUCKETS,
+    'decode_seconds': TIME_BUCKETS,
+    'resize_seconds': TIME_BUCKETS,
+    'encode_seconds': TIME_BUCKETS,
+    'storage_read_bytes': BYTE_BUCKETS,
+    'storage_write_bytes': BYTE_BUCKETS,
+    'cache_hits': None,
+    'cache_misses': None,
+}
+# measured by every request, observed even when zero
+ALWAYS_MEASURED = ('db_queries', 'db_seconds')
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': TIME_BUCKETS,
+    **{name: buckets for name, buckets in MEASURES.items() if buckets is not None},
+}
+
+_lock = threading.Lock()
+_counters = Counter()
+# (name, labels): [bucket counts, sum, count]
+_histograms = {}
+
+_request = contextvars.ContextVar('metrics_request', default=None)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def increment(name, value=1, **labels):
+    """Add value to a named counter."""
+    with _lock:
+        _counters[(name, _labels(labels))] += value
+
+
+def observe(name, value, **labels):
+    """Record value in a named histogram."""
+    buckets = HISTOGRAMS[name]
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(buckets), 0, 0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def snapshot():
+    """Return {series: value} of all counters."""
+    with _lock:
+        return {_series(name, labels): value for (name, labels), value in _counters.items()}
+
+
+def add(name, value=1):
+    """Add value to a measure of the current request."""
+    measures = _request.get()
+    if measures is not None:
+        measures[name] += value
+
+
+@contextmanager
+def timer(name):
+    """Add seconds spent in the block to a measure of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - start)
+
+
+def start_request():
+    """Start collecting measures of a request, return token for finish_request."""
+    return _request.set(Counter({name: 0 for name in ALWAYS_MEASURED}))
+
+
+def finish_request(token, endpoint, status_code, duration):
+    """Export measures of the request to per-endpoint metrics and return them."""
+    measures = _request.get()
+    _request.reset(token)
+
+    observe('http_request_duration_seconds', duration, endpoint=endpoint)
+    increment('http_requests_total', endpoint=endpoint, status=status_code)
+    for name, value in measures.items():
+        if MEASURES[name] is None:
+            increment(f'{name}_total', value, endpoint=endpoint)
+        else:
+            observe(name, value, endpoint=endpoint)
+    return measures
+
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper adding queries and their time to the current request."""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        add('db_seconds', time.perf_counter() - start)
+        add('db_queries')
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """Install time_query on a new database connection."""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def server_timing(measures, duration):
+    """Return Server-Timing header value of request measures."""
+    timings = [f'db;dur={measures["db_seconds"] * 1000:.1f};desc="{measures["db_queries"]} queries"']
+    for step in ('decode', 'resize', 'encode'):
+        if f'{step}_seconds' in measures:
+            timings.append(f'{step};dur={measures[f"{step}_seconds"] * 1000:.1f}')
+    timings.append(f'total;dur={duration * 1000:.1f}')
+    return ', '.join(timings)
+
+
+def render():
+    """Return all metrics in Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in _histograms.items())
+
+    lines = []
+    metric = None
+    for (name, labels), value in counters:
+        if name != metric:
+            metric = name
+            lines.append(f'# TYPE {name} counter')
+        lines.append(f'{_series(name, labels)} {value}')
+
+    for (name, labels), (counts, total, count) in histograms:
+        if name != metric:
+            metric = name
+            lines.append(f'# TYPE {name} histogram')
+        for bound, bucket_count in zip(HISTOGRAMS[name], counts):
+            lines.append(f'{_series(f"{name}_bucket", labels + (("le", bound),))} {bucket_count}')
+        lines.append(f'{_series(f"{name}_bucket", labels + (("le", "+Inf"),))} {count}')
+        lines.append(f'{_series(f"{name}_sum", labels)} {total}')
+        lines.append(f'{_series(f"{name}_count", labels)} {count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,115 @@
+"""
+Middleware of the image API.
+"""
+import cProfile
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from core import metrics, profiling
+
+
+class MetricsMiddleware:
+    """
+    Collect per-request measures and export them per endpoint.
+
+    Under DEBUG the breakdown is also sent in a Server-Timing header, shown
+    by browser devtools. Works around sync and async views alike.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = metrics.start_request()
+        start = time.perf_counter()
+        response = self.get_response(request)
+        return self._finish(request, response, token, start)
+
+    async def __acall__(self, request):
+        token = metrics.start_request()
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        return self._finish(request, response, token, start)
+
+    def _endpoint(self, request):
+        # URL names keep label cardinality bounded, unlike paths
+        match = getattr(request, 'resolver_match', None)
+        return match.view_name if match is not None else 'unmatched'
+
+    def _finish(self, request, response, token, start):
+        duration = time.perf_counter() - start
+        measures = metrics.finish_request(token, self._endpoint(request), response.status_code, duration)
+        if settings.DEBUG:
+            response['Server-Timing'] = metrics.server_timing(measures, duration)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Keep profiles of slow requests and of a random sample of requests.
+
+    Sync requests only: under ASGI, async views share the event loop thread
+    and are passed through unprofiled.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_REQUESTS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.get_response(request)
+
+        token = profiling.start_request()
+        profiler = None
+        if random.random() < settings.PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+        else:
+            sampler = profiling.get_sampler()
+            samples = sampler.register()
+
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            if profiler is None:
+                sampler.unregister()
+            tags = profiling.finish_request(token)
+
+        if profiler is not None or (duration >= settings.PROFILE_SLOW_SECONDS and samples):
+            match = getattr(request, 'resolver_match', None)
+            meta = {
+                'endpoint': match.view_name if match is not None else 'unmatched',
+                'method': request.method,
+                # the route, not the path: download paths carry tokens
+                'route': match.route if match is not None else None,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 1),
+                'tags': tags,
+            }
+            profiling.save(meta, samples=None if profiler else samples, profiler=profiler)
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.10 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_renderjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plan',
+            name='cache_max_age',
+            field=models.PositiveIntegerField(default=86400),
+        ),
+    ]
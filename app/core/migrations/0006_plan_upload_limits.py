@@ -0,0 +1,23 @@
+# Generated by Django 4.0.10 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_plan_cache_max_age'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plan',
+            name='max_upload_bytes',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='plan',
+            name='max_upload_pixels',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.0.10 on 2026-10-18 18:37
+
+import core.transforms
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_thumbnail_quality'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plan',
+            name='transform_families',
+            field=models.CharField(blank=True, help_text='Comma separated: height, width, fit, fill and dpr (allows @2x and @3x).', max_length=64, validators=[core.transforms.validate_families]),
+        ),
+    ]
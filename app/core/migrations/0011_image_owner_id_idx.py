@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_image_metadata'),
+    ]
+
+    operations = [
+        # the composite index is built before the owner_id index it replaces is dropped
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['owner', '-id'], include=('image', 'filename', 'width', 'height', 'image_format', 'file_size'), name='image_owner_id_idx'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='images', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -4,11 +4,15 @@ Database models.
 import os
 import uuid
 
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-from django.db.models.signals import pre_delete
+from django.utils import timezone
+from django.db.models.signals import pre_delete, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import AbstractUser, UserManager as AbstractUserManager
 
+from core.transforms import validate_families
+
 
 def image_file_path(instance, filename):
     """Generate file path for new recipe image."""
@@ -18,11 +22,29 @@ def image_file_path(instance, filename):
     return os.path.join('uploads', 'images', filename)
 
 
+def blob_file_path(instance, filename):
+    """Generate content-addressed file path sharded by hash prefix."""
+    ext = os.path.splitext(filename)[1].lower()
+    digest = instance.sha256
+
+    return os.path.join('uploads', 'blobs', digest[:2], digest[2:4], f'{digest}{ext}')
+
+
 class Plan(models.Model):
     name = models.CharField(max_length=255, unique=True)
     thumbnails = models.ManyToManyField('Thumbnail')
     original_size = models.BooleanField()
     expiring_link = models.BooleanField()
+    # Cache-Control max-age of downloaded images in seconds
+    cache_max_age = models.PositiveIntegerField(default=86400)
+    # upload limits, settings UPLOAD_MAX_BYTES / UPLOAD_MAX_PIXELS apply when empty
+    max_upload_bytes = models.PositiveIntegerField(null=True, blank=True)
+    max_upload_pixels = models.PositiveIntegerField(null=True, blank=True)
+    # on-the-fly resize families allowed in download URLs, comma separated
+    transform_families = models.CharField(
+        max_length=64, blank=True, validators=[validate_families],
+        help_text='Comma separated: height, width, fit, fill and dpr (allows @2x and @3x).',
+    )
 
     def __str__(self):
         return self.name
@@ -30,6 +52,10 @@ class Plan(models.Model):
 
 class Thumbnail(models.Model):
     size = models.PositiveIntegerField(unique=True)
+    # encoder quality of JPEG/WebP/AVIF output, Pillow default (75) when empty
+    quality = models.PositiveSmallIntegerField(
+        null=True, blank=True, validators=[MinValueValidator(1), MaxValueValidator(100)],
+    )
 
     def __str__(self):
         return f'Thumbnail height: {self.size}px'
@@ -64,15 +90,181 @@ class User(AbstractUser):
     objects = UserManager()
 
 
+class Blob(models.Model):
+    """Stored file shared by all images with identical content."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=blob_file_path)
+    size = models.PositiveBigIntegerField()
+    # number of images pointing at this blob, file is removed when it drops to zero
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Blob {self.sha256} ({self.refcount} references)'
+
+
+# columns of images-list entries, covered by image_owner_id_idx
+IMAGE_LISTING_FIELDS = ['image', 'filename', 'width', 'height', 'image_format', 'file_size']
+
+
 class Image(models.Model):
     image = models.ImageField(upload_to=image_file_path)
-    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='images')
+    # indexed by image_owner_id_idx, a separate owner_id index would be redundant
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='images', db_index=False)
+    # image.image points at blob file, images uploaded before deduplication have no blob
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='images')
+    # name of uploaded file, blob files are named by content hash
+    filename = models.CharField(max_length=255, blank=True)
+    # read from the header at ingest, so listings never reopen the file;
+    # empty for images uploaded before (see backfill_image_metadata)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    image_format = models.CharField(max_length=16, blank=True)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # images of an owner newest first (api/image) or by cursor (images-list);
+            # PostgreSQL answers listings from the index alone, other databases
+            # ignore included columns
+            models.Index(fields=['owner', '-id'], include=IMAGE_LISTING_FIELDS, name='image_owner_id_idx'),
+        ]
+
+    @property
+    def display_name(self):
+        return self.filename or os.path.basename(self.image.name)
+
+
+class Derivative(models.Model):
+    """Rendering status of an image thumbnail."""
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
+
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='derivatives')
+    size = models.PositiveIntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['image', 'size'], name='unique_derivative_size'),
+        ]
+
+    def __str__(self):
+        return f'Image {self.image_id} thumbnail {self.size}px: {self.status}'
+
+
+class RenderJob(models.Model):
+    """Thumbnail rendering job processed by render_worker command."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='render_jobs')
+    size = models.PositiveIntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    # queued jobs wait until this time, running jobs are reclaimed after it
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=255, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['image', 'size'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='unique_active_render_job',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='render_job_pickup_idx'),
+        ]
+
+    def __str__(self):
+        return f'Render image {self.image_id} at {self.size}px: {self.status}'
+
+
+@receiver(post_save, sender=Image)
+def pregenerate_thumbnails(sender, instance, created, **kwargs):
+    # Render thumbnails of a new image in the background
+    from core.pipeline import schedule_thumbnails
+
+    if created:
+        schedule_thumbnails(instance)
 
 
 @receiver(pre_delete, sender=Image)
 def delete_image(sender, instance, **kwargs):
-    # Delete an image
-    instance.image.delete(False)
+    # Remove an image file and its rendered thumbnails after commit unless other images share them
+    from core import blobs, sweeper
+
+    if instance.blob_id is not None:
+        blobs.release(instance.blob_id)
+    else:
+        sweeper.schedule(names=[instance.image.name])
+
+
+@receiver([post_save, post_delete], sender='authtoken.Token')
+def invalidate_token_access(sender, instance, **kwargs):
+    # Drop cached download authorization of a token
+    from core import access
+
+    access.invalidate_token(instance.key)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_access(sender, instance, **kwargs):
+    # Drop cached plan of a user
+    from core import access
+
+    access.invalidate_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Plan)
+def invalidate_plan_access(sender, instance, **kwargs):
+    # Drop cached flags of a plan
+    from core import access
+
+    access.invalidate_plans([instance.pk])
+
+
+@receiver(m2m_changed, sender=Plan.thumbnails.through)
+def invalidate_plan_thumbnails_access(sender, instance, action, reverse, pk_set, **kwargs):
+    # Drop cached thumbnail sizes of plans whose thumbnails changed
+    from core import access
+
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        access.invalidate_plans([instance.pk])
+    elif pk_set:
+        access.invalidate_plans(pk_set)
+    else:
+        access.invalidate_plans(Plan.objects.values_list('id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Thumbnail)
+def invalidate_thumbnail_access(sender, instance, **kwargs):
+    # Thumbnail size changed or was removed from all plans
+    from core import access
+
+    access.invalidate_plans(Plan.objects.values_list('id', flat=True))
 
 
 def list_of_default_plans():
@@ -0,0 +1,18 @@
+"""
+Pagination classes for Image APIs.
+"""
+from django.conf import settings
+
+from rest_framework.pagination import CursorPagination
+
+
+class ImageCursorPagination(CursorPagination):
+    """Keyset pagination of images by id, stable while images are added or deleted."""
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        # settings are read per request, not when the module is imported
+        self.page_size = settings.IMAGE_LIST_PAGE_SIZE
+        self.max_page_size = settings.IMAGE_LIST_MAX_PAGE_SIZE
+        return super().get_page_size(request)
@@ -0,0 +1,173 @@
+"""
+Pre-generation of image thumbnails.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from core.cache import get_thumbnail_cache
+from core.imaging import can_encode, render_thumbnails
+from core.models import Derivative, Image, Thumbnail
+from core import coalesce, jobs, metrics
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_PIPELINE_WORKERS,
+            thread_name_prefix='thumbnails',
+        )
+    return _executor
+
+
+def plan_sizes():
+    """Return thumbnail sizes referenced by any plan."""
+    return list(
+        Thumbnail.objects.filter(plan__isnull=False).distinct().values_list('size', flat=True)
+    )
+
+
+def output_formats():
+    """Return thumbnail formats rendered ahead of downloads."""
+    return [
+        image_format for image_format in settings.THUMBNAIL_FORMATS
+        if image_format == 'JPEG' or can_encode(image_format)
+    ] or ['JPEG']
+
+
+def thumbnail_qualities(sizes):
+    """Return {size: quality} of thumbnail sizes."""
+    qualities = dict(Thumbnail.objects.filter(size__in=sizes).values_list('size', 'quality'))
+    return {size: qualities.get(size) for size in sizes}
+
+
+def schedule_thumbnails(image):
+    """Register thumbnails of an image and render them after commit."""
+    schedule_many([image])
+
+
+def schedule_many(images):
+    """Register thumbnails of new images in bulk and render them after commit."""
+    sizes = plan_sizes()
+    ready = {}
+    blob_ids = {image.blob_id for image in images if image.blob_id is not None}
+    if blob_ids:
+        # derivatives are shared by all images of a blob, render them only once
+        shared = Derivative.objects.filter(
+            image__blob__in=blob_ids, size__in=sizes, status=Derivative.READY,
+        ).values_list('image__blob', 'size')
+        for blob_id, size in shared:
+            ready.setdefault(blob_id, set()).add(size)
+
+    derivatives = []
+    pending = []
+    for image in images:
+        image_ready = ready.get(image.blob_id, set())
+        for size in sizes:
+            status = Derivative.READY if size in image_ready else Derivative.PENDING
+            derivatives.append(Derivative(image=image, size=size, status=status))
+            if status == Derivative.PENDING:
+                pending.append((image, size))
+    Derivative.objects.bulk_create(derivatives, ignore_conflicts=True)
+
+    if not pending or settings.THUMBNAIL_PIPELINE == 'off':
+        return
+    if settings.THUMBNAIL_PIPELINE == 'queue':
+        # jobs become visible to render_worker when the transaction commits
+        jobs.enqueue_many(pending)
+        return
+    image_ids = sorted({image.pk for image, _ in pending})
+    transaction.on_commit(lambda: dispatch_many(image_ids))
+
+
+def dispatch_many(image_ids):
+    """Render thumbnails of images according to the pipeline mode."""
+    for image_id in image_ids:
+        dispatch(image_id)
+
+
+def dispatch(image_id):
+    """Render thumbnails of an image according to the pipeline mode."""
+    if settings.THUMBNAIL_PIPELINE == 'sync':
+        render_derivatives(image_id)
+    else:
+        _get_executor().submit(_render_in_thread, image_id)
+
+
+def _render_in_thread(image_id):
+    try:
+        render_derivatives(image_id)
+    finally:
+        # worker threads must not leak their database connections
+        connection.close()
+
+
+def open_original(name):
+    """Return an open original image file from the storage of Image.image."""
+    return Image._meta.get_field('image').storage.open(name, 'rb')
+
+
+def render_stored(name, variant, formats, quality=None):
+    """Return {format: bytes} of thumbnails of a stored original, top level to be picklable."""
+    with open_original(name) as source:
+        renders = render_thumbnails(source, variant, formats, quality)
+        metrics.add('storage_read_bytes', source.tell())
+    return renders
+
+
+def store_thumbnail(image, size, renders, quality=None):
+    """Put thumbnail rendered in {format: bytes} into the cache and mark it as ready."""
+    cache = get_thumbnail_cache()
+    for image_format, data in renders.items():
+        cache.put(image, size, data, image_format, quality)
+    Derivative.objects.filter(image=image, size=size).update(status=Derivative.READY)
+
+
+def store_variant(image, transform, renders, quality=None, derivative=False):
+    """Put a variant rendered in {format: bytes} into the cache, plan thumbnails are marked as ready."""
+    if derivative:
+        store_thumbnail(image, transform.pixel_height, renders, quality)
+        return
+    cache = get_thumbnail_cache()
+    for image_format, data in renders.items():
+        cache.put(image, transform.key, data, image_format, quality)
+
+
+def render_derivatives(image_id):
+    """Render all not yet ready thumbnails of an image into the cache."""
+    try:
+        image = Image.objects.select_related('blob').get(pk=image_id)
+    except Image.DoesNotExist:
+        return
+
+    cache = get_thumbnail_cache()
+    formats = output_formats()
+    derivatives = list(image.derivatives.exclude(status=Derivative.READY))
+    qualities = thumbnail_qualities([derivative.size for derivative in derivatives])
+    for derivative in derivatives:
+        quality = qualities[derivative.size]
+        try:
+            # a download rendering the same thumbnail meanwhile is waited for
+            with coalesce.single_flight(coalesce.render_key(image, derivative.size)):
+                missing = [
+                    image_format for image_format in formats
+                    if not cache.exists(image, derivative.size, image_format, quality)
+                ]
+                if missing:
+                    # decode and resize once, encode every format
+                    renders = render_stored(image.image.name, derivative.size, missing, quality)
+                    for image_format, data in renders.items():
+                        cache.put(image, derivative.size, data, image_format, quality)
+            derivative.status = Derivative.READY
+        except Exception:
+            logger.exception('Rendering thumbnail %spx of image %s failed', derivative.size, image_id)
+            derivative.status = Derivative.FAILED
+        derivative.save(update_fields=['status', 'updated_at'])
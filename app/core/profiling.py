@@ -0,0 +1,181 @@
+"""
+Opt-in profiling of slow and sampled requests.
+
+While PROFILE_REQUESTS is on, a background thread samples the stacks of
+threads serving requests every PROFILE_INTERVAL seconds; requests slower
+than PROFILE_SLOW_SECONDS keep their samples. A PROFILE_SAMPLE_RATE fraction
+of requests is profiled with cProfile instead. Profiles are written to
+PROFILE_PATH as <id>.json (tags, samples) and <id>.prof (cProfile stats),
+the oldest ones are removed beyond PROFILE_MAX_FILES. Views tag requests
+with tag(), e.g. image dimensions and plan.
+"""
+import contextvars
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+
+_tags = contextvars.ContextVar('profiling_tags', default=None)
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def tag(**tags):
+    """Tag the profile of the current request."""
+    current = _tags.get()
+    if current is not None:
+        current.update(tags)
+
+
+def function_label(code):
+    """Return pstats style label of a code object."""
+    return f'{code.co_filename}:{code.co_firstlineno}({code.co_name})'
+
+
+class StackSampler(threading.Thread):
+    """Daemon thread counting stacks of registered threads."""
+
+    def __init__(self, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.interval = interval
+        self.lock = threading.Lock()
+        # thread ident: Counter of stacks, outermost frame first
+        self.threads = {}
+
+    def register(self):
+        """Start sampling the calling thread, return its samples."""
+        samples = Counter()
+        with self.lock:
+            self.threads[threading.get_ident()] = samples
+        return samples
+
+    def unregister(self):
+        """Stop sampling the calling thread."""
+        with self.lock:
+            self.threads.pop(threading.get_ident(), None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.threads:
+                    continue
+                frames = sys._current_frames()
+                for ident, samples in self.threads.items():
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None:
+                        stack.append(function_label(frame.f_code))
+                        frame = frame.f_back
+                    if stack:
+                        samples[';'.join(reversed(stack))] += 1
+
+
+def get_sampler():
+    """Return the stack sampler of this process, started on first use."""
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = StackSampler(settings.PROFILE_INTERVAL)
+            _sampler.start()
+    return _sampler
+
+
+def start_request():
+    """Start collecting tags of a request, return token for finish_request."""
+    return _tags.set({})
+
+
+def finish_request(token):
+    """Return tags of the request and stop collecting them."""
+    tags = _tags.get()
+    _tags.reset(token)
+    return tags
+
+
+def save(meta, samples=None, profiler=None):
+    """Write a profile with its tags to PROFILE_PATH, return its id."""
+    os.makedirs(settings.PROFILE_PATH, exist_ok=True)
+    endpoint = meta['endpoint'].replace(':', '-').replace('/', '-')
+    created = datetime.now(timezone.utc)
+    profile_id = f'{created.strftime("%Y%m%d-%H%M%S-%f")}-{endpoint}-{uuid.uuid4().hex[:8]}'
+    base = os.path.join(settings.PROFILE_PATH, profile_id)
+
+    meta = {**meta, 'id': profile_id, 'created': created.timestamp()}
+    if profiler is not None:
+        profiler.dump_stats(base + '.prof')
+        meta['kind'] = 'cprofile'
+    else:
+        meta.update(kind='samples', interval=settings.PROFILE_INTERVAL, samples=dict(samples))
+
+    # the metadata file goes last, profiles are listed by it
+    tmp_path = base + '.json.tmp'
+    with open(tmp_path, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(tmp_path, base + '.json')
+
+    rotate()
+    return profile_id
+
+
+def list_profiles():
+    """Return metadata of stored profiles, newest first."""
+    try:
+        names = [name for name in os.listdir(settings.PROFILE_PATH) if name.endswith('.json')]
+    except FileNotFoundError:
+        return []
+
+    profiles = []
+    for name in names:
+        try:
+            with open(os.path.join(settings.PROFILE_PATH, name)) as meta_file:
+                profiles.append(json.load(meta_file))
+        except (FileNotFoundError, ValueError):
+            # removed by another process in the meantime
+            continue
+    return sorted(profiles, key=lambda meta: meta['created'], reverse=True)
+
+
+def rotate():
+    """Remove the oldest profiles beyond PROFILE_MAX_FILES."""
+    # ids start with the creation time, so names sort by age
+    ids = sorted(
+        (name[:-len('.json')] for name in os.listdir(settings.PROFILE_PATH) if name.endswith('.json')),
+        reverse=True,
+    )
+    for profile_id in ids[settings.PROFILE_MAX_FILES:]:
+        for extension in ('.prof', '.json'):
+            try:
+                os.unlink(os.path.join(settings.PROFILE_PATH, profile_id + extension))
+            except FileNotFoundError:
+                pass
+
+
+def top_functions(meta, limit=20):
+    """Return [(function, cumulative seconds, own seconds, calls or samples)] of a profile by cumulative time."""
+    if meta['kind'] == 'cprofile':
+        stats = pstats.Stats(os.path.join(settings.PROFILE_PATH, meta['id'] + '.prof')).stats
+        rows = [
+            (f'{filename}:{line}({name})', cumulative, own, calls)
+            for (filename, line, name), (_, calls, own, cumulative, _) in stats.items()
+        ]
+    else:
+        cumulative, own = Counter(), Counter()
+        for stack, count in meta['samples'].items():
+            frames = stack.split(';')
+            # recursive functions are counted once per sample
+            for label in set(frames):
+                cumulative[label] += count
+            own[frames[-1]] += count
+        interval = meta['interval']
+        rows = [(label, count * interval, own[label] * interval, count) for label, count in cumulative.items()]
+    return sorted(rows, key=lambda row: row[1], reverse=True)[:limit]
@@ -1,11 +1,16 @@
 """
 Serializers for Image APIs.
 """
+import os
+
 from django.contrib.auth import authenticate
+from django.db import transaction
 
 from rest_framework import serializers
 
+from core import blobs
 from core.models import Thumbnail, Plan, User, Image
+from core.uploads import image_metadata
 
 
 class ThumbnailSerializer(serializers.ModelSerializer):
@@ -68,31 +73,92 @@ class AuthTokenSerializer(serializers.Serializer):
         return attrs
 
 
-class ImageListSerializer(serializers.ModelSerializer):
-    """Serializer for uploading images."""
+class StreamedImageField(serializers.ImageField):
+    """Image field trusting files already checked by ImageUploadHandler."""
 
-    class Meta:
-        model = Image
-        fields = ['id', 'image']
+    def to_internal_value(self, data):
+        if getattr(data, 'image_format', None) is None:
+            return super().to_internal_value(data)
+        # header was validated while streaming, don't read whole file again
+        return serializers.FileField.to_internal_value(self, data)
 
 
 class ImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading images."""
+    image = StreamedImageField(required=True)
 
     class Meta:
         model = Image
-        fields = ['id', 'image']
-        rear_only_fields = ['id']
-        extra_kwargs = {
-            'image': {'required': 'True'},
-        }
+        fields = ['id', 'image', 'width', 'height', 'image_format', 'file_size']
+        read_only_fields = ['id', 'width', 'height', 'image_format', 'file_size']
 
     def create(self, validated_data):
         """Create Image"""
         owner = self.context['request'].user
-        new_image = Image.objects.create(
-            owner=owner,
-            **validated_data
-        )
+        upload = validated_data.pop('image')
+        # read before the upload is moved into storage
+        metadata = image_metadata(upload)
+        with transaction.atomic():
+            # identical uploads share one stored file
+            blob = blobs.store(upload)
+            new_image = Image.objects.create(
+                owner=owner,
+                image=blob.file.name,
+                blob=blob,
+                filename=os.path.basename(upload.name),
+                **metadata,
+                **validated_data
+            )
 
         return new_image
+
+
+class BulkImageSerializer(serializers.Serializer):
+    """Serializer for uploading many images at once."""
+    images = serializers.ListField(child=serializers.FileField(), required=False)
+    archive = serializers.FileField(required=False, help_text='zip or tar archive of images.')
+
+    def validate(self, attrs):
+        """Validate that some files were sent."""
+        if not attrs.get('images') and not attrs.get('archive'):
+            raise serializers.ValidationError('Upload images or an archive.')
+        return attrs
+
+
+class ImageFilterSerializer(serializers.Serializer):
+    """Serializer for selecting images by id range or file name."""
+    id_gte = serializers.IntegerField(required=False)
+    id_lte = serializers.IntegerField(required=False)
+    filename = serializers.CharField(required=False, help_text='Part of uploaded file name.')
+
+    def validate(self, attrs):
+        """Validate that the filter is not empty."""
+        if not attrs:
+            raise serializers.ValidationError('Filter needs at least one condition.')
+        return attrs
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    """Serializer for deleting many images at once."""
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    filter = ImageFilterSerializer(required=False)
+
+    def validate(self, attrs):
+        """Validate that exactly one of ids and filter is given."""
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError('Give either ids or filter.')
+        return attrs
+
+    def filter_queryset(self, queryset):
+        """Return images of queryset selected by ids or filter."""
+        if 'ids' in self.validated_data:
+            return queryset.filter(pk__in=self.validated_data['ids'])
+
+        conditions = self.validated_data['filter']
+        if 'id_gte' in conditions:
+            queryset = queryset.filter(pk__gte=conditions['id_gte'])
+        if 'id_lte' in conditions:
+            queryset = queryset.filter(pk__lte=conditions['id_lte'])
+        if 'filename' in conditions:
+            queryset = queryset.filter(filename__contains=conditions['filename'])
+        return queryset
@@ -0,0 +1,266 @@
+"""
+Storage backends for originals and derivatives.
+
+Images are read and written through the Django storage API only, so they
+can live on a local filesystem (FileSystemStorage) or in an S3-compatible
+object store (ObjectStorage). LocalObjectClient is a stand-in for the S3
+client keeping objects in a local directory, for tests and development.
+"""
+import io
+import os
+import shutil
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import quote, urljoin
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+
+
+MISSING_CODES = {'404', 'NoSuchKey', 'NotFound'}
+
+
+class ClientError(Exception):
+    """Error of LocalObjectClient shaped like botocore ClientError."""
+
+    def __init__(self, code, operation):
+        super().__init__(f'{operation}: {code}')
+        self.response = {'Error': {'Code': code}}
+
+
+class LocalObjectClient:
+    """Subset of boto3 S3 client API storing objects under a local directory."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        path = os.path.normpath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.join(self.root, bucket) + os.sep):
+            raise ClientError('InvalidKey', 'Path')
+        return path
+
+    def _stat(self, bucket, key, operation):
+        try:
+            return os.stat(self._path(bucket, key))
+        except FileNotFoundError:
+            raise ClientError('NoSuchKey', operation) from None
+
+    def put_object(self, Bucket, Key, Body):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.upload'
+        with open(tmp_path, 'wb') as object_file:
+            if isinstance(Body, bytes):
+                object_file.write(Body)
+            else:
+                shutil.copyfileobj(Body, object_file)
+        # objects appear whole or not at all, like in S3
+        os.replace(tmp_path, path)
+        return {}
+
+    def head_object(self, Bucket, Key):
+        stat = self._stat(Bucket, Key, 'HeadObject')
+        return {
+            'ContentLength': stat.st_size,
+            'LastModified': datetime.fromtimestamp(stat.st_mtime, dt_timezone.utc),
+        }
+
+    def get_object(self, Bucket, Key, Range=None):
+        self._stat(Bucket, Key, 'GetObject')
+        with open(self._path(Bucket, Key), 'rb') as object_file:
+            if Range is None:
+                data = object_file.read()
+            else:
+                start, end = Range.split('=')[1].split('-')
+                object_file.seek(int(start))
+                data = object_file.read(int(end) - int(start) + 1)
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def delete_object(self, Bucket, Key):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', Delimiter=None, **kwargs):
+        bucket_root = os.path.join(self.root, Bucket)
+        contents = []
+        prefixes = set()
+        for dirpath, _, filenames in os.walk(bucket_root):
+            for filename in filenames:
+                if filename.endswith('.upload'):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, filename), bucket_root).replace(os.sep, '/')
+                if not key.startswith(Prefix):
+                    continue
+                rest = key[len(Prefix):]
+                if Delimiter and Delimiter in rest:
+                    prefixes.add(Prefix + rest.split(Delimiter)[0] + Delimiter)
+                    continue
+                stat = os.stat(os.path.join(dirpath, filename))
+                contents.append({
+                    'Key': key,
+                    'Size': stat.st_size,
+                    'LastModified': datetime.fromtimestamp(stat.st_mtime, dt_timezone.utc),
+                })
+        return {
+            'Contents': sorted(contents, key=lambda item: item['Key']),
+            'CommonPrefixes': [{'Prefix': prefix} for prefix in sorted(prefixes)],
+            'IsTruncated': False,
+        }
+
+
+def s3_client(endpoint_url=None):
+    """Return boto3 S3 client, boto3 is needed only with an object store."""
+    try:
+        import boto3
+    except ImportError as exc:
+        raise ImproperlyConfigured('ObjectStorage with an S3 endpoint needs boto3 installed.') from exc
+    return boto3.client('s3', endpoint_url=endpoint_url)
+
+
+class RangedReader(io.RawIOBase):
+    """Seekable reader of an object fetching requested byte ranges only."""
+
+    def __init__(self, storage, name, size):
+        self.storage = storage
+        self.name = name
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size or not len(buffer):
+            return 0
+        end = min(self.position + len(buffer), self.size) - 1
+        data = self.storage.read_range(self.name, self.position, end)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+@deconstructible
+class ObjectStorage(Storage):
+    """
+    Storage in an S3-compatible bucket.
+
+    Opened objects are read lazily with ranged GETs in blocks of
+    read_block_size, so probing a header does not download the whole file.
+    Saving overwrites, callers store content-addressed or unique names.
+    """
+
+    def __init__(self, bucket=None, prefix=None, endpoint_url=None, client=None, read_block_size=None):
+        self.bucket = bucket or settings.OBJECT_STORAGE_BUCKET
+        self.prefix = settings.OBJECT_STORAGE_PREFIX if prefix is None else prefix
+        self.endpoint_url = endpoint_url or settings.OBJECT_STORAGE_ENDPOINT_URL
+        self.read_block_size = read_block_size or settings.OBJECT_STORAGE_READ_BLOCK_SIZE
+        if client is None and settings.OBJECT_STORAGE_CLIENT:
+            client = import_string(settings.OBJECT_STORAGE_CLIENT)(settings.OBJECT_STORAGE_ROOT)
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = s3_client(self.endpoint_url)
+        return self._client
+
+    def _key(self, name):
+        return self.prefix + name.replace(os.sep, '/')
+
+    def _call(self, operation, name, **kwargs):
+        try:
+            return getattr(self.client, operation)(Bucket=self.bucket, Key=self._key(name), **kwargs)
+        except Exception as exc:
+            code = getattr(exc, 'response', {}).get('Error', {}).get('Code')
+            if code in MISSING_CODES:
+                raise FileNotFoundError(name) from exc
+            raise
+
+    def read_range(self, name, start, end):
+        """Return bytes start to end (inclusive) of an object."""
+        return self._call('get_object', name, Range=f'bytes={start}-{end}')['Body'].read()
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError('ObjectStorage files are read only, use save().')
+        reader = RangedReader(self, name, self.size(name))
+        return File(io.BufferedReader(reader, buffer_size=self.read_block_size), name=name)
+
+    def _save(self, name, content):
+        content.seek(0)
+        self._call('put_object', name, Body=content)
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def delete(self, name):
+        self._call('delete_object', name)
+
+    def exists(self, name):
+        try:
+            self._call('head_object', name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def size(self, name):
+        return self._call('head_object', name)['ContentLength']
+
+    def get_modified_time(self, name):
+        modified = self._call('head_object', name)['LastModified']
+        return modified if settings.USE_TZ else timezone.make_naive(modified)
+
+    def listdir(self, path):
+        prefix = self._key(path).rstrip('/') + '/' if path else self.prefix
+        listing = self.client.list_objects_v2(Bucket=self.bucket, Prefix=prefix, Delimiter='/')
+        directories = [item['Prefix'][len(prefix):].rstrip('/') for item in listing.get('CommonPrefixes', [])]
+        files = [item['Key'][len(prefix):] for item in listing.get('Contents', [])]
+        return directories, files
+
+    def url(self, name):
+        if not self.endpoint_url:
+            # same shape as FileSystemStorage URLs, downloads go through the API anyway
+            return urljoin(settings.MEDIA_URL, quote(name.replace(os.sep, '/')))
+        return f'{self.endpoint_url.rstrip("/")}/{self.bucket}/{self._key(name)}'
+
+
+def local_path(storage, name):
+    """Return filesystem path of a stored file or None when storage is not local."""
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def source_version(image):
+    """Return (version, modified timestamp) of an image original without reading it."""
+    if image.blob_id is not None:
+        # blob files are content-addressed and never change
+        return image.blob.sha256, int(image.blob.created_at.timestamp())
+
+    storage = image.image.storage
+    modified = storage.get_modified_time(image.image.name).timestamp()
+    return f'{modified}:{storage.size(image.image.name)}', int(modified)
@@ -0,0 +1,101 @@
+"""
+Background removal of files of deleted images.
+
+Deleting rows only schedules their files; once the transaction commits the
+sweeper purges unreferenced blobs and unlinks files and derivatives in
+batches, outside of the request and of any row locks it held.
+"""
+import contextvars
+import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from core.cache import get_thumbnail_cache
+from core.models import Blob
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+# (names, blob ids) collected by batch, None outside of it
+_batch = contextvars.ContextVar('sweeper_batch', default=None)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # a single thread keeps unlinks serialized, batches queue behind each other
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sweeper')
+    return _executor
+
+
+def schedule(names=(), blob_ids=()):
+    """Remove files stored under names and unreferenced blobs after commit."""
+    names, blob_ids = list(names), list(blob_ids)
+    batch = _batch.get()
+    if batch is not None:
+        batch[0].extend(names)
+        batch[1].extend(blob_ids)
+    elif names or blob_ids:
+        transaction.on_commit(lambda: dispatch(names, blob_ids))
+
+
+@contextmanager
+def batch():
+    """Collect schedule() calls, e.g. of delete signals, and schedule them as one sweep on exit."""
+    names, blob_ids = [], []
+    token = _batch.set((names, blob_ids))
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+    schedule(names, blob_ids)
+
+
+def dispatch(names, blob_ids):
+    """Sweep files according to the sweeper mode."""
+    if settings.FILE_SWEEPER == 'sync':
+        sweep(names, blob_ids)
+    else:
+        _get_executor().submit(_sweep_in_thread, names, blob_ids)
+
+
+def _sweep_in_thread(names, blob_ids):
+    try:
+        sweep(names, blob_ids)
+    except Exception:
+        logger.exception('Removing files of deleted images failed')
+    finally:
+        # worker threads must not leak their database connections
+        connection.close()
+
+
+def sweep(names, blob_ids):
+    """Unlink files with their derivatives and purge unreferenced blobs in batches."""
+    batch_size = settings.FILE_SWEEPER_BATCH_SIZE
+    for start in range(0, len(blob_ids), batch_size):
+        purge_blobs(blob_ids[start:start + batch_size])
+
+    cache = get_thumbnail_cache()
+    for name in names:
+        cache.invalidate(name)
+        default_storage.delete(name)
+
+
+def purge_blobs(blob_ids):
+    """Remove unreferenced blobs together with their files and derivatives."""
+    cache = get_thumbnail_cache()
+    with transaction.atomic():
+        blobs = list(
+            Blob.objects.select_for_update(of=('self',)).filter(pk__in=blob_ids, refcount=0, images__isnull=True)
+        )
+        Blob.objects.filter(pk__in=[blob.pk for blob in blobs]).delete()
+        # unlink while the rows are locked so a concurrent store() sees the files gone
+        for blob in blobs:
+            cache.invalidate(blob.file.name)
+            blob.file.delete(False)
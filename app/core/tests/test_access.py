@@ -0,0 +1,94 @@
+"""
+Tests for cached download authorization.
+"""
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+
+from rest_framework.authtoken.models import Token
+
+from core import access
+from core.models import Plan, Thumbnail
+from core.tests.utils import create_image
+
+
+class AccessCacheTests(TestCase):
+    """Test resolving tokens to download grants."""
+
+    def setUp(self):
+        self.thumbnail = Thumbnail.objects.create(size=200)
+        self.plan = Plan.objects.create(name='Basic', original_size=False, expiring_link=False)
+        self.plan.thumbnails.add(self.thumbnail)
+
+        self.user = get_user_model().objects.create_user(username='Test User', password='testpass123', plan=self.plan)
+        self.token = Token.objects.create(user=self.user)
+
+    def test_resolve_token(self):
+        """Test grant contains user and plan permissions."""
+        grant = access.resolve_token(self.token.key)
+
+        self.assertEqual(grant, access.Grant(self.user.id, {200: None}, False, False, 86400, frozenset(), self.plan.id))
+
+    def test_resolve_unknown_token(self):
+        """Test unknown token has no grant."""
+        self.assertIsNone(access.resolve_token('unknown'))
+
+    def test_warm_cache_runs_no_queries(self):
+        """Test second resolution is served from cache."""
+        access.resolve_token(self.token.key)
+
+        with self.assertNumQueries(0):
+            access.resolve_token(self.token.key)
+
+    def test_plan_thumbnails_change_invalidates(self):
+        """Test adding a thumbnail to the plan is visible immediately."""
+        access.resolve_token(self.token.key)
+
+        self.plan.thumbnails.add(Thumbnail.objects.create(size=400))
+
+        self.assertEqual(access.resolve_token(self.token.key).sizes, {200: None, 400: None})
+
+    def test_plan_flags_change_invalidates(self):
+        """Test changing plan flags is visible immediately."""
+        access.resolve_token(self.token.key)
+
+        self.plan.original_size = True
+        self.plan.save()
+
+        self.assertTrue(access.resolve_token(self.token.key).original_size)
+
+    def test_user_plan_change_invalidates(self):
+        """Test moving user to another plan is visible immediately."""
+        access.resolve_token(self.token.key)
+
+        self.user.plan = None
+        self.user.save()
+
+        self.assertEqual(access.resolve_token(self.token.key).sizes, {})
+
+    def test_token_delete_invalidates(self):
+        """Test revoked token is not authorized anymore."""
+        key = self.token.key
+        access.resolve_token(key)
+
+        self.token.delete()
+
+        self.assertIsNone(access.resolve_token(key))
+
+    def test_download_on_warm_cache_runs_one_query(self):
+        """Test authorizing a cached thumbnail download takes one query."""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            image = create_image(self.user, (800, 600))
+            url = reverse('core:download', args=[image.id, 200, self.token.key])
+
+            self.client.get(url)
+            with self.assertNumQueries(1):
+                res = self.client.get(url)
+                b''.join(res.streaming_content)
+
+        self.assertEqual(res.status_code, 200)
@@ -0,0 +1,97 @@
+"""
+Tests for async download views.
+"""
+import asyncio
+from io import BytesIO
+from unittest.mock import patch
+
+from PIL import Image as PILImage
+
+from django.http import Http404
+from django.test import AsyncRequestFactory, override_settings
+from django.contrib.auth import get_user_model
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+
+from core import async_views, metrics
+from core.pipeline import render_stored
+from core.tests.utils import DownloadTestCase
+
+
+async def read_streaming(response):
+    """Return body of a response streamed through an async iterator."""
+    return b''.join([chunk async for chunk in response.streaming_content])
+
+
+@override_settings(THUMBNAIL_PIPELINE='off', RENDER_LOCK_BACKEND='file', IMAGE_DELIVERY_BACKEND='python')
+class AsyncDownloadTests(DownloadTestCase):
+    """Test downloads served by async views."""
+
+    plan_options = {'name': 'Premium', 'original_size': True, 'expiring_link': False}
+
+    def setUp(self):
+        super().setUp()
+        with open(self.image.image.path, 'rb') as original:
+            self.original = original.read()
+        self.factory = AsyncRequestFactory()
+
+    async def test_thumbnail_rendered_then_streamed(self):
+        """Test thumbnail is rendered once, then streamed from cache."""
+        res = await async_views.thumbnailView(self.factory.get('/'), self.image.id, 200, self.token.key)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        with PILImage.open(BytesIO(res.content)) as thumbnail:
+            self.assertEqual(thumbnail.height, 200)
+
+        with patch('core.imaging.PILImage.open') as patched_open:
+            res = await async_views.thumbnailView(self.factory.get('/'), self.image.id, 200, self.token.key)
+            cached = await read_streaming(res)
+
+            patched_open.assert_not_called()
+        self.assertTrue(res.is_async)
+        self.assertIn('Accept', res['Vary'])
+        with PILImage.open(BytesIO(cached)) as thumbnail:
+            self.assertEqual(thumbnail.height, 200)
+
+    async def test_concurrent_requests_share_render(self):
+        """Test concurrent requests for one thumbnail wait for a single render."""
+        calls = []
+
+        def counting_render(*args):
+            calls.append(args)
+            return render_stored(*args)
+
+        collapsed = metrics.snapshot().get('thumbnail_renders_collapsed', 0)
+        with patch('core.async_views.render_stored', side_effect=counting_render):
+            responses = await asyncio.gather(*[
+                async_views.thumbnailView(self.factory.get('/'), self.image.id, 200, self.token.key)
+                for _ in range(5)
+            ])
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({res.status_code for res in responses}, {status.HTTP_200_OK})
+        self.assertEqual(len({res.content for res in responses}), 1)
+        self.assertEqual(metrics.snapshot()['thumbnail_renders_collapsed'], collapsed + 4)
+
+    @override_settings(DOWNLOAD_CHUNK_SIZE=1024)
+    async def test_original_streamed_in_chunks(self):
+        """Test original is streamed chunk by chunk through an async iterator."""
+        res = await async_views.originalView(self.factory.get('/'), self.image.id, self.token.key)
+
+        chunks = [chunk async for chunk in res.streaming_content]
+        self.assertGreater(len(chunks), 1)
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 1024)
+        self.assertEqual(b''.join(chunks), self.original)
+        self.assertEqual(res['Content-Length'], str(len(self.original)))
+
+    async def test_authorization(self):
+        """Test unknown tokens and foreign images are refused."""
+        with self.assertRaises(Http404):
+            await async_views.originalView(self.factory.get('/'), self.image.id, 'unknown')
+
+        other = await get_user_model().objects.acreate(username='Other User')
+        other_token = await Token.objects.acreate(user=other)
+        res = await async_views.thumbnailView(self.factory.get('/'), self.image.id, 200, other_token.key)
+
+        self.assertEqual(res.content, f'error: {status.HTTP_401_UNAUTHORIZED} unauthorized'.encode())
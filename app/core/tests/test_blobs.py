@@ -0,0 +1,140 @@
+"""
+Tests for content-addressed blob storage.
+"""
+import os
+from io import BytesIO, StringIO
+
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import blobs
+from core.cache import get_thumbnail_cache
+from core.models import Blob, Derivative, Image, Plan, Thumbnail
+from core.tests.utils import MediaTestCase, image_bytes
+
+
+IMAGE_URL = reverse('core:image-list')
+
+
+@override_settings(THUMBNAIL_PIPELINE='off', FILE_SWEEPER='sync')
+class BlobTests(MediaTestCase):
+    """Test deduplication of uploaded images."""
+
+    def setUp(self):
+        super().setUp()
+        plan = Plan.objects.create(name='Basic', original_size=False, expiring_link=False)
+        plan.thumbnails.add(Thumbnail.objects.create(size=100))
+        self.user = get_user_model().objects.create_user(username='Test User', password='testpass123', plan=plan)
+        self.other_user = get_user_model().objects.create_user(username='Other User', password='testpass123', plan=plan)
+        self.client = APIClient()
+
+    def _upload(self, user, data, name='photo.jpg'):
+        self.client.force_authenticate(user=user)
+        res = self.client.post(IMAGE_URL, {'image': SimpleUploadedFile(name, data)}, format='multipart')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return Image.objects.get(pk=res.data['id'])
+
+    def test_identical_uploads_share_blob(self):
+        """Test same content uploaded twice is stored once."""
+        first = self._upload(self.user, image_bytes(), name='a.jpg')
+        second = self._upload(self.other_user, image_bytes(), name='b.jpg')
+        third = self._upload(self.user, image_bytes(color=(255, 0, 0)))
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertNotEqual(first.blob_id, third.blob_id)
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(Blob.objects.get(pk=first.blob_id).refcount, 2)
+        self.assertEqual((first.filename, second.filename), ('a.jpg', 'b.jpg'))
+
+        digest = first.blob.sha256
+        self.assertEqual(first.image.name, f'uploads/blobs/{digest[:2]}/{digest[2:4]}/{digest}.jpg')
+
+    def test_store_many_restores_purged_file(self):
+        """Test file reused by a batch is written again when its blob was purged before the rows are stored."""
+        first = self._upload(self.user, image_bytes())
+        digest, path = first.blob.sha256, first.image.path
+        upload = SimpleUploadedFile('again.jpg', image_bytes())
+        name = blobs.save_file(digest, upload)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertFalse(os.path.exists(path))
+
+        stored = blobs.store_many({digest: (name, upload, 1)})
+
+        self.assertEqual(stored[digest].file.name, name)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(Blob.objects.get(sha256=digest).refcount, 1)
+
+    def test_derivatives_shared_by_blob(self):
+        """Test thumbnails ready for a blob are not scheduled again."""
+        first = self._upload(self.user, image_bytes())
+        first.derivatives.update(status=Derivative.READY)
+
+        second = self._upload(self.other_user, image_bytes())
+
+        self.assertEqual(second.derivatives.get().status, Derivative.READY)
+        self.assertEqual(get_thumbnail_cache().path(first, 100), get_thumbnail_cache().path(second, 100))
+
+    def test_file_removed_with_last_reference(self):
+        """Test blob file is kept until no image references it."""
+        first = self._upload(self.user, image_bytes())
+        second = self._upload(self.other_user, image_bytes())
+        path = first.image.path
+        get_thumbnail_cache().put(first, 100, b'thumbnail')
+        cached_path = get_thumbnail_cache().path(first, 100)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(os.path.exists(cached_path))
+        self.assertEqual(Blob.objects.get().refcount, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(cached_path))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_download_name_quoted(self):
+        """Test uploaded name is quoted in Content-Disposition of original downloads."""
+        Plan.objects.update(original_size=True)
+        image = self._upload(self.user, image_bytes())
+        Image.objects.filter(pk=image.pk).update(filename='my "photo" \u017c.jpg')
+        token = Token.objects.create(user=self.user)
+
+        res = self.client.get(reverse('core:download-original', args=[image.id, token.key]))
+
+        self.assertEqual(res['Content-Disposition'], "attachment; filename*=utf-8''my%20%22photo%22%20%C5%BC.jpg")
+
+    def test_dedupe_media_command(self):
+        """Test command moves existing images into shared blobs."""
+        legacy = []
+        for owner in [self.user, self.other_user]:
+            image = Image(owner=owner)
+            image.image.save('legacy.jpg', File(BytesIO(image_bytes())))
+            legacy.append(image)
+        old_paths = [image.image.path for image in legacy]
+        old_names = [os.path.basename(path) for path in old_paths]
+
+        out = StringIO()
+        call_command('dedupe_media', stdout=out)
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.refcount, 2)
+        for image, old_name in zip(legacy, old_names):
+            image.refresh_from_db()
+            self.assertEqual(image.blob_id, blob.pk)
+            self.assertEqual(image.display_name, old_name)
+        for path in old_paths:
+            self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(blob.file.path))
+        self.assertIn('freeing', out.getvalue())
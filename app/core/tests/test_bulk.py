@@ -0,0 +1,226 @@
+"""
+Tests for batch image uploads.
+"""
+import io
+import os
+import tarfile
+import zipfile
+from unittest.mock import patch
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import blobs, sweeper
+from core.models import Blob, Derivative, Image, Plan, Thumbnail
+from core.tests.utils import MediaTestCase, image_bytes
+
+
+BULK_URL = reverse('core:image-bulk')
+BULK_DELETE_URL = reverse('core:image-bulk-delete')
+
+
+@override_settings(THUMBNAIL_PIPELINE='off', BULK_UPLOAD_WORKERS=4)
+class BulkUploadTests(MediaTestCase):
+    """Test uploading many images in one request."""
+
+    def setUp(self):
+        super().setUp()
+        plan = Plan.objects.create(name='Basic', original_size=False, expiring_link=False)
+        plan.thumbnails.add(Thumbnail.objects.create(size=100))
+        self.user = get_user_model().objects.create_user(username='Test User', password='testpass123', plan=plan)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_multipart_files(self):
+        """Test every valid file is stored and invalid ones are reported."""
+        images = [
+            SimpleUploadedFile('black.jpg', image_bytes()),
+            SimpleUploadedFile('red.jpg', image_bytes(color=(255, 0, 0))),
+            SimpleUploadedFile('notes.txt', b'not an image' * 100),
+            SimpleUploadedFile('black-copy.jpg', image_bytes()),
+        ]
+
+        res = self.client.post(BULK_URL, {'images': images}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(res.data['created'], 3)
+        results = {result['image']: result for result in res.data['results']}
+        self.assertIn('errors', results['notes.txt'])
+        for name in ['black.jpg', 'red.jpg', 'black-copy.jpg']:
+            image = Image.objects.get(pk=results[name]['id'])
+            self.assertEqual(image.owner, self.user)
+            self.assertEqual(image.filename, name)
+            self.assertEqual((image.width, image.height, image.image_format), (300, 200, 'JPEG'))
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertEqual(Blob.objects.get(pk=Image.objects.get(filename='black.jpg').blob_id).refcount, 2)
+        self.assertEqual(Derivative.objects.filter(size=100).count(), 3)
+
+    def test_zip_archive(self):
+        """Test images are unpacked from a zip archive."""
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('photos/a.jpg', image_bytes())
+            zip_file.writestr('photos/b.jpg', image_bytes(color=(0, 255, 0)))
+
+        res = self.client.post(
+            BULK_URL, {'archive': SimpleUploadedFile('photos.zip', archive.getvalue())}, format='multipart',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sorted(Image.objects.values_list('filename', flat=True)), ['a.jpg', 'b.jpg'])
+        self.assertEqual(set(Image.objects.values_list('width', 'height')), {(300, 200)})
+
+    def test_tar_archive(self):
+        """Test images are unpacked from a gzipped tar archive."""
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar_file:
+            for name, data in [('a.jpg', image_bytes()), ('b.jpg', b'broken')]:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar_file.addfile(info, io.BytesIO(data))
+
+        res = self.client.post(
+            BULK_URL, {'archive': SimpleUploadedFile('photos.tar.gz', archive.getvalue())}, format='multipart',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(Image.objects.get().filename, 'a.jpg')
+
+    def test_invalid_archive(self):
+        """Test file that is neither zip nor tar is rejected."""
+        res = self.client.post(
+            BULK_URL, {'archive': SimpleUploadedFile('photos.zip', b'garbage' * 100)}, format='multipart',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Image.objects.exists())
+
+    @override_settings(BULK_UPLOAD_MAX_FILES=2)
+    def test_too_many_files(self):
+        """Test files over the per request limit are rejected."""
+        images = [SimpleUploadedFile(f'{i}.jpg', image_bytes(color=(i, 0, 0))) for i in range(3)]
+
+        res = self.client.post(BULK_URL, {'images': images}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(res.data['created'], 2)
+
+    def test_more_files_than_django_default(self):
+        """Test requests with more than Django's default of 100 files reach the bulk endpoint."""
+        images = [SimpleUploadedFile(f'{i}.jpg', image_bytes(color=(i, 0, 0))) for i in range(150)]
+
+        res = self.client.post(BULK_URL, {'images': images}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['created'], 150)
+
+    def test_no_files(self):
+        """Test request without files is rejected."""
+        res = self.client.post(BULK_URL, {}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(THUMBNAIL_PIPELINE='off', FILE_SWEEPER='sync')
+class BulkDeleteTests(MediaTestCase):
+    """Test deleting many images in one request."""
+
+    def setUp(self):
+        super().setUp()
+        plan = Plan.objects.create(name='Basic', original_size=False, expiring_link=False)
+        plan.thumbnails.add(Thumbnail.objects.create(size=100))
+        self.user = get_user_model().objects.create_user(username='Test User', password='testpass123', plan=plan)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        images = [
+            SimpleUploadedFile('a.jpg', image_bytes()),
+            SimpleUploadedFile('b.jpg', image_bytes()),
+            SimpleUploadedFile('c.jpg', image_bytes(color=(255, 0, 0))),
+        ]
+        res = self.client.post(BULK_URL, {'images': images}, format='multipart')
+        self.images = {result['image']: Image.objects.get(pk=result['id']) for result in res.data['results']}
+
+    def test_delete_by_ids(self):
+        """Test listed images are deleted and files removed after commit."""
+        red = self.images['c.jpg']
+        other_user = get_user_model().objects.create_user(username='Other User', password='testpass123')
+        other_image = Image.objects.create(owner=other_user, image=red.image.name, blob=red.blob)
+        Blob.objects.filter(pk=red.blob_id).update(refcount=2)
+        ids = [self.images['a.jpg'].id, red.id, other_image.id]
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            res = self.client.post(BULK_DELETE_URL, {'ids': ids}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['deleted'], 2)
+        self.assertEqual(
+            set(Image.objects.values_list('filename', flat=True)), {'b.jpg', other_image.filename},
+        )
+        self.assertFalse(Derivative.objects.filter(image_id__in=ids[:2]).exists())
+        # files are untouched until the transaction commits
+        self.assertTrue(os.path.exists(red.image.path))
+
+        for callback in callbacks:
+            callback()
+        # blobs are still used by b.jpg and by the other user's image
+        self.assertTrue(os.path.exists(self.images['a.jpg'].image.path))
+        self.assertTrue(os.path.exists(red.image.path))
+        self.assertEqual(Blob.objects.get(pk=red.blob_id).refcount, 1)
+
+    def test_delete_by_filter(self):
+        """Test images matching a filter are deleted with unused blobs."""
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(BULK_DELETE_URL, {'filter': {'filename': 'c.'}}, format='json')
+
+        self.assertEqual(res.data['deleted'], 1)
+        self.assertFalse(Image.objects.filter(filename='c.jpg').exists())
+        self.assertFalse(os.path.exists(self.images['c.jpg'].image.path))
+        self.assertFalse(Blob.objects.filter(pk=self.images['c.jpg'].blob_id).exists())
+
+    def test_delete_releases_blobs_once(self):
+        """Test delete signals release every blob reference once, in one statement."""
+        shared_blob_id = self.images['a.jpg'].blob_id
+        paths = [image.image.path for image in self.images.values()]
+
+        with patch('core.blobs.release_many', wraps=blobs.release_many) as release_many, \
+                self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(BULK_DELETE_URL, {'filter': {'id_gte': 1}}, format='json')
+
+        self.assertEqual(res.data['deleted'], 3)
+        release_many.assert_called_once_with({shared_blob_id: 2, self.images['c.jpg'].blob_id: 1})
+        self.assertFalse(Blob.objects.exists())
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+
+    def test_delete_legacy_images(self):
+        """Test files of images stored before blobs are removed in the same sweep."""
+        legacy = []
+        for name in ['legacy-a.jpg', 'legacy-b.jpg']:
+            image = Image(owner=self.user)
+            image.image.save(name, io.BytesIO(image_bytes()))
+            legacy.append(image)
+
+        with patch('core.sweeper.dispatch', wraps=sweeper.dispatch) as dispatch, \
+                self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(BULK_DELETE_URL, {'filter': {'id_gte': 1}}, format='json')
+
+        self.assertEqual(res.data['deleted'], 5)
+        dispatch.assert_called_once()
+        names, blob_ids = dispatch.call_args.args
+        self.assertEqual(sorted(names), sorted(image.image.name for image in legacy))
+        self.assertEqual(len(blob_ids), 2)
+        for image in legacy:
+            self.assertFalse(os.path.exists(image.image.path))
+
+    def test_invalid_request(self):
+        """Test either ids or a non-empty filter is required."""
+        for payload in [{}, {'ids': [1], 'filter': {'id_gte': 1}}, {'filter': {}}, {'ids': []}]:
+            res = self.client.post(BULK_DELETE_URL, payload, format='json')
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
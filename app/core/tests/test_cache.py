@@ -0,0 +1,101 @@
+"""
+Tests for thumbnail cache.
+"""
+import os
+from unittest.mock import patch
+
+from django.core.files.storage import FileSystemStorage
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+
+from core.cache import DerivativeCache, get_thumbnail_cache
+from core.tests.utils import DownloadTestCase, MediaTestCase, create_image
+
+
+class DerivativeCacheTests(MediaTestCase):
+    """Test storing and evicting rendered thumbnails."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username='Test User', password='testpass123')
+        self.image = create_image(self.user)
+
+    def test_put_and_open(self):
+        """Test cached derivative is returned after storing it."""
+        cache = get_thumbnail_cache()
+
+        self.assertIsNone(cache.open(self.image, 200))
+        cache.put(self.image, 200, b'thumbnail')
+
+        with cache.open(self.image, 200) as cached_file:
+            self.assertEqual(cached_file.read(), b'thumbnail')
+        self.assertIsNone(cache.open(self.image, 400))
+
+    def test_key_changes_with_source(self):
+        """Test replacing the original file invalidates cached derivatives."""
+        cache = get_thumbnail_cache()
+        key = cache.key(self.image, 200)
+
+        stat = os.stat(self.image.image.path)
+        os.utime(self.image.image.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        self.assertNotEqual(cache.key(self.image, 200), key)
+
+    def test_evict_least_recently_used(self):
+        """Test eviction removes the oldest derivatives first."""
+        cache = DerivativeCache(FileSystemStorage(os.path.join(self.media_root, 'cache')), max_bytes=10)
+        old_name = cache.put(self.image, 200, b'12345')
+        os.utime(cache.storage.path(old_name), (0, 0))
+
+        new_name = cache.put(self.image, 400, b'123456')
+
+        self.assertFalse(cache.storage.exists(old_name))
+        self.assertTrue(cache.storage.exists(new_name))
+
+    def test_put_scans_only_over_budget(self):
+        """Test writes within the budget don't scan the cache directory."""
+        cache = DerivativeCache(FileSystemStorage(os.path.join(self.media_root, 'cache')), max_bytes=20)
+
+        with patch('core.cache.os.walk', wraps=os.walk) as walk:
+            for size in range(3):
+                cache.put(self.image, size, b'12345')
+            # first write of the process counts what is cached already
+            self.assertEqual(walk.call_count, 1)
+
+            cache.put(self.image, 3, b'123456')
+            self.assertEqual(walk.call_count, 2)
+        # 21 bytes are evicted to 90% of the budget, leaving room for the next writes
+        _, filenames = cache.storage.listdir(cache._source_dir(self.image.image.name))
+        self.assertEqual(len(filenames), 3)
+
+    def test_delete_image_invalidates_cache(self):
+        """Test deleting an image removes its cached derivatives."""
+        get_thumbnail_cache().put(self.image, 200, b'thumbnail')
+        path = get_thumbnail_cache().path(self.image, 200)
+
+        with self.settings(FILE_SWEEPER='sync'), self.captureOnCommitCallbacks(execute=True):
+            self.image.delete()
+
+        self.assertFalse(os.path.exists(path))
+
+
+class ThumbnailViewCacheTests(DownloadTestCase):
+    """Test thumbnail download is served from cache."""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('core:download', args=[self.image.id, 200, self.token.key])
+
+    def test_thumbnail_cached_after_first_request(self):
+        """Test second request is streamed from cache without Pillow."""
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200)
+        rendered = res.content
+
+        with patch('core.imaging.PILImage.open') as patched_open:
+            res = self.client.get(self.url)
+            cached = b''.join(res.streaming_content)
+
+            patched_open.assert_not_called()
+        self.assertEqual(cached, rendered)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
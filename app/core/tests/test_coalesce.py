@@ -0,0 +1,90 @@
+"""
+Tests for single-flight thumbnail rendering.
+"""
+import threading
+import time
+from unittest.mock import patch
+
+from django.test import override_settings
+from django.urls import reverse
+
+from core import coalesce, metrics
+from core.cache import DerivativeCache, get_thumbnail_cache
+from core.tests.utils import DownloadTestCase, MediaTestCase
+
+
+@override_settings(RENDER_LOCK_BACKEND='file', RENDER_LOCK_TIMEOUT=5)
+class SingleFlightTests(MediaTestCase):
+    """Test render lock on the file backend."""
+
+    def _hold(self, key, seconds, acquired):
+        with coalesce.single_flight(key):
+            acquired.set()
+            time.sleep(seconds)
+
+    def test_waits_for_holder(self):
+        """Test second caller waits until the first one releases the lock."""
+        acquired = threading.Event()
+        holder = threading.Thread(target=self._hold, args=(42, 0.3, acquired))
+        holder.start()
+        acquired.wait()
+
+        start = time.monotonic()
+        with coalesce.single_flight(42) as waited:
+            elapsed = time.monotonic() - start
+        holder.join()
+
+        self.assertTrue(waited)
+        self.assertGreater(elapsed, 0.1)
+
+    def test_free_lock(self):
+        """Test uncontended lock is taken without waiting."""
+        with coalesce.single_flight(42) as waited:
+            self.assertFalse(waited)
+        with coalesce.single_flight(42) as waited:
+            self.assertFalse(waited)
+
+    @override_settings(RENDER_LOCK_TIMEOUT=0)
+    def test_timeout(self):
+        """Test waiting gives up after the timeout."""
+        acquired = threading.Event()
+        holder = threading.Thread(target=self._hold, args=(7, 0.5, acquired))
+        holder.start()
+        acquired.wait()
+
+        start = time.monotonic()
+        with coalesce.single_flight(7) as waited:
+            self.assertLess(time.monotonic() - start, 0.3)
+        holder.join()
+
+        self.assertTrue(waited)
+
+    @override_settings(RENDER_LOCK_BACKEND='auto')
+    def test_auto_backend(self):
+        """Test file lock is used without PostgreSQL."""
+        self.assertEqual(coalesce.lock_backend(), 'file')
+
+
+@override_settings(RENDER_LOCK_BACKEND='file')
+class CollapsedRenderTests(DownloadTestCase):
+    """Test download waiting for a concurrent render uses its result."""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('core:download', args=[self.image.id, 200, self.token.key])
+
+    def test_render_collapsed(self):
+        """Test thumbnail cached by the lock holder is served without rendering."""
+        get_thumbnail_cache().put(self.image, 200, b'rendered elsewhere')
+        real_open = DerivativeCache.open
+        # first lookup misses, the thumbnail appears while waiting for the lock
+        lookups = iter([lambda *args: None, real_open])
+        collapsed = metrics.snapshot().get('thumbnail_renders_collapsed', 0)
+
+        with patch.object(DerivativeCache, 'open', lambda *args: next(lookups)(*args)), \
+                patch('core.views.render_stored') as render:
+            res = self.client.get(self.url)
+
+        render.assert_not_called()
+        self.assertEqual(b''.join(res.streaming_content), b'rendered elsewhere')
+        self.assertEqual(metrics.snapshot()['thumbnail_renders_collapsed'], collapsed + 1)
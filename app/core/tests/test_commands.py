@@ -1,15 +1,22 @@
 """
 Test custom Django management commands.
 """
+import shutil
+import tempfile
+from io import BytesIO, StringIO
 from unittest.mock import patch
 
+from PIL import Image as PILImage
 from psycopg2 import OperationalError as Psycopg2Error
 
-from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management import CommandError, call_command
+from django.db import connections
 from django.db.utils import OperationalError
 from django.test import TestCase
 
-from core.models import Plan, list_of_default_plans
+from core.models import Image, Plan, list_of_default_plans
 
 
 class CommandTests(TestCase):
@@ -49,3 +56,60 @@ class CommandTests(TestCase):
 
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+    @patch('core.management.commands.wait_for_db.Command.check')
+    def test_wait_for_db_connections(self, patched_check):
+        """Test connections of all worker threads are opened at once."""
+        out = StringIO()
+        call_command('wait_for_db', '--connections', '3', stdout=out)
+
+        self.assertIn('Opened 3 connections at once', out.getvalue())
+
+    @patch('core.management.commands.wait_for_db.Command.check')
+    def test_wait_for_db_connections_refused(self, patched_check):
+        """Test error when the database doesn't admit all connections."""
+        create_connection = connections.create_connection
+        calls = []
+
+        def refuse_third(alias):
+            calls.append(alias)
+            if len(calls) == 3:
+                raise OperationalError('too many clients already')
+            return create_connection(alias)
+
+        with patch.object(connections, 'create_connection', side_effect=refuse_third):
+            with self.assertRaisesMessage(CommandError, 'too many clients already'):
+                call_command('wait_for_db', '--connections', '3', stdout=StringIO())
+
+    def test_backfill_image_metadata(self):
+        """Test metadata of images uploaded before ingest stored it is filled in."""
+        user = get_user_model().objects.create_user(username='Test User', password='testpass123')
+        img_io = BytesIO()
+        PILImage.new('RGB', (30, 20)).save(img_io, format='GIF')
+        media_root = tempfile.mkdtemp()
+        try:
+            with self.settings(MEDIA_ROOT=media_root):
+                image = Image(owner=user)
+                image.image.save('legacy.gif', File(img_io))
+
+                call_command('backfill_image_metadata', stdout=StringIO())
+        finally:
+            shutil.rmtree(media_root)
+
+        image.refresh_from_db()
+        self.assertEqual((image.width, image.height, image.image_format), (30, 20, 'GIF'))
+        self.assertEqual(image.file_size, len(img_io.getvalue()))
+
+    def test_explain_hot_queries(self):
+        """Test hot queries are planned on indexes and seeded rows are rolled back."""
+        out = StringIO()
+        call_command('explain_hot_queries', '--seed', '500', '--owners', '5', '--check', stdout=out)
+
+        self.assertIn('image_owner_id_idx', out.getvalue())
+        self.assertFalse(Image.objects.exists())
+        self.assertFalse(Plan.objects.exists())
+
+    def test_explain_hot_queries_no_images(self):
+        """Test command asks for seeding when there are no images."""
+        with self.assertRaises(CommandError):
+            call_command('explain_hot_queries', stdout=StringIO())
@@ -0,0 +1,154 @@
+"""
+Tests for HTTP delivery of thumbnails and originals.
+"""
+import os
+from unittest.mock import patch
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+
+from core import delivery
+from core.cache import get_thumbnail_cache
+from core.models import Thumbnail
+from core.tests.utils import DownloadTestCase
+
+
+class NegotiateFormatTests(SimpleTestCase):
+    """Test choosing thumbnail format from Accept header."""
+
+    def _negotiate(self, accept, formats=('AVIF', 'WEBP', 'JPEG')):
+        request = RequestFactory().get('/', HTTP_ACCEPT=accept)
+        with patch('core.delivery.output_formats', return_value=list(formats)):
+            return delivery.negotiate_format(request)
+
+    def test_preferred_format(self):
+        """Test first configured format accepted by client wins."""
+        self.assertEqual(self._negotiate('image/avif,image/webp,*/*'), 'AVIF')
+        self.assertEqual(self._negotiate('image/webp,image/avif;q=0,*/*;q=0.8'), 'WEBP')
+
+    def test_jpeg_fallback(self):
+        """Test wildcard and missing Accept get JPEG."""
+        self.assertEqual(self._negotiate('*/*'), 'JPEG')
+        self.assertEqual(self._negotiate(''), 'JPEG')
+        self.assertEqual(self._negotiate('image/webp', formats=('JPEG',)), 'JPEG')
+
+    @override_settings(THUMBNAIL_FORMATS=['WEBP', 'JPEG'])
+    def test_unsupported_format_skipped(self):
+        """Test format Pillow can't write is never negotiated."""
+        request = RequestFactory().get('/', HTTP_ACCEPT='image/webp')
+        with patch('core.pipeline.can_encode', return_value=False):
+            self.assertEqual(delivery.negotiate_format(request), 'JPEG')
+
+
+class DeliveryTests(DownloadTestCase):
+    """Test conditional requests and caching headers of downloads."""
+
+    plan_options = {'name': 'Premium', 'original_size': True, 'expiring_link': False, 'cache_max_age': 600}
+    image_size = (800, 600)
+
+    def setUp(self):
+        super().setUp()
+        self.thumbnail_url = reverse('core:download', args=[self.image.id, 200, self.token.key])
+        self.original_url = reverse('core:download-original', args=[self.image.id, self.token.key])
+
+    def test_thumbnail_caching_headers(self):
+        """Test thumbnail has validators and plan max-age."""
+        res = self.client.get(self.thumbnail_url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', res)
+        self.assertEqual(res['Cache-Control'], 'max-age=600')
+
+    def test_thumbnail_varies_on_accept(self):
+        """Test negotiated thumbnail responses vary on Accept."""
+        res = self.client.get(self.thumbnail_url)
+        self.assertIn('Accept', res['Vary'])
+
+        res = self.client.get(self.thumbnail_url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn('Accept', res['Vary'])
+
+    def test_thumbnail_quality_cached_separately(self):
+        """Test changing thumbnail quality renders and caches a new variant."""
+        etag = self.client.get(self.thumbnail_url)['ETag']
+        Thumbnail.objects.filter(size=200).update(quality=40)
+        self.plan.save()
+
+        res = self.client.get(self.thumbnail_url)
+
+        self.assertNotEqual(res['ETag'], etag)
+        self.assertTrue(get_thumbnail_cache().exists(self.image, 200, 'JPEG', 40))
+        self.assertTrue(get_thumbnail_cache().exists(self.image, 200, 'JPEG', None))
+
+    def test_thumbnail_if_none_match(self):
+        """Test matching ETag returns 304 without opening any file."""
+        etag = self.client.get(self.thumbnail_url)['ETag']
+
+        with patch('core.views.get_thumbnail_cache') as patched_cache:
+            res = self.client.get(self.thumbnail_url, HTTP_IF_NONE_MATCH=etag)
+
+            patched_cache.assert_not_called()
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+        self.assertEqual(res['Cache-Control'], 'max-age=600')
+
+    def test_thumbnail_if_modified_since(self):
+        """Test unchanged source returns 304 for If-Modified-Since."""
+        last_modified = self.client.get(self.thumbnail_url)['Last-Modified']
+
+        res = self.client.get(self.thumbnail_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_differs_per_size(self):
+        """Test thumbnail and original of an image have different ETags."""
+        thumbnail_etag = self.client.get(self.thumbnail_url)['ETag']
+        original_etag = self.client.get(self.original_url)['ETag']
+
+        self.assertNotEqual(thumbnail_etag, original_etag)
+
+    def test_download_original(self):
+        """Test original image is downloaded with validators."""
+        res = self.client.get(self.original_url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        with open(self.image.image.path, 'rb') as original:
+            self.assertEqual(b''.join(res.streaming_content), original.read())
+
+        res = self.client.get(self.original_url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_download_original_not_in_plan(self):
+        """Test original is not available for plans without original size."""
+        self.plan.original_size = False
+        self.plan.save()
+
+        res = self.client.get(self.original_url)
+
+        self.assertIn(b'unauthorized', res.content)
+        self.assertNotIn('ETag', res)
+
+    def test_thumbnail_x_accel_redirect(self):
+        """Test cached thumbnail is handed to nginx in x-accel mode."""
+        self.client.get(self.thumbnail_url)
+        cached_path = get_thumbnail_cache().path(self.image, 200)
+
+        with self.settings(IMAGE_DELIVERY_BACKEND='x-accel', IMAGE_ACCEL_PREFIX='/protected-media/'):
+            res = self.client.get(self.thumbnail_url)
+
+        relative_path = os.path.relpath(cached_path, self.media_root)
+        self.assertEqual(res['X-Accel-Redirect'], '/protected-media/' + relative_path)
+        self.assertEqual(res.content, b'')
+        self.assertIn('ETag', res)
+
+    def test_original_x_sendfile(self):
+        """Test original is handed to web server in x-sendfile mode."""
+        with self.settings(IMAGE_DELIVERY_BACKEND='x-sendfile'):
+            res = self.client.get(self.original_url)
+
+        self.assertEqual(res['X-Sendfile'], self.image.image.path)
+        self.assertEqual(res.content, b'')
@@ -2,8 +2,10 @@
 Tests for thumbnail APIs.
 """
 import tempfile
+import json
 import os
 from io import BytesIO
+from unittest.mock import patch
 
 from PIL import Image as PILImage
 
@@ -78,6 +80,7 @@ class AuthenticatedUserAPITest(TestCase):
         self.image = Image(owner=self.user)
         self.image.image.save('test.jpg', image_file)
         self.image.save()
+        self.extra_images = []
 
         # create default plans
         default_plans = list_of_default_plans()
@@ -93,6 +96,8 @@ class AuthenticatedUserAPITest(TestCase):
 
     def tearDown(self):
         self.image.image.delete()
+        for image in self.extra_images:
+            image.image.delete()
 
     def test_check_user_view(self):
         """Test user auth correctly"""
@@ -114,11 +119,26 @@ class AuthenticatedUserAPITest(TestCase):
             }
             res = self.client.post(IMAGE_URL, payload, format='multipart')
 
-            image_from_db = Image.objects.get(image__contains=file_name)
+            image_from_db = Image.objects.get(filename__startswith=file_name)
             self.assertEqual(res.status_code, status.HTTP_201_CREATED)
             self.assertIn('image', res.data)
             self.assertTrue(os.path.exists(image_from_db.image.path))
 
+    def test_upload_image_stores_metadata(self):
+        """Test dimensions, format and size of an upload are stored on the image"""
+        img_io = BytesIO()
+        PILImage.new('RGB', (120, 80)).save(img_io, format='PNG')
+        img_io.name = 'metadata.png'
+        img_io.seek(0)
+
+        res = self.client.post(IMAGE_URL, {'image': img_io}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        image = Image.objects.get(pk=res.data['id'])
+        self.assertEqual((image.width, image.height, image.image_format), (120, 80, 'PNG'))
+        self.assertEqual(image.file_size, len(img_io.getvalue()))
+        self.assertEqual(res.data['width'], 120)
+
     def test_upload_image_bad_request(self):
         """Test uploading an invalid image."""
         payload = {'image': 'notanimage'}
@@ -136,9 +156,9 @@ class AuthenticatedUserAPITest(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         for t in thumbnails:
-            self.assertIn(f'thumbnail of height {t["size"]}px:', res.data[0])
-        self.assertNotIn('original image', res.data[0])
-        self.assertNotIn('expiring link', res.data[0])
+            self.assertIn(f'thumbnail of height {t["size"]}px:', res.data['results'][0])
+        self.assertNotIn('original image', res.data['results'][0])
+        self.assertNotIn('expiring link', res.data['results'][0])
 
     def test_premium_plan_user(self):
         """Test basic plan access"""
@@ -150,9 +170,9 @@ class AuthenticatedUserAPITest(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         for t in thumbnails:
-            self.assertIn(f'thumbnail of height {t["size"]}px:', res.data[0])
-        self.assertIn('original image', res.data[0])
-        self.assertNotIn('expiring link', res.data[0])
+            self.assertIn(f'thumbnail of height {t["size"]}px:', res.data['results'][0])
+        self.assertIn('original image', res.data['results'][0])
+        self.assertNotIn('expiring link', res.data['results'][0])
 
     def test_enterprise_plan_user(self):
         """Test basic plan access"""
@@ -164,6 +184,124 @@ class AuthenticatedUserAPITest(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         for t in thumbnails:
-            self.assertIn(f'thumbnail of height {t["size"]}px:', res.data[0])
-        self.assertIn('original image', res.data[0])
-        self.assertIn('expiring link', res.data[0])
+            self.assertIn(f'thumbnail of height {t["size"]}px:', res.data['results'][0])
+        self.assertIn('original image', res.data['results'][0])
+        self.assertIn('expiring link', res.data['results'][0])
+
+    def test_list_query_count_is_constant(self):
+        """Test listing images does not run queries per image"""
+        self.user.plan = Plan.objects.get(name='Enterprise')
+
+        with self.assertNumQueries(3):
+            res = self.client.get(LIST_URL)
+        self.assertEqual(len(res.data['results']), 1)
+
+        for _ in range(10):
+            image = Image(owner=self.user)
+            image.image.save('test.jpg', File(BytesIO(b'image')))
+            self.extra_images.append(image)
+
+        with self.assertNumQueries(3):
+            res = self.client.get(LIST_URL)
+        self.assertEqual(len(res.data['results']), 11)
+
+    def test_list_links(self):
+        """Test links in image list point to image downloads"""
+        self.user.plan = Plan.objects.get(name='Premium')
+
+        res = self.client.get(LIST_URL)
+
+        image = res.data['results'][0]
+        self.assertEqual(image['image'], os.path.basename(self.image.image.name))
+        self.assertEqual(
+            image['thumbnail of height 400px:'],
+            'testserver' + reverse('core:download', args=[self.image.id, 400, self.token.key]),
+        )
+        self.assertEqual(
+            image['original image'],
+            'testserver' + reverse('core:download-original', args=[self.image.id, self.token.key]),
+        )
+
+    def test_list_srcset(self):
+        """Test variants are listed with sizes computed from stored metadata"""
+        plan = Plan.objects.get(name='Premium')
+        plan.transform_families = 'width'
+        plan.save()
+        self.user.plan = plan
+        Image.objects.filter(pk=self.image.pk).update(width=1600, height=1000, image_format='JPEG', file_size=1234)
+
+        with patch('PIL.Image.open') as patched_open:
+            res = self.client.get(LIST_URL)
+
+            patched_open.assert_not_called()
+        image = res.data['results'][0]
+        self.assertEqual((image['width'], image['height'], image['format'], image['bytes']), (1600, 1000, 'JPEG', 1234))
+        self.assertEqual(
+            [(variant['width'], variant['height']) for variant in image['variants']],
+            [(320, 200), (640, 400), (960, 600), (1280, 800), (1600, 1000)],
+        )
+        self.assertEqual(image['variants'][0]['url'], image['thumbnail of height 200px:'])
+        transform_url = 'testserver' + reverse('core:download-transform', args=[self.image.id, 'w960', self.token.key])
+        self.assertIn(f'{transform_url} 960w', image['srcset'])
+        self.assertTrue(image['srcset'].endswith(f'{image["original image"]} 1600w'))
+
+    def test_list_without_metadata(self):
+        """Test images uploaded before metadata was stored have no variants"""
+        self.user.plan = Plan.objects.get(name='Premium')
+
+        res = self.client.get(LIST_URL)
+
+        self.assertEqual(res.data['results'][0]['variants'], [])
+        self.assertEqual(res.data['results'][0]['srcset'], '')
+
+    def test_list_cursor_pagination(self):
+        """Test images are listed page by page following next cursor"""
+        self.user.plan = Plan.objects.get(name='Basic')
+        for _ in range(4):
+            image = Image(owner=self.user)
+            image.image.save('test.jpg', File(BytesIO(b'image')))
+            self.extra_images.append(image)
+
+        ids = []
+        url = LIST_URL + '?page_size=2'
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(res.data['results']), 2)
+            ids.extend(image['id'] for image in res.data['results'])
+            url = res.data['next']
+
+        expected = [self.image.id] + [image.id for image in self.extra_images]
+        self.assertEqual(ids, expected)
+
+    def test_list_page_size_settings(self):
+        """Test default and maximum page size follow settings"""
+        self.user.plan = Plan.objects.get(name='Basic')
+        for _ in range(4):
+            image = Image(owner=self.user)
+            image.image.save('test.jpg', File(BytesIO(b'image')))
+            self.extra_images.append(image)
+
+        with self.settings(IMAGE_LIST_PAGE_SIZE=2, IMAGE_LIST_MAX_PAGE_SIZE=3):
+            default_page = self.client.get(LIST_URL)
+            largest_page = self.client.get(LIST_URL, {'page_size': 10})
+
+        self.assertEqual(len(default_page.data['results']), 2)
+        self.assertEqual(len(largest_page.data['results']), 3)
+
+    def test_list_stream_ndjson(self):
+        """Test whole image list can be streamed as NDJSON"""
+        self.user.plan = Plan.objects.get(name='Premium')
+        for _ in range(2):
+            image = Image(owner=self.user)
+            image.image.save('test.jpg', File(BytesIO(b'image')))
+            self.extra_images.append(image)
+
+        with self.settings(IMAGE_LIST_STREAM_CHUNK_SIZE=2):
+            res = self.client.get(LIST_URL, {'stream': 'ndjson'})
+            lines = b''.join(res.streaming_content).decode().splitlines()
+
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        entries = [json.loads(line) for line in lines]
+        self.assertEqual([entry['id'] for entry in entries], [self.image.id] + [i.id for i in self.extra_images])
+        self.assertIn('original image', entries[0])
@@ -0,0 +1,88 @@
+"""
+Tests for image processing helpers.
+"""
+import tempfile
+from io import BytesIO
+from unittest import skipUnless
+
+from PIL import Image as PILImage
+
+from django.test import SimpleTestCase
+
+from core.imaging import can_encode, encode, render_thumbnail, render_thumbnails
+
+
+class RenderThumbnailTests(SimpleTestCase):
+    """Test rendering thumbnails."""
+
+    def _render(self, image_format, suffix, size=(3000, 2000), height=200):
+        with tempfile.NamedTemporaryFile(suffix=suffix) as image_file:
+            PILImage.new('RGB', size, color='red').save(image_file, format=image_format)
+            image_file.flush()
+
+            with tempfile.TemporaryFile() as thumbnail_file:
+                thumbnail_file.write(render_thumbnail(image_file.name, height))
+                thumbnail_file.seek(0)
+                with PILImage.open(thumbnail_file) as thumbnail:
+                    thumbnail.load()
+                    return thumbnail
+
+    def test_render_jpeg_with_reduced_decode(self):
+        """Test JPEG thumbnail has requested size after draft decoding."""
+        thumbnail = self._render('JPEG', '.jpg')
+
+        self.assertEqual(thumbnail.size, (300, 200))
+        self.assertEqual(thumbnail.format, 'JPEG')
+
+    def test_render_png_with_full_decode(self):
+        """Test formats without draft support are rendered as well."""
+        thumbnail = self._render('PNG', '.png')
+
+        self.assertEqual(thumbnail.size, (300, 200))
+
+    def test_render_keeps_colors(self):
+        """Test reduced decoding does not change image content."""
+        thumbnail = self._render('JPEG', '.jpg', size=(1600, 1600), height=100)
+        red, green, blue = thumbnail.getpixel((50, 50))
+
+        self.assertGreater(red, 240)
+        self.assertLess(green, 20)
+        self.assertLess(blue, 20)
+
+
+class EncodeTests(SimpleTestCase):
+    """Test encoding thumbnails into output formats."""
+
+    def setUp(self):
+        gradient = PILImage.linear_gradient('L').resize((300, 200))
+        self.thumbnail = PILImage.merge('RGB', (gradient, PILImage.effect_noise((300, 200), 32), gradient))
+
+    def test_jpeg_is_progressive(self):
+        """Test JPEG fallback is progressive."""
+        with PILImage.open(BytesIO(encode(self.thumbnail, 'JPEG'))) as thumbnail:
+            self.assertTrue(thumbnail.info.get('progressive'))
+
+    def test_quality_changes_size(self):
+        """Test lower quality produces smaller files."""
+        low = encode(self.thumbnail, 'JPEG', quality=30)
+        high = encode(self.thumbnail, 'JPEG', quality=95)
+
+        self.assertLess(len(low), len(high))
+
+    @skipUnless(can_encode('WEBP'), 'Pillow built without WebP')
+    def test_webp(self):
+        """Test thumbnail is encoded as WebP."""
+        with PILImage.open(BytesIO(encode(self.thumbnail, 'WEBP', quality=80))) as thumbnail:
+            self.assertEqual(thumbnail.format, 'WEBP')
+
+    def test_render_thumbnails_in_formats(self):
+        """Test one render returns every requested format."""
+        with tempfile.NamedTemporaryFile(suffix='.png') as image_file:
+            self.thumbnail.save(image_file, format='PNG')
+            image_file.flush()
+
+            renders = render_thumbnails(image_file.name, 100, ['JPEG', 'PNG'])
+
+        self.assertEqual(set(renders), {'JPEG', 'PNG'})
+        with PILImage.open(BytesIO(renders['PNG'])) as thumbnail:
+            self.assertEqual(thumbnail.size, (150, 100))
@@ -0,0 +1,138 @@
+"""
+Tests for render job queue and render_worker command.
+"""
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+
+from core import jobs
+from core.cache import get_thumbnail_cache
+from core.models import Derivative, RenderJob
+from core.tests.utils import DownloadTestCase
+
+
+@override_settings(THUMBNAIL_PIPELINE='queue')
+class RenderJobTests(DownloadTestCase):
+    """Test queueing and processing render jobs."""
+
+    plan_options = {'name': 'Premium', 'original_size': True, 'expiring_link': False}
+    thumbnail_sizes = [200, 400]
+    image_size = (800, 600)
+
+    def test_new_image_is_queued(self):
+        """Test saving an image queues a job for every plan thumbnail."""
+        sizes = self.image.render_jobs.values_list('size', flat=True)
+
+        self.assertEqual(sorted(sizes), [200, 400])
+
+    def test_enqueue_skips_active_jobs(self):
+        """Test an image size is queued only once while pending."""
+        jobs.enqueue(self.image, [200, 400])
+
+        self.assertEqual(self.image.render_jobs.count(), 2)
+
+    def test_claim_and_visibility_timeout(self):
+        """Test claimed jobs are hidden until visibility timeout passes."""
+        claimed = jobs.claim('worker-1', 10, visibility_timeout=60)
+
+        self.assertEqual(len(claimed), 2)
+        self.assertTrue(all(job.status == RenderJob.RUNNING for job in claimed))
+        self.assertEqual(jobs.claim('worker-2', 10, visibility_timeout=60), [])
+
+        RenderJob.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+        reclaimed = jobs.claim('worker-2', 10, visibility_timeout=60)
+
+        self.assertEqual({job.locked_by for job in reclaimed}, {'worker-2'})
+        self.assertEqual({job.attempts for job in reclaimed}, {2})
+
+    def test_abandoned_job_fails_after_max_attempts(self):
+        """Test a job whose worker died on the last attempt is not claimed again."""
+        RenderJob.objects.update(
+            status=RenderJob.RUNNING, attempts=3, available_at=timezone.now() - timedelta(seconds=1),
+        )
+        RenderJob.objects.filter(size=400).update(attempts=2)
+
+        claimed = jobs.claim('worker', 10, visibility_timeout=60, max_attempts=3)
+
+        self.assertEqual([job.size for job in claimed], [400])
+        self.assertEqual(RenderJob.objects.get(size=200).status, RenderJob.FAILED)
+        self.assertEqual(self.image.derivatives.get(size=200).status, Derivative.FAILED)
+
+    def test_fail_retries_until_max_attempts(self):
+        """Test failed job is retried and then marked as failed."""
+        RenderJob.objects.filter(size=400).delete()
+        job = jobs.claim('worker', 1, visibility_timeout=60)[0]
+
+        jobs.fail(job, 'error', max_attempts=2, retry_delay=0)
+        self.assertEqual(job.status, RenderJob.QUEUED)
+
+        job = jobs.claim('worker', 1, visibility_timeout=60)[0]
+        jobs.fail(job, 'error', max_attempts=2, retry_delay=0)
+        self.assertEqual(job.status, RenderJob.FAILED)
+        self.assertEqual(job.last_error, 'error')
+
+    def test_render_worker_command(self):
+        """Test render_worker renders queued thumbnails into the cache."""
+        call_command('render_worker', '--once', '--sync', stdout=StringIO())
+
+        cache = get_thumbnail_cache()
+        for job in self.image.render_jobs.all():
+            self.assertEqual(job.status, RenderJob.DONE)
+            cached_file = cache.open(self.image, job.size)
+            self.assertIsNotNone(cached_file)
+            cached_file.close()
+        statuses = set(self.image.derivatives.values_list('status', flat=True))
+        self.assertEqual(statuses, {Derivative.READY})
+
+    def test_render_worker_recreates_broken_pool(self):
+        """Test jobs of a pool whose process died are requeued and rendered by a new pool."""
+        pools = []
+
+        class Pool:
+            # first pool behaves as if a process was killed, later ones render in this process
+            def __init__(self, max_workers):
+                self.broken = not pools
+                pools.append(self)
+
+            def submit(self, fn, *args):
+                future = Future()
+                if self.broken:
+                    future.set_exception(BrokenProcessPool('process died'))
+                else:
+                    future.set_result(fn(*args))
+                return future
+
+            def shutdown(self, wait=True):
+                pass
+
+        with patch('core.management.commands.render_worker.ProcessPoolExecutor', Pool), \
+                patch('core.management.commands.render_worker.connections'):
+            call_command(
+                'render_worker', '--once', '--concurrency', '2', '--retry-delay', '0',
+                stdout=StringIO(), stderr=StringIO(),
+            )
+
+        self.assertEqual(len(pools), 2)
+        for job in self.image.render_jobs.all():
+            self.assertEqual(job.status, RenderJob.DONE)
+            self.assertEqual(job.attempts, 2)
+
+    def test_download_queues_instead_of_rendering(self):
+        """Test thumbnail miss is queued and not rendered by the web worker."""
+        RenderJob.objects.all().delete()
+        url = reverse('core:download', args=[self.image.id, 200, self.token.key])
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIn('Retry-After', res)
+        self.assertTrue(self.image.render_jobs.filter(size=200, status=RenderJob.QUEUED).exists())
@@ -0,0 +1,118 @@
+"""
+Tests for signed expiring links.
+"""
+from io import BytesIO
+from unittest.mock import patch
+
+from PIL import Image as PILImage
+
+from django.core import signing
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import links
+from core.models import Thumbnail
+from core.tests.utils import DownloadTestCase
+
+
+LIST_URL = reverse('core:list')
+
+
+class SignedLinkTests(TestCase):
+    """Test signing and verifying links."""
+
+    def test_sign_and_verify(self):
+        """Test signed link returns its image and variant."""
+        image_id, variant, _ = links.verify(links.sign(1, 'original', 300))
+
+        self.assertEqual((image_id, variant), (1, 'original'))
+
+    def test_tampered_link(self):
+        """Test modified link is rejected."""
+        signed = links.sign(1, 'original', 300)
+        forged = signing.dumps([2, 'original', 2 ** 40], salt='other')
+
+        with self.assertRaises(signing.BadSignature):
+            links.verify(signed[:-1] + ('a' if signed[-1] != 'a' else 'b'))
+        with self.assertRaises(signing.BadSignature):
+            links.verify(forged)
+
+    def test_expired_link(self):
+        """Test link is rejected after its expiry."""
+        signed = links.sign(1, 'original', 300)
+
+        with patch('core.links.time.time', return_value=10 ** 10):
+            with self.assertRaises(links.LinkExpired):
+                links.verify(signed)
+
+
+class ExpiringLinkAPITests(DownloadTestCase):
+    """Test expiring links of Enterprise plan."""
+
+    plan_options = {'name': 'Enterprise', 'original_size': True, 'expiring_link': True}
+    image_size = (800, 600)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user, token=self.token)
+
+    def test_list_contains_expiring_link(self):
+        """Test expiring link downloads original without token lookup."""
+        res = self.client.get(LIST_URL, {'expires_in': 600})
+        link = res.data['results'][0]['expiring link']
+
+        self.assertTrue(link.startswith('testserver/api/link/'))
+        with self.assertNumQueries(1):
+            res = self.client.get(link[len('testserver'):])
+            content = b''.join(res.streaming_content)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        with open(self.image.image.path, 'rb') as original:
+            self.assertEqual(content, original.read())
+        self.assertLessEqual(int(res['Cache-Control'].split('=')[1]), 600)
+
+    def test_expiring_link_without_original_size(self):
+        """Test plan without originals gets expiring links to its largest thumbnail."""
+        self.plan.original_size = False
+        self.plan.save()
+        self.plan.thumbnails.add(Thumbnail.objects.create(size=400))
+
+        res = self.client.get(LIST_URL, {'expires_in': 600})
+        link = res.data['results'][0]['expiring link']
+        _, variant, _ = links.verify(link.rsplit('/', 1)[-1])
+        res = self.client.get(link[len('testserver'):])
+
+        self.assertEqual(variant, 400)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(PILImage.open(BytesIO(res.content)).height, 400)
+
+    def test_list_expires_in_out_of_range(self):
+        """Test expiry outside of allowed window is rejected."""
+        for expires_in in [299, 30001, 'abc']:
+            res = self.client.get(LIST_URL, {'expires_in': expires_in})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_thumbnail_link(self):
+        """Test signed link can point to a thumbnail."""
+        url = reverse('core:expiring-link', args=[links.sign(self.image.id, 200, 300)])
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+
+    def test_expired_and_invalid_link(self):
+        """Test expired link is gone and forged link is not found."""
+        signed = links.sign(self.image.id, 'original', 300)
+
+        with patch('core.links.time.time', return_value=10 ** 10):
+            res = self.client.get(reverse('core:expiring-link', args=[signed]))
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+
+        res = self.client.get(reverse('core:expiring-link', args=[signed + 'x']))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
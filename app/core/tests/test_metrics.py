@@ -0,0 +1,119 @@
+"""
+Tests for request metrics and the metrics endpoint.
+"""
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+
+from core import metrics
+from core.tests.utils import DownloadTestCase
+
+
+METRICS_URL = reverse('metrics')
+
+
+def sample(text, series):
+    """Return value of a series in Prometheus text, None when missing."""
+    for line in text.splitlines():
+        name, _, value = line.rpartition(' ')
+        if name == series:
+            return float(value)
+    return None
+
+
+class RenderTests(SimpleTestCase):
+    """Test metrics rendered in Prometheus text format."""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test histogram buckets count observations up to their bound."""
+        for value in [0, 3, 7, 1000]:
+            metrics.observe('db_queries', value, endpoint='test:histogram')
+
+        text = metrics.render()
+
+        self.assertEqual(sample(text, 'db_queries_bucket{endpoint="test:histogram",le="0"}'), 1)
+        self.assertEqual(sample(text, 'db_queries_bucket{endpoint="test:histogram",le="5"}'), 2)
+        self.assertEqual(sample(text, 'db_queries_bucket{endpoint="test:histogram",le="10"}'), 3)
+        self.assertEqual(sample(text, 'db_queries_bucket{endpoint="test:histogram",le="+Inf"}'), 4)
+        self.assertEqual(sample(text, 'db_queries_sum{endpoint="test:histogram"}'), 1010)
+        self.assertIn('# TYPE db_queries histogram', text)
+
+    def test_counter_labels_escaped(self):
+        """Test label values are escaped."""
+        metrics.increment('http_requests_total', endpoint='test:"quoted"', status=200)
+
+        self.assertIn('http_requests_total{endpoint="test:\\"quoted\\"",status="200"} 1', metrics.render())
+
+    def test_measures_outside_request_dropped(self):
+        """Test hot path timers are no-ops outside a request."""
+        with metrics.timer('decode_seconds'):
+            metrics.add('cache_hits')
+
+        token = metrics.start_request()
+        measures = metrics.finish_request(token, 'test:empty', 200, 0.01)
+
+        self.assertEqual(dict(measures), {'db_queries': 0, 'db_seconds': 0})
+
+
+@override_settings(THUMBNAIL_PIPELINE='off', IMAGE_DELIVERY_BACKEND='python')
+class MiddlewareTests(DownloadTestCase):
+    """Test measures of requests exported per endpoint."""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('core:download', args=[self.image.id, 200, self.token.key])
+
+    def test_thumbnail_measures(self):
+        """Test render steps, queries and cache hits are exported for the endpoint."""
+        before = metrics.render()
+
+        self.client.get(self.url)
+        res = self.client.get(self.url)
+        b''.join(res.streaming_content)
+        text = self.client.get(METRICS_URL).content.decode()
+
+        def delta(series):
+            return sample(text, series) - (sample(before, series) or 0)
+
+        labels = '{endpoint="core:download"}'
+        self.assertEqual(delta(f'http_request_duration_seconds_count{labels}'), 2)
+        self.assertEqual(delta('http_requests_total{endpoint="core:download",status="200"}'), 2)
+        self.assertEqual(delta(f'db_queries_count{labels}'), 2)
+        self.assertGreater(delta(f'db_queries_sum{labels}'), 0)
+        for step in ['decode', 'resize', 'encode']:
+            self.assertEqual(delta(f'{step}_seconds_count{labels}'), 1)
+        self.assertEqual(delta(f'cache_misses_total{labels}'), 1)
+        self.assertEqual(delta(f'cache_hits_total{labels}'), 1)
+        self.assertGreater(delta(f'storage_write_bytes_sum{labels}'), 0)
+        self.assertGreater(delta(f'storage_read_bytes_sum{labels}'), 0)
+
+    def test_server_timing_in_debug(self):
+        """Test breakdown is sent in Server-Timing under DEBUG only."""
+        res = self.client.get(self.url)
+        self.assertNotIn('Server-Timing', res)
+
+        with override_settings(DEBUG=True):
+            res = self.client.get(reverse('core:download', args=[self.image.id, 200, self.token.key]))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertRegex(res['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", .*total;dur=[\d.]+$')
+
+    @override_settings(METRICS_TOKEN='scraper-secret')
+    def test_token_required(self):
+        """Test metrics are only sent to scrapers with the token when one is set."""
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer scraper-secret')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        """Test metrics endpoint is gone when metrics are disabled."""
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,87 @@
+"""
+Tests for thumbnail pre-generation pipeline.
+"""
+import tempfile
+from unittest.mock import patch
+
+from PIL import Image as PILImage
+
+from django.test import override_settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework.authtoken.models import Token
+
+from core.cache import get_thumbnail_cache
+from core.models import Derivative, Image, Plan, Thumbnail
+from core.pipeline import render_derivatives
+from core.tests.utils import MediaTestCase
+
+
+IMAGE_URL = reverse('core:image-list')
+LIST_URL = reverse('core:list')
+
+
+@override_settings(THUMBNAIL_PIPELINE='sync')
+class PipelineTests(MediaTestCase):
+    """Test thumbnails are rendered when an image is uploaded."""
+
+    def setUp(self):
+        super().setUp()
+        plan = Plan.objects.create(name='Premium', original_size=True, expiring_link=False)
+        for size in [200, 400]:
+            plan.thumbnails.add(Thumbnail.objects.create(size=size))
+
+        self.user = get_user_model().objects.create_user(username='Test User', password='testpass123', plan=plan)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user, token=self.token)
+
+    def _upload(self):
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            PILImage.new('RGB', (800, 600)).save(image_file, format='JPEG')
+            image_file.seek(0)
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.client.post(IMAGE_URL, {'image': image_file}, format='multipart')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return Image.objects.get(pk=res.data['id'])
+
+    def test_upload_renders_plan_thumbnails(self):
+        """Test every plan thumbnail is cached after upload."""
+        image = self._upload()
+
+        cache = get_thumbnail_cache()
+        for derivative in image.derivatives.all():
+            self.assertEqual(derivative.status, Derivative.READY)
+            with cache.open(image, derivative.size) as cached_file:
+                self.assertEqual(PILImage.open(cached_file).height, derivative.size)
+        self.assertEqual(image.derivatives.count(), 2)
+
+    def test_render_failure_marks_derivative(self):
+        """Test failed rendering is reported in derivative status."""
+        with patch('core.pipeline.render_thumbnails', side_effect=OSError), \
+                self.assertLogs('core.pipeline', level='ERROR'):
+            image = self._upload()
+
+        statuses = set(image.derivatives.values_list('status', flat=True))
+        self.assertEqual(statuses, {Derivative.FAILED})
+
+        render_derivatives(image.pk)
+        statuses = set(image.derivatives.values_list('status', flat=True))
+        self.assertEqual(statuses, {Derivative.READY})
+
+    def test_list_reports_thumbnail_status(self):
+        """Test image list shows readiness of each thumbnail."""
+        with override_settings(THUMBNAIL_PIPELINE='off'):
+            image = self._upload()
+        Derivative.objects.filter(image=image, size=200).update(status=Derivative.READY)
+
+        res = self.client.get(LIST_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data['results'][0]['thumbnail status'],
+            {200: Derivative.READY, 400: Derivative.PENDING},
+        )
@@ -0,0 +1,100 @@
+"""
+Tests for profiling of slow and sampled requests.
+"""
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+
+from core import profiling
+from core.pipeline import render_stored
+from core.tests.utils import DownloadTestCase
+
+
+def slow_render(*args):
+    """Render like a large original would, slow enough to be sampled."""
+    time.sleep(0.05)
+    return render_stored(*args)
+
+
+@override_settings(
+    THUMBNAIL_PIPELINE='off', PROFILE_REQUESTS=True, PROFILE_SLOW_SECONDS=0.02,
+    PROFILE_SAMPLE_RATE=0, PROFILE_INTERVAL=0.001,
+)
+class ProfilingTests(DownloadTestCase):
+    """Test profiles are kept for slow and sampled requests."""
+
+    def setUp(self):
+        super().setUp()
+        self.profile_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_path)
+        settings_override = override_settings(PROFILE_PATH=self.profile_path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.image.width, self.image.height = self.image_size
+        self.image.save(update_fields=['width', 'height'])
+
+    def _download(self):
+        with patch('core.views.render_stored', side_effect=slow_render):
+            return self.client.get(reverse('core:download', args=[self.image.id, 200, self.token.key]))
+
+    def test_slow_request_sampled(self):
+        """Test stacks of a slow request are kept with its tags."""
+        self._download()
+
+        [meta] = profiling.list_profiles()
+        self.assertEqual(meta['endpoint'], 'core:download')
+        self.assertEqual(meta['kind'], 'samples')
+        self.assertNotIn(self.token.key, meta['route'])
+        self.assertEqual(meta['tags'], {'image_width': 1600, 'image_height': 1000, 'plan_id': self.plan.id})
+        functions = [row[0] for row in profiling.top_functions(meta, limit=100)]
+        self.assertTrue(any(function.endswith('(thumbnailView)') for function in functions))
+
+    @override_settings(PROFILE_SLOW_SECONDS=60)
+    def test_fast_request_dropped(self):
+        """Test requests under the threshold leave no profile."""
+        self._download()
+
+        self.assertEqual(profiling.list_profiles(), [])
+
+    @override_settings(PROFILE_SLOW_SECONDS=60, PROFILE_SAMPLE_RATE=1)
+    def test_sampled_request_cprofiled(self):
+        """Test sampled request is profiled with cProfile and summarized by the command."""
+        self._download()
+
+        [meta] = profiling.list_profiles()
+        self.assertEqual(meta['kind'], 'cprofile')
+        self.assertTrue(os.path.exists(os.path.join(self.profile_path, meta['id'] + '.prof')))
+
+        out = StringIO()
+        call_command('profiles', meta['id'], '--top', '50', stdout=out)
+        self.assertIn('plan=Basic', out.getvalue())
+        self.assertIn('(thumbnailView)', out.getvalue())
+
+    @override_settings(PROFILE_MAX_FILES=2, PROFILE_SAMPLE_RATE=1)
+    def test_rotation(self):
+        """Test only the newest profiles are kept."""
+        for _ in range(3):
+            self._download()
+
+        self.assertEqual(len(profiling.list_profiles()), 2)
+        # .json and .prof of each
+        self.assertEqual(len(os.listdir(self.profile_path)), 4)
+
+    def test_command_lists_profiles(self):
+        """Test command lists profiles filtered by endpoint."""
+        self._download()
+
+        out = StringIO()
+        call_command('profiles', '--endpoint', 'core:download', stdout=out)
+        self.assertIn('core:download', out.getvalue())
+
+        out = StringIO()
+        call_command('profiles', '--endpoint', 'core:list', stdout=out)
+        self.assertIn('No profiles stored', out.getvalue())
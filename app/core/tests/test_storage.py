@@ -0,0 +1,168 @@
+"""
+Tests for storage backends of originals and derivatives.
+"""
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from PIL import Image as PILImage
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.cache import get_thumbnail_cache
+from core.models import Image, Plan, Thumbnail
+from core.storage import LocalObjectClient, ObjectStorage
+from core.tests.utils import MediaTestCase, image_bytes
+
+
+IMAGE_URL = reverse('core:image-list')
+
+
+class CountingClient(LocalObjectClient):
+    """LocalObjectClient recording bytes returned by get_object."""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.fetched = 0
+
+    def get_object(self, **kwargs):
+        response = super().get_object(**kwargs)
+        self.fetched += response['ContentLength']
+        return response
+
+
+class ObjectStorageTests(SimpleTestCase):
+    """Test object store backend on the local stand-in client."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.client = CountingClient(self.root)
+        self.storage = ObjectStorage(bucket='test', prefix='media/', client=self.client, read_block_size=4096)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_save_open_delete(self):
+        """Test stored object is read back, listed and deleted."""
+        name = self.storage.save('uploads/a.txt', ContentFile(b'content'))
+
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'test', 'media', 'uploads', 'a.txt')))
+        with self.storage.open(name) as stored_file:
+            self.assertEqual(stored_file.read(), b'content')
+        self.assertEqual(self.storage.size(name), 7)
+        self.assertEqual(self.storage.listdir(''), (['uploads'], []))
+        self.assertEqual(self.storage.listdir('uploads'), ([], ['a.txt']))
+
+        self.storage.delete(name)
+
+        self.assertFalse(self.storage.exists(name))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open(name)
+
+    def test_ranged_reads(self):
+        """Test reading a header fetches one block, not the whole object."""
+        name = self.storage.save('big.bin', ContentFile(bytes(range(256)) * 4096))
+
+        with self.storage.open(name) as stored_file:
+            stored_file.seek(1000)
+            self.assertEqual(stored_file.read(4), bytes([232, 233, 234, 235]))
+
+        self.assertEqual(self.client.fetched, 4096)
+
+    def test_no_local_path(self):
+        """Test object store files can't be handed to the web server."""
+        with self.assertRaises(NotImplementedError):
+            self.storage.path('big.bin')
+
+
+@override_settings(
+    STORAGES={
+        'default': {'BACKEND': 'core.storage.ObjectStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    OBJECT_STORAGE_CLIENT='core.storage.LocalObjectClient',
+    OBJECT_STORAGE_BUCKET='images',
+    IMAGE_DELIVERY_BACKEND='x-accel',
+    THUMBNAIL_PIPELINE='off',
+)
+class ObjectStoreDeliveryTests(MediaTestCase):
+    """Test uploads and downloads with originals in an object store."""
+
+    def setUp(self):
+        super().setUp()
+        self.object_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.object_root)
+        settings_override = override_settings(OBJECT_STORAGE_ROOT=self.object_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.original = image_bytes((1600, 1000), (0, 0, 255))
+
+        plan = Plan.objects.create(name='Basic', original_size=True, expiring_link=False)
+        plan.thumbnails.add(Thumbnail.objects.create(size=200))
+        self.user = get_user_model().objects.create_user(username='Test User', password='testpass123', plan=plan)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        res = self.client.post(
+            IMAGE_URL, {'image': SimpleUploadedFile('photo.jpg', self.original)}, format='multipart',
+        )
+        self.image = Image.objects.get(pk=res.data['id'])
+
+    def test_original_stored_in_bucket(self):
+        """Test uploaded original is written to the object store only."""
+        self.assertTrue(os.path.exists(os.path.join(self.object_root, 'images', self.image.image.name)))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, self.image.image.name)))
+
+    def test_thumbnail_cached_locally(self):
+        """Test thumbnail is rendered from the bucket and cached in the local derivative storage."""
+        url = reverse('core:download', args=[self.image.id, 200, self.token.key])
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        with PILImage.open(BytesIO(res.content)) as thumbnail:
+            self.assertEqual(thumbnail.height, 200)
+        cached_path = get_thumbnail_cache().path(self.image, 200)
+        self.assertTrue(cached_path.startswith(self.media_root))
+
+        res = self.client.get(url)
+
+        # cached thumbnail is local, the web server sends it
+        self.assertIn('X-Accel-Redirect', res)
+
+    def test_original_streamed(self):
+        """Test original in the bucket is streamed instead of redirected to the web server."""
+        res = self.client.get(reverse('core:download-original', args=[self.image.id, self.token.key]))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Accel-Redirect', res)
+        self.assertEqual(b''.join(res.streaming_content), self.original)
+
+    @override_settings(
+        THUMBNAIL_STORAGE='core.storage.ObjectStorage',
+        THUMBNAIL_STORAGE_OPTIONS={'bucket': 'thumbnails'},
+    )
+    def test_thumbnail_cached_in_bucket(self):
+        """Test derivatives may live in another backend than originals."""
+        url = reverse('core:download', args=[self.image.id, 200, self.token.key])
+        self.client.get(url)
+
+        name = get_thumbnail_cache().name(self.image, 200)
+        self.assertTrue(os.path.exists(os.path.join(self.object_root, 'thumbnails', name)))
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Accel-Redirect', res)
+        with PILImage.open(BytesIO(b''.join(res.streaming_content))) as thumbnail:
+            self.assertEqual(thumbnail.height, 200)
@@ -0,0 +1,170 @@
+"""
+Tests for on-the-fly resize specs.
+"""
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from PIL import Image as PILImage
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+
+from core import transforms
+from core.imaging import resize
+from core.models import RenderJob, Thumbnail
+from core.tests.utils import DownloadTestCase
+
+
+class ParseTests(SimpleTestCase):
+    """Test parsing specs into canonical transforms."""
+
+    def test_families(self):
+        """Test every family is parsed with its dimensions."""
+        self.assertEqual(transforms.parse('h300'), transforms.Transform('height', None, 300, 1))
+        self.assertEqual(transforms.parse('w400'), transforms.Transform('width', 400, None, 1))
+        self.assertEqual(transforms.parse('fit400x300'), transforms.Transform('fit', 400, 300, 1))
+        self.assertEqual(transforms.parse('FILL400x300@2x'), transforms.Transform('fill', 400, 300, 2))
+
+    def test_canonical_key(self):
+        """Test specs with the same output share a key."""
+        self.assertEqual(transforms.parse('w400@2x').key, transforms.parse('w800').key)
+        self.assertEqual(transforms.parse('fill0200x100@3x').key, 'fill600x300')
+        # heights share derivatives of fixed thumbnail sizes
+        self.assertEqual(transforms.parse('h100@2x').key, str(200))
+        self.assertEqual(transforms.for_height(200).key, '200')
+
+    def test_invalid(self):
+        """Test malformed and out of bound specs are rejected."""
+        for spec in ['', 'x300', 'w', 'fit400', 'w400@4x', 'w400@1.5x', 'h0', 'w5000', 'fill3000x100@2x', 'w2560@2x']:
+            with self.assertRaises(transforms.TransformError):
+                transforms.parse(spec)
+
+    def test_sizes_outside_list(self):
+        """Test only listed sizes are accepted, so an image has a bounded number of variants."""
+        for spec in ['w401', 'h299', 'fit400x301', 'fill1x1@3x']:
+            with self.assertRaises(transforms.TransformError):
+                transforms.parse(spec)
+
+        with self.settings(TRANSFORM_SIZES=[250]):
+            self.assertEqual(transforms.parse('w250@2x').key, 'w500')
+
+    def test_allowed(self):
+        """Test plan families whitelist transforms and pixel ratios."""
+        families = frozenset(['width', 'fill'])
+
+        self.assertTrue(transforms.allowed(transforms.parse('w400'), families))
+        self.assertFalse(transforms.allowed(transforms.parse('fit400x300'), families))
+        self.assertFalse(transforms.allowed(transforms.parse('w400@2x'), families))
+        self.assertTrue(transforms.allowed(transforms.parse('w400@2x'), families | {'dpr'}))
+
+    def test_validate_families(self):
+        """Test unknown families are rejected in plans."""
+        transforms.validate_families('width, fit,dpr')
+        with self.assertRaises(ValidationError):
+            transforms.validate_families('width,crop')
+
+
+class GeometryTests(SimpleTestCase):
+    """Test output size and source box of transforms."""
+
+    def test_width_and_fit(self):
+        """Test width and fit keep the aspect ratio."""
+        self.assertEqual(transforms.geometry(transforms.parse('w400'), 1600, 1000)[0], (400, 250))
+        self.assertEqual(transforms.geometry(transforms.parse('fit400x400'), 1600, 1000)[0], (400, 250))
+        self.assertEqual(transforms.geometry(transforms.parse('fit400x100'), 1600, 1000)[0], (160, 100))
+
+    def test_fill_crops_centre(self):
+        """Test fill crops the source to the output aspect ratio."""
+        size, box = transforms.geometry(transforms.parse('fill100x100'), 1600, 1000)
+
+        self.assertEqual(size, (100, 100))
+        self.assertEqual(box, (300, 0, 1300, 1000))
+
+    def test_resize(self):
+        """Test decoded image has the output size of the transform."""
+        source = BytesIO()
+        PILImage.new('RGB', (1600, 1000)).save(source, format='JPEG')
+
+        for spec, size in [('h100@2x', (320, 200)), ('fill300x100', (300, 100)), ('fit300x300', (300, 188))]:
+            source.seek(0)
+            self.assertEqual(resize(source, transforms.parse(spec)).size, size)
+
+
+@override_settings(THUMBNAIL_PIPELINE='off')
+class TransformViewTests(DownloadTestCase):
+    """Test downloads of on-the-fly resized variants."""
+
+    plan_options = {
+        'name': 'Responsive', 'original_size': False, 'expiring_link': False, 'transform_families': 'width,fill,dpr',
+    }
+    thumbnail_sizes = []
+
+    def _url(self, spec):
+        return reverse('core:download-transform', args=[self.image.id, spec, self.token.key])
+
+    def test_fill(self):
+        """Test whitelisted transform is rendered with its output size."""
+        res = self.client.get(self._url('fill200x200'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('fill200x200', res['Content-Disposition'])
+        with PILImage.open(BytesIO(res.content)) as thumbnail:
+            self.assertEqual(thumbnail.size, (200, 200))
+
+    def test_pixel_ratio_shares_cache(self):
+        """Test w400@2x is served from the derivative cached for w800."""
+        rendered = self.client.get(self._url('w800')).content
+
+        with patch('core.imaging.PILImage.open') as patched_open:
+            res = self.client.get(self._url('w400@2x'))
+            cached = b''.join(res.streaming_content)
+
+            patched_open.assert_not_called()
+        self.assertEqual(cached, rendered)
+
+    def test_family_not_whitelisted(self):
+        """Test transforms outside plan families are refused."""
+        res = self.client.get(self._url('fit200x200'))
+
+        self.assertEqual(res.content, f'error: {status.HTTP_401_UNAUTHORIZED} unauthorized'.encode())
+
+    def test_invalid_spec(self):
+        """Test malformed spec is a bad request."""
+        res = self.client.get(self._url('w400@9x'))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(THUMBNAIL_PIPELINE='queue')
+    def test_height_of_plan_thumbnail_queued(self):
+        """Test height of a plan thumbnail is left to render_worker and served at the thumbnail quality."""
+        self.plan.transform_families = 'height'
+        self.plan.save()
+        self.plan.thumbnails.add(Thumbnail.objects.create(size=200, quality=60))
+
+        res = self.client.get(self._url('h200'))
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+
+        call_command('render_worker', '--once', '--sync', stdout=StringIO())
+        with patch('core.imaging.PILImage.open') as patched_open:
+            res = self.client.get(self._url('h200'))
+            b''.join(res.streaming_content)
+
+            patched_open.assert_not_called()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(THUMBNAIL_PIPELINE='queue')
+    def test_height_outside_plan_rendered(self):
+        """Test heights without a plan thumbnail are rendered by the request, not queued."""
+        self.plan.transform_families = 'height'
+        self.plan.save()
+
+        res = self.client.get(self._url('h300'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(RenderJob.objects.exists())
+        with PILImage.open(BytesIO(res.content)) as thumbnail:
+            self.assertEqual(thumbnail.size, (480, 300))
@@ -0,0 +1,146 @@
+"""
+Tests for streamed image upload validation.
+"""
+import hashlib
+import os
+from io import BytesIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from PIL import Image as PILImage
+
+from django import forms
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from core.imaging import can_encode
+from core.models import Image, Plan
+from core.tests.utils import MediaTestCase, image_bytes
+from core.uploads import ImageUploadHandler
+
+
+IMAGE_URL = reverse('core:image-list')
+
+
+class ImageUploadHandlerTests(TestCase):
+    """Test upload handler directly."""
+
+    def setUp(self):
+        self.plan = Plan.objects.create(name='Basic', original_size=False, expiring_link=False)
+        request = RequestFactory().post(IMAGE_URL)
+        request.user = get_user_model().objects.create_user(
+            username='Test User', password='testpass123', plan=self.plan,
+        )
+        self.request = request
+
+    def _stream(self, data, chunk_size=1024):
+        handler = ImageUploadHandler(self.request)
+        handler.new_file('image', 'test.jpg', 'image/jpeg', len(data))
+        for start in range(0, len(data), chunk_size):
+            handler.receive_data_chunk(data[start:start + chunk_size], start)
+        return handler.file_complete(len(data))
+
+    def test_streamed_file_has_header_info_and_hash(self):
+        """Test completed upload carries format, size and content hash."""
+        data = image_bytes((120, 80))
+
+        uploaded = self._stream(data)
+
+        self.assertEqual(uploaded.image_format, 'JPEG')
+        self.assertEqual(uploaded.image_size, (120, 80))
+        self.assertEqual(uploaded.sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(uploaded.read(), data)
+
+    def test_webp_header_read_from_prefix(self):
+        """Test WebP size is read from the RIFF header of a file larger than the header buffer."""
+        # lossless bitstream header of a 3000x2000 image
+        bits = (3000 - 1) | (2000 - 1) << 14
+        data = b'RIFF\0\0\0\0WEBPVP8L\0\0\0\0\x2f' + bits.to_bytes(4, 'little') + bytes(600 * 1024)
+
+        uploaded = self._stream(data, chunk_size=64 * 1024)
+
+        self.assertEqual(uploaded.image_format, 'WEBP')
+        self.assertEqual(uploaded.image_size, (3000, 2000))
+
+    def test_rejects_before_body_finishes(self):
+        """Test oversized dimensions are rejected on the first chunk."""
+        self.plan.max_upload_pixels = 100
+        self.plan.save()
+        data = image_bytes((100, 100))
+        handler = ImageUploadHandler(self.request)
+        handler.new_file('image', 'test.jpg', 'image/jpeg', len(data))
+
+        with self.assertRaises(ValidationError):
+            handler.receive_data_chunk(data[:1024], 0)
+
+    def test_plan_byte_limit(self):
+        """Test plan byte limit overrides the default."""
+        data = image_bytes((100, 100))
+        self.plan.max_upload_bytes = len(data) - 1
+        self.plan.save()
+
+        with self.assertRaises(ValidationError):
+            self._stream(data)
+
+
+class UploadAPITests(MediaTestCase):
+    """Test uploading images through the API."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username='Test User', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _upload(self, data, name='test.jpg'):
+        return self.client.post(IMAGE_URL, {'image': SimpleUploadedFile(name, data)}, format='multipart')
+
+    def test_upload_not_read_again(self):
+        """Test streamed image is not verified by reading it a second time."""
+        with patch.object(forms.ImageField, 'to_python') as patched_to_python:
+            res = self._upload(image_bytes((100, 100)))
+
+            patched_to_python.assert_not_called()
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Image.objects.filter(owner=self.user).exists())
+
+    @skipUnless(can_encode('WEBP'), 'Pillow built without WebP')
+    def test_upload_webp_larger_than_header_buffer(self):
+        """Test WebP image over 512 KB is accepted."""
+        noise = PILImage.frombytes('RGB', (600, 600), os.urandom(600 * 600 * 3))
+        buffer = BytesIO()
+        noise.save(buffer, format='WEBP', lossless=True)
+        self.assertGreater(len(buffer.getvalue()), 512 * 1024)
+
+        res = self._upload(buffer.getvalue(), name='test.webp')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Image.objects.get().image_format, 'WEBP')
+
+    def test_upload_unsupported_format(self):
+        """Test image in a format outside of allowed list is rejected."""
+        res = self._upload(image_bytes(image_format='BMP'), name='test.bmp')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Unsupported image format', res.data['image'][0])
+
+    def test_upload_not_an_image(self):
+        """Test file which is not an image is rejected."""
+        res = self._upload(b'not an image' * 100)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Image.objects.exists())
+
+    @override_settings(UPLOAD_MAX_PIXELS=1000)
+    def test_upload_too_many_pixels(self):
+        """Test decompression bomb sized image is rejected."""
+        res = self._upload(image_bytes((100, 100), image_format='PNG'), name='test.png')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('pixels', res.data['image'][0])
@@ -0,0 +1,58 @@
+"""
+Fixtures shared by the core tests.
+"""
+import shutil
+import tempfile
+from io import BytesIO
+
+from PIL import Image as PILImage
+
+from django.core.files import File
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+
+from rest_framework.authtoken.models import Token
+
+from core.models import Image, Plan, Thumbnail
+
+
+def image_bytes(size=(300, 200), color=(0, 0, 0), image_format='JPEG'):
+    """Return encoded image of a solid color."""
+    buffer = BytesIO()
+    PILImage.new('RGB', size, color).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def create_image(owner, size=(1600, 1000), color=(0, 0, 0), name='test.jpg', **fields):
+    """Create and return an image stored in MEDIA_ROOT."""
+    image = Image(owner=owner, **fields)
+    image.image.save(name, File(BytesIO(image_bytes(size, color))))
+    return image
+
+
+class MediaTestCase(TestCase):
+    """Test case storing files in a temporary MEDIA_ROOT."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class DownloadTestCase(MediaTestCase):
+    """Test case with a user of a plan, their token and an uploaded image."""
+
+    plan_options = {'name': 'Basic', 'original_size': False, 'expiring_link': False}
+    thumbnail_sizes = [200]
+    image_size = (1600, 1000)
+
+    def setUp(self):
+        super().setUp()
+        self.plan = Plan.objects.create(**self.plan_options)
+        for size in self.thumbnail_sizes:
+            self.plan.thumbnails.add(Thumbnail.objects.create(size=size))
+        self.user = get_user_model().objects.create_user(username='Test User', password='testpass123', plan=self.plan)
+        self.token = Token.objects.create(user=self.user)
+        self.image = create_image(self.user, self.image_size)
@@ -0,0 +1,143 @@
+"""
+On-the-fly resize specs parsed from download URLs.
+
+A spec names a transform family with its dimensions and an optional device
+pixel ratio: h300 (height), w400 (width), fit400x300 (fit into a box),
+fill400x300 (crop to fill a box), each optionally suffixed with @2x or @3x.
+Specs are normalized to a canonical key of output pixels, so w400@2x and
+w800 share one cached derivative, and h200 shares the one of the 200px
+thumbnail when the plan has that size. Dimensions are limited to the
+TRANSFORM_SIZES list, which bounds the number of variants of an image.
+"""
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+
+FAMILIES = ('height', 'width', 'fit', 'fill')
+# plans list 'dpr' next to families to allow @2x and @3x variants
+PLAN_FAMILIES = FAMILIES + ('dpr',)
+DPRS = (1, 2, 3)
+
+SPEC_RE = re.compile(
+    r'^(?:(?P<side>[hw])(?P<size>\d+)|(?P<box>fit|fill)(?P<width>\d+)x(?P<height>\d+))'
+    r'(?:@(?P<dpr>\d)x)?$'
+)
+
+
+class TransformError(ValueError):
+    """Spec is malformed or out of bounds."""
+
+
+class Transform(namedtuple('Transform', ['family', 'width', 'height', 'dpr'])):
+    """Resize requested in CSS pixels, width or height is None when derived from aspect ratio."""
+
+    __slots__ = ()
+
+    @property
+    def pixel_width(self):
+        return None if self.width is None else self.width * self.dpr
+
+    @property
+    def pixel_height(self):
+        return None if self.height is None else self.height * self.dpr
+
+    @property
+    def key(self):
+        """Return canonical key of the output, a plain number for height."""
+        if self.family == 'height':
+            return str(self.pixel_height)
+        if self.family == 'width':
+            return f'w{self.pixel_width}'
+        return f'{self.family}{self.pixel_width}x{self.pixel_height}'
+
+    @property
+    def label(self):
+        """Return description of the output used in download filenames."""
+        if self.family == 'height':
+            return f'height-{self.pixel_height}px'
+        return self.key
+
+
+def for_height(height):
+    """Return transform of a fixed thumbnail height."""
+    return Transform('height', None, height, 1)
+
+
+def coerce(variant):
+    """Return Transform of a variant given as Transform or fixed thumbnail height."""
+    return variant if isinstance(variant, Transform) else for_height(variant)
+
+
+def parse(spec):
+    """Return Transform of a URL spec, raise TransformError when it is invalid."""
+    match = SPEC_RE.match(spec.lower())
+    if match is None:
+        raise TransformError(f'Invalid transform "{spec}", use e.g. h300, w400, fit400x300, fill400x300@2x.')
+
+    dpr = int(match['dpr'] or 1)
+    if dpr not in DPRS:
+        raise TransformError(f'Pixel ratio must be one of {", ".join(f"{ratio}x" for ratio in DPRS)}.')
+
+    if match['side'] == 'h':
+        transform = Transform('height', None, int(match['size']), dpr)
+    elif match['side'] == 'w':
+        transform = Transform('width', int(match['size']), None, dpr)
+    else:
+        transform = Transform(match['box'], int(match['width']), int(match['height']), dpr)
+
+    sizes = [side for side in (transform.width, transform.height) if side is not None]
+    if any(size not in settings.TRANSFORM_SIZES for size in sizes):
+        raise TransformError(f'Sizes must be one of {", ".join(map(str, settings.TRANSFORM_SIZES))}px.')
+    dimensions = [side for side in (transform.pixel_width, transform.pixel_height) if side is not None]
+    if min(dimensions) < 1 or max(dimensions) > settings.TRANSFORM_MAX_DIMENSION:
+        raise TransformError(f'Output dimensions must be between 1 and {settings.TRANSFORM_MAX_DIMENSION}px.')
+    return transform
+
+
+def allowed(transform, families):
+    """Return True when plan families whitelist the transform."""
+    return transform.family in families and (transform.dpr == 1 or 'dpr' in families)
+
+
+def geometry(transform, width, height):
+    """Return (output size, source box) of a transform applied to an image of given size."""
+    box = (0, 0, width, height)
+    if transform.family == 'height':
+        out_height = transform.pixel_height
+        return (max(int(out_height * (width / height)), 1), out_height), box
+    if transform.family == 'width':
+        out_width = transform.pixel_width
+        return (out_width, max(int(out_width * (height / width)), 1)), box
+
+    out_width, out_height = transform.pixel_width, transform.pixel_height
+    if transform.family == 'fit':
+        scale = min(out_width / width, out_height / height)
+        return (max(round(width * scale), 1), max(round(height * scale), 1)), box
+
+    # fill: crop the centre of the source to the output aspect ratio
+    if width * out_height > height * out_width:
+        crop_width = height * out_width / out_height
+        left = (width - crop_width) / 2
+        box = (left, 0, left + crop_width, height)
+    else:
+        crop_height = width * out_height / out_width
+        top = (height - crop_height) / 2
+        box = (0, top, width, top + crop_height)
+    return (out_width, out_height), box
+
+
+def parse_families(value):
+    """Return frozenset of families listed comma separated in Plan.transform_families."""
+    return frozenset(family.strip() for family in value.split(',') if family.strip())
+
+
+def validate_families(value):
+    """Validate Plan.transform_families lists known families only."""
+    unknown = parse_families(value) - set(PLAN_FAMILIES)
+    if unknown:
+        raise ValidationError(
+            f'Unknown transform families: {", ".join(sorted(unknown))}. Use {", ".join(PLAN_FAMILIES)}.'
+        )
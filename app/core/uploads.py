@@ -0,0 +1,184 @@
+"""
+Upload handler validating images while they are streamed to disk.
+"""
+import hashlib
+import io
+import warnings
+
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+
+from rest_framework.exceptions import ValidationError
+
+from PIL import Image as PILImage
+
+
+# image header has to be recognized within this many leading bytes
+HEADER_MAX_BYTES = 512 * 1024
+
+INVALID_IMAGE = 'Upload a valid image. The file you uploaded was either not an image or a corrupted image.'
+
+
+def upload_limits(user):
+    """Return (max bytes, max pixels) of an upload for user's plan."""
+    plan = getattr(user, 'plan', None)
+    max_bytes = getattr(plan, 'max_upload_bytes', None) or settings.UPLOAD_MAX_BYTES
+    max_pixels = getattr(plan, 'max_upload_pixels', None) or settings.UPLOAD_MAX_PIXELS
+    return max_bytes, max_pixels
+
+
+def check_image(image_format, image_size, max_pixels):
+    """Return error message for an image outside of the limits, None if it is fine."""
+    if image_format not in settings.UPLOAD_IMAGE_FORMATS:
+        return f'Unsupported image format {image_format}.'
+    if image_size[0] * image_size[1] > max_pixels:
+        return f'Image has more than {max_pixels} pixels.'
+    return None
+
+
+def webp_size(header):
+    """Return (width, height) read from the RIFF header of a WebP image."""
+    chunk, data = header[12:16], header[20:30]
+    if len(data) < 10:
+        raise ValueError('WebP header is not complete.')
+    if chunk == b'VP8X':
+        # extended format, 24 bit canvas width - 1 and height - 1
+        return int.from_bytes(header[24:27], 'little') + 1, int.from_bytes(header[27:30], 'little') + 1
+    if chunk == b'VP8 ' and data[3:6] == b'\x9d\x01\x2a':
+        # lossy key frame, 14 bit width and height after the start code
+        return int.from_bytes(data[6:8], 'little') & 0x3fff, int.from_bytes(data[8:10], 'little') & 0x3fff
+    if chunk == b'VP8L' and data[0] == 0x2f:
+        # lossless, 14 bit width - 1 and height - 1 after the signature
+        bits = int.from_bytes(data[1:5], 'little')
+        return (bits & 0x3fff) + 1, (bits >> 14 & 0x3fff) + 1
+    raise ValueError('Not a WebP header.')
+
+
+def open_header(data):
+    """Return (format, size) read from image header in a file or bytes."""
+    if isinstance(data, bytes) and data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        # Pillow needs the whole file to open a WebP image, a streamed prefix is parsed here
+        return 'WEBP', webp_size(data)
+    with warnings.catch_warnings():
+        # pixel count is checked by check_image against plan limit
+        warnings.simplefilter('ignore', PILImage.DecompressionBombWarning)
+        with PILImage.open(io.BytesIO(data) if isinstance(data, bytes) else data) as image:
+            return image.format, image.size
+
+
+def image_metadata(file):
+    """Return Image fields describing an uploaded file, its header is read unless checked while streaming."""
+    image_format, image_size = getattr(file, 'image_format', None), getattr(file, 'image_size', None)
+    if image_format is None:
+        file.seek(0)
+        image_format, image_size = open_header(file)
+    return {'width': image_size[0], 'height': image_size[1], 'image_format': image_format, 'file_size': file.size}
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Stream uploaded image to a temporary file, rejecting it as early as possible.
+
+    Format and dimensions are read from the header in the first chunks, so
+    unsupported or oversized images are refused before the body is received.
+    Content is hashed while streaming. Completed files carry image_format,
+    image_size and sha256 attributes, so they don't need to be read again.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_bytes, self.max_pixels = upload_limits(getattr(request, 'user', None))
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.header = b''
+        self.image_format = None
+        self.image_size = None
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_bytes:
+            self._reject(f'Image is larger than {self.max_bytes} bytes.')
+
+        if self.image_format is None:
+            self._read_header(raw_data)
+
+        self.sha256.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.image_format is None:
+            self._reject(INVALID_IMAGE)
+
+        file = super().file_complete(file_size)
+        file.image_format = self.image_format
+        file.image_size = self.image_size
+        file.sha256 = self.sha256.hexdigest()
+        return file
+
+    def _read_header(self, raw_data):
+        self.header += raw_data
+        try:
+            image_format, image_size = open_header(self.header)
+        except PILImage.DecompressionBombError:
+            self._reject(f'Image has more than {self.max_pixels} pixels.')
+        except Exception:
+            if len(self.header) >= HEADER_MAX_BYTES:
+                self._reject(INVALID_IMAGE)
+            # header is not complete yet
+            return
+
+        error = check_image(image_format, image_size, self.max_pixels)
+        if error is not None:
+            self._reject(error)
+
+        self.image_format, self.image_size = image_format, image_size
+        self.header = b''
+
+    def _reject(self, message):
+        self.upload_interrupted()
+        raise ValidationError({'image': [message]})
+
+
+class BulkUploadHandler(ImageUploadHandler):
+    """
+    Image upload handler of batch uploads.
+
+    Rejected files are skipped and collected in rejected instead of failing
+    the request. Files of the archive field are zip/tar archives, they are
+    stored as they are and checked when unpacked.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.rejected = []
+        self.file_count = 0
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.archive = field_name == 'archive'
+        self.file_count += 1
+        if self.file_count > settings.BULK_UPLOAD_MAX_FILES:
+            self._reject(f'More than {settings.BULK_UPLOAD_MAX_FILES} files in one request.')
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.archive:
+            return super().receive_data_chunk(raw_data, start)
+
+        if start + len(raw_data) > settings.BULK_UPLOAD_MAX_BYTES:
+            self._reject(f'Archive is larger than {settings.BULK_UPLOAD_MAX_BYTES} bytes.')
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.archive:
+            return TemporaryFileUploadHandler.file_complete(self, file_size)
+        if self.image_format is None:
+            self.upload_interrupted()
+            self.rejected.append({'image': self.file_name, 'errors': [INVALID_IMAGE]})
+            return None
+        return super().file_complete(file_size)
+
+    def _reject(self, message):
+        self.upload_interrupted()
+        self.rejected.append({'image': self.file_name, 'errors': [message]})
+        raise SkipFile()
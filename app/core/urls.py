@@ -1,11 +1,12 @@
 """
 URL mappings for the core app.
 """
+from django.conf import settings
 from django.urls import path, include
 
 from rest_framework.routers import DefaultRouter
 
-from core import views
+from core import async_views, views
 
 
 router = DefaultRouter()
@@ -14,6 +15,9 @@ router = DefaultRouter()
 router.register('image', views.ImageViewSet)
 # router.register('list', views.ImageList)
 
+# downloads are served by async views under ASGI
+download_views = async_views if settings.ASYNC_DOWNLOADS else views
+
 app_name = 'core'
 urlpatterns = [
     path('', include(router.urls)),
@@ -22,7 +26,18 @@ urlpatterns = [
     path('images-list/', views.ImageList.as_view(), name='list'),
     path(
         'download/<int:image_id>/<int:size>/<str:token>',
-        views.thumbnailView,
+        download_views.thumbnailView,
         name='download'
-    )
+    ),
+    path(
+        'download/<int:image_id>/t/<str:spec>/<str:token>',
+        download_views.transformView,
+        name='download-transform'
+    ),
+    path(
+        'download/<int:image_id>/original/<str:token>',
+        download_views.originalView,
+        name='download-original'
+    ),
+    path('link/<str:signed>', download_views.expiringLinkView, name='expiring-link'),
 ]
@@ -2,26 +2,33 @@
 Views for the Image APIs.
 """
 from rest_framework import viewsets
-from rest_framework.views import APIView
+from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework import status
 from rest_framework.generics import RetrieveAPIView
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.authtoken.models import Token
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.settings import api_settings
+from rest_framework.exceptions import ValidationError
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.core import signing
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.urls import reverse
+from django.utils.crypto import constant_time_compare
 from django.shortcuts import get_object_or_404
 
-from PIL import Image as PILImage
+import json
 import os
-import io
 
-from core.models import Image
-from core import serializers
+from core.models import IMAGE_LISTING_FIELDS, Image, Derivative
+from core.cache import get_thumbnail_cache
+from core.pagination import ImageCursorPagination
+from core.pipeline import open_original, render_stored, store_variant, thumbnail_qualities
+from core.uploads import BulkUploadHandler, ImageUploadHandler
+from core import access, bulk, coalesce, delivery, jobs, links, metrics, profiling, serializers, transforms
 
 
 class ImageViewSet(viewsets.ModelViewSet):
@@ -39,6 +46,49 @@ class ImageViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    def initial(self, request, *args, **kwargs):
+        """Validate uploads while streaming, once user and plan are known."""
+        super().initial(request, *args, **kwargs)
+        if self.action == 'create':
+            request._request.upload_handlers = [ImageUploadHandler(request._request)]
+        elif self.action == 'bulk':
+            self.upload_handler = BulkUploadHandler(request._request)
+            request._request.upload_handlers = [self.upload_handler]
+
+    @action(detail=False, methods=['post'], serializer_class=serializers.BulkImageSerializer)
+    def bulk(self, request):
+        """Upload many images as multipart files and/or a zip/tar archive."""
+        serializer = self.get_serializer(data=request.data)
+        # files rejected while streaming are reported per item below
+        if not serializer.is_valid() and not self.upload_handler.rejected:
+            raise ValidationError(serializer.errors)
+
+        archive = serializer.validated_data.get('archive')
+        results = bulk.ingest(
+            request.user,
+            serializer.validated_data.get('images', []),
+            [archive] if archive else [],
+            self.upload_handler.rejected,
+        )
+
+        created = sum('id' in result for result in results)
+        if created == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({'created': created, 'results': results}, status=response_status)
+
+    @action(detail=False, methods=['post'], url_path='bulk-delete', serializer_class=serializers.BulkDeleteSerializer)
+    def bulk_delete(self, request):
+        """Delete images listed by ids or matching a filter."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        deleted = bulk.delete(serializer.filter_queryset(self.get_queryset()))
+        return Response({'deleted': deleted})
+
 
 class CreateTokenView(ObtainAuthToken):
     """Create a new auth token for user."""
@@ -61,59 +111,282 @@ class ImageList(APIView):
     """View for listing user images and links"""
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = ImageCursorPagination
+
+    def _link_templates(self, plan, sizes, token):
+        """Return download link templates of the plan, keyed by list label."""
+        host = self.request.get_host()
+        templates = {}
+        for size in sizes:
+            # reverse once per size with a placeholder id, filled in per image
+            url = reverse('core:download', args=[0, size, token])
+            templates[f'thumbnail of height {size}px:'] = host + url.replace(f'/0/{size}/', f'/{{image_id}}/{size}/', 1)
+
+        if plan.original_size:
+            url = reverse('core:download-original', args=[0, token])
+            templates['original image'] = host + url.replace('/0/original/', '/{image_id}/original/', 1)
+
+        if plan.expiring_link:
+            url = reverse('core:expiring-link', args=['signed'])
+            templates['expiring link'] = host + url.replace('signed', '{signed}')
+        return templates
+
+    def _transform_template(self, plan, token):
+        """Return link template of width transforms, None when the plan doesn't allow them."""
+        if 'width' not in transforms.parse_families(plan.transform_families):
+            return None
+        url = reverse('core:download-transform', args=[0, 'spec', token])
+        return self.request.get_host() + url.replace('/0/t/spec/', '/{image_id}/t/{spec}/', 1)
+
+    def _variants(self, image, plan, sizes, link_templates, transform_template):
+        """Return downloadable variants of an image by width, sized from stored metadata only."""
+        width, height = image['width'], image['height']
+        if not width or not height:
+            # uploaded before metadata was stored
+            return []
+
+        image_id = image['id']
+        variants = {}
+        for size in sizes:
+            (variant_width, _), _ = transforms.geometry(transforms.for_height(size), width, height)
+            url = link_templates[f'thumbnail of height {size}px:'].format(image_id=image_id)
+            variants.setdefault(variant_width, {'url': url, 'width': variant_width, 'height': size})
+
+        if transform_template is not None:
+            for variant_width in settings.SRCSET_WIDTHS:
+                if variant_width >= width or variant_width > settings.TRANSFORM_MAX_DIMENSION:
+                    break
+                if variant_width not in settings.TRANSFORM_SIZES:
+                    continue
+                transform = transforms.Transform('width', variant_width, None, 1)
+                (_, variant_height), _ = transforms.geometry(transform, width, height)
+                url = transform_template.format(image_id=image_id, spec=transform.key)
+                variants.setdefault(variant_width, {'url': url, 'width': variant_width, 'height': variant_height})
+
+        if plan.original_size:
+            url = link_templates['original image'].format(image_id=image_id)
+            variants.setdefault(width, {'url': url, 'width': width, 'height': height})
+
+        return [variants[variant_width] for variant_width in sorted(variants)]
+
+    def _expires_in(self):
+        """Return requested lifetime of expiring links in seconds."""
+        value = self.request.query_params.get('expires_in', settings.EXPIRING_LINK_DEFAULT_SECONDS)
+        minimum, maximum = settings.EXPIRING_LINK_MIN_SECONDS, settings.EXPIRING_LINK_MAX_SECONDS
+        try:
+            expires_in = int(value)
+        except (TypeError, ValueError):
+            expires_in = None
+        if expires_in is None or not minimum <= expires_in <= maximum:
+            raise ValidationError({'expires_in': f'Must be a number of seconds between {minimum} and {maximum}.'})
+        return expires_in
+
+    def _build_entries(self, images, plan, sizes, link_templates, transform_template, expires_in):
+        """Return list entries of image rows with id and image name."""
+        statuses = {}
+        derivatives = Derivative.objects.filter(
+            image_id__in=[image['id'] for image in images],
+        ).values_list('image_id', 'size', 'status')
+        for image_id, size, derivative_status in derivatives:
+            statuses.setdefault(image_id, {})[size] = derivative_status
+
+        # expiring links grant the original only to plans allowing it, the largest thumbnail otherwise
+        link_variant = 'original' if plan.original_size else (sizes[-1] if sizes else None)
+
+        entries = []
+        for image in images:
+            image_id = image['id']
+            entry = {
+                'id': image_id,
+                'image': image['filename'] or os.path.basename(image['image']),
+                'width': image['width'],
+                'height': image['height'],
+                'format': image['image_format'],
+                'bytes': image['file_size'],
+            }
+
+            for label, template in link_templates.items():
+                if label != 'expiring link':
+                    entry[label] = template.format(image_id=image_id)
+
+            image_statuses = statuses.get(image_id, {})
+            entry['thumbnail status'] = {
+                size: image_statuses.get(size, Derivative.PENDING) for size in sizes
+            }
+
+            variants = self._variants(image, plan, sizes, link_templates, transform_template)
+            entry['variants'] = variants
+            entry['srcset'] = ', '.join(f'{variant["url"]} {variant["width"]}w' for variant in variants)
 
-    def _generate_thumbnail_links(self, list_of_thumbnails, token, image_id):
-        links = {}
-        for t in list_of_thumbnails:
-            host = self.request.get_host()
-            url = reverse('core:download', args=[image_id, t.size, token])
-            links[f'thumbnail of height {t.size}px:'] = host + url
-        return links
+            if plan.expiring_link and link_variant is not None:
+                signed = links.sign(image_id, link_variant, expires_in)
+                entry['expiring link'] = link_templates['expiring link'].format(signed=signed)
+
+            entries.append(entry)
+        return entries
+
+    def _stream_entries(self, images, *args):
+        """Yield all list entries as NDJSON lines, reading images in chunks."""
+        chunk_size = settings.IMAGE_LIST_STREAM_CHUNK_SIZE
+        chunk = []
+        for image in images.order_by('id').iterator(chunk_size=chunk_size):
+            chunk.append(image)
+            if len(chunk) == chunk_size:
+                yield ''.join(json.dumps(entry) + '\n' for entry in self._build_entries(chunk, *args))
+                chunk = []
+        if chunk:
+            yield ''.join(json.dumps(entry) + '\n' for entry in self._build_entries(chunk, *args))
 
     def get(self, request, format=None):
         token = self.request.auth.key
         plan = request.user.plan
-        plan_ser = serializers.PlanSerializer(plan)
+        profiling.tag(plan_id=plan.pk)
+
+        sizes = list(plan.thumbnails.order_by('size').values_list('size', flat=True))
+        link_templates = self._link_templates(plan, sizes, token)
+        transform_template = self._transform_template(plan, token)
+        images = Image.objects.filter(owner=request.user).values('id', *IMAGE_LISTING_FIELDS)
+        expires_in = self._expires_in() if plan.expiring_link else None
+
+        if request.query_params.get('stream') == 'ndjson':
+            return StreamingHttpResponse(
+                self._stream_entries(images, plan, sizes, link_templates, transform_template, expires_in),
+                content_type='application/x-ndjson',
+            )
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(images, request, view=self)
+        return paginator.get_paginated_response(
+            self._build_entries(page, plan, sizes, link_templates, transform_template, expires_in),
+        )
+
+
+def _thumbnail_response(request, image, variant):
+    """Return thumbnail of an authorized image download."""
+    return delivery.vary_on_accept(_negotiated_thumbnail(request, image, variant))
+
+
+def _negotiated_thumbnail(request, image, variant):
+    image_format = delivery.negotiate_format(request)
+    transform, quality = variant.transform, variant.quality
+    key = transform.key
+
+    # answer revalidation before any file is opened
+    etag, last_modified = delivery.thumbnail_validators(image, variant, image_format)
+    response = delivery.not_modified(request, etag, last_modified, variant.max_age)
+    if response is not None:
+        return response
+
+    cache = get_thumbnail_cache()
+    cached_file = cache.open(image, key, image_format, quality)
+    metrics.add('cache_hits' if cached_file is not None else 'cache_misses')
+    content_type, filename = delivery.thumbnail_file(image, variant, image_format)
+
+    if cached_file is not None:
+        # deliver cached thumbnail, Pillow is not touched at all
+        response = delivery.file_response(cached_file, content_type, filename)
+    else:
+        if delivery.queued(variant):
+            # leave rendering to render_worker, web workers stay free
+            jobs.enqueue(image, [transform.pixel_height])
+            return delivery.render_pending()
 
-        images = Image.objects.filter(owner=request.user)
-        serializer = serializers.ImageListSerializer(images, many=True)
+        # concurrent requests for this thumbnail wait for one render
+        with coalesce.single_flight(coalesce.render_key(image, key)):
+            cached_file = cache.open(image, key, image_format, quality)
+            if cached_file is None:
+                data = render_stored(image.image.name, transform, [image_format], quality)[image_format]
+                store_variant(image, transform, {image_format: data}, quality, variant.derivative)
+            else:
+                metrics.increment('thumbnail_renders_collapsed')
 
-        thumbnails = plan.thumbnails.all().order_by('size')
+        if cached_file is not None:
+            response = delivery.file_response(cached_file, content_type, filename)
+        else:
+            response = delivery.data_response(data, content_type, filename)
 
-        for image in serializer.data:
-            image.update(self._generate_thumbnail_links(thumbnails, token, image['id']))
+    return delivery.add_caching_headers(response, etag, last_modified, variant.max_age)
 
-            if plan_ser.data['original_size']:
-                image['original image'] = self.request.get_host() + image['image']
 
-            if plan_ser.data['expiring_link']:
-                image['expiring link'] = 'TO DO'
+def _original_response(request, image, max_age):
+    """Return original of an authorized image download."""
+    etag, last_modified = delivery.validators(image, 'original')
+    response = delivery.not_modified(request, etag, last_modified, max_age)
+    if response is not None:
+        return response
 
-            image['image'] = os.path.basename(image['image'])
-        return Response(serializer.data)
+    content_type, filename = delivery.original_file(image)
+    response = delivery.file_response(open_original(image.image.name), content_type, filename)
+
+    return delivery.add_caching_headers(response, etag, last_modified, max_age)
+
+
+def _authorize(image_id, token):
+    """Return (image, grant) of a download, raise Http404 for an unknown image or token."""
+    image = get_object_or_404(Image.objects.select_related('blob'), pk=image_id)
+    grant = access.resolve_token(token)
+    if grant is None:
+        raise Http404('No Token matches the given query.')
+    profiling.tag(image_width=image.width, image_height=image.height, plan_id=grant.plan_id)
+    return image, grant
 
 
 def thumbnailView(request, image_id, size, token):
-    image = get_object_or_404(Image, pk=image_id)
-    user = get_object_or_404(Token, key=token).user
-    allowed_thumbnails = [t.size for t in user.plan.thumbnails.all()]
+    image, grant = _authorize(image_id, token)
+
+    variant = delivery.thumbnail_variant(image, grant, size)
+    if variant is None:
+        return delivery.unauthorized()
+    return _thumbnail_response(request, image, variant)
+
+
+def transformView(request, image_id, spec, token):
+    image, grant = _authorize(image_id, token)
+
+    try:
+        transform = transforms.parse(spec)
+    except transforms.TransformError as exc:
+        return delivery.invalid_transform(exc)
+
+    variant = delivery.transform_variant(image, grant, transform)
+    if variant is None:
+        return delivery.unauthorized()
+    return _thumbnail_response(request, image, variant)
+
+
+def originalView(request, image_id, token):
+    image, grant = _authorize(image_id, token)
+
+    if not delivery.original_allowed(image, grant):
+        return delivery.unauthorized()
+    return _original_response(request, image, grant.cache_max_age)
+
 
-    if image.owner == user and size in allowed_thumbnails:
-        with PILImage.open(image.image.path) as original_image:
-            # calculate new width
-            aspect_ration = original_image.width / original_image.height
-            new_width = int(size * aspect_ration)
+def expiringLinkView(request, signed):
+    try:
+        image_id, variant, expires = links.verify(signed)
+    except signing.BadSignature:
+        raise Http404('Invalid link.')
+    except links.LinkExpired:
+        return delivery.link_expired()
 
-            # prepare new buffer
-            buffer = io.BytesIO()
+    # the signature is the authorization, no token or plan lookup needed
+    image = get_object_or_404(Image.objects.select_related('blob'), pk=image_id)
 
-            # convert and resize image
-            thumbnail = original_image.resize((new_width, size), PILImage.ANTIALIAS)
-            thumbnail.convert('RGB').save(buffer, 'JPEG')
+    if variant == 'original':
+        return _original_response(request, image, delivery.link_max_age(expires))
+    quality = thumbnail_qualities([variant])[variant]
+    return _thumbnail_response(request, image, delivery.link_variant(variant, quality, expires))
 
-            # create and set up a response
-            response = HttpResponse(buffer.getvalue(), content_type='image/jpeg')
-            response['Content-Disposition'] = f'attachment; filename="thumbnail-{image_id}-height-{size}px.jpg"'
 
-            return response
-    return HttpResponse(f'error: {status.HTTP_401_UNAUTHORIZED} unauthorized')
+def metricsView(request):
+    if not settings.METRICS_ENABLED:
+        raise Http404('Metrics are disabled.')
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if settings.METRICS_TOKEN and not constant_time_compare(authorization, f'Bearer {settings.METRICS_TOKEN}'):
+        response = HttpResponse(
+            f'error: {status.HTTP_401_UNAUTHORIZED} unauthorized', status=status.HTTP_401_UNAUTHORIZED,
+        )
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
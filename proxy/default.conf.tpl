@@ -1,8 +1,40 @@
 server {
     listen ${LISTEN_PORT};
 
-    location /static {
-        alias /vol/static;
+    # collected static files only, media and other app data in the volume are not public
+    location /static/static/ {
+        alias /vol/static/static/;
+    }
+
+    # images authorized by the app via X-Accel-Redirect
+    location /protected-media/ {
+        internal;
+        alias /vol/static/media/;
+        # the redirect drops the app's Vary and validators, put them back;
+        # revalidation was answered by the app already
+        etag                    off;
+        if_modified_since       off;
+        add_header              Vary $upstream_http_vary always;
+        add_header              ETag $upstream_http_etag always;
+        add_header              Last-Modified $upstream_http_last_modified always;
+    }
+
+    location = /metrics {
+        # scrapers on the internal network only
+        allow                   127.0.0.1;
+        allow                   10.0.0.0/8;
+        allow                   172.16.0.0/12;
+        allow                   192.168.0.0/16;
+        deny                    all;
+        uwsgi_pass              ${APP_HOST}:${APP_PORT};
+        include                 /etc/nginx/uwsgi_params;
+    }
+
+    # batch uploads of many files or an archive, checked by the app
+    location /api/image/bulk/ {
+        uwsgi_pass              ${APP_HOST}:${APP_PORT};
+        include                 /etc/nginx/uwsgi_params;
+        client_max_body_size    ${BULK_UPLOAD_MAX_BODY_SIZE};
     }
 
     location / {
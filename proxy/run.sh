@@ -2,5 +2,11 @@
 
 set -e
 
-envsubst < /etc/nginx/default.conf.tpl > /etc/nginx/conf.d/default.conf
+if [ "$APP_SERVER" = "asgi" ]; then
+    TEMPLATE=/etc/nginx/asgi.conf.tpl
+else
+    TEMPLATE=/etc/nginx/default.conf.tpl
+fi
+
+envsubst '${LISTEN_PORT} ${APP_HOST} ${APP_PORT} ${BULK_UPLOAD_MAX_BODY_SIZE}' < "$TEMPLATE" > /etc/nginx/conf.d/default.conf
 nginx -g 'daemon off;'
@@ -2,9 +2,19 @@
 
 set -e
 
-python manage.py wait_for_db
+APP_WORKERS=${APP_WORKERS:-4}
+APP_THREADS=${APP_THREADS:-4}
+
+# the database must admit the persistent connections of every worker thread
+python manage.py wait_for_db --connections $((APP_WORKERS * APP_THREADS))
 python manage.py collectstatic --noinput
 python manage.py migrate
 python manage.py create_default_plans
 
-uwsgi --socket :9000 --workers 4 --master --enable-threads --module app.wsgi
+if [ "$APP_SERVER" = "asgi" ]; then
+    # async downloads, pair with APP_SERVER=asgi in the proxy; persistent
+    # connections are not reused across async requests, close them
+    ASYNC_DOWNLOADS=1 DB_CONN_MAX_AGE=0 exec uvicorn app.asgi:application --host 0.0.0.0 --port 9000 --workers "$APP_WORKERS"
+fi
+
+uwsgi --socket :9000 --workers "$APP_WORKERS" --threads "$APP_THREADS" --master --enable-threads --module app.wsgi